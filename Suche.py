@@ -1,16 +1,33 @@
 import streamlit as st
-import requests
-from itertools import pairwise
 
-from utils.db_management import _db_manager
+from utils.search import SEARCH_BACKEND_URL, FACET_FIELDS, SearchError, SearchPage, get_search_client
 
 DEFAULT_CHAT_PLACEHOLDER = "Ihre Suchanfrage"
+# Beschriftung der Filter in der Seitenleiste
+FILTER_LABELS = {"Dateiname": "Dateien", "section": "Abschnitte"}
 
 
-# will start server on import; that is needed because streamlit
-# reruns the whole file on every interaction,
-# and we don't want the server to be started upon that
-from server import BASE_URL
+if not SEARCH_BACKEND_URL:
+    # will start server on import; that is needed because streamlit
+    # reruns the whole file on every interaction,
+    # and we don't want the server to be started upon that.
+    # The page itself searches in-process, the server is for external clients
+    import server
+
+
+@st.cache_resource
+def search_client():
+    # one client per process, so the remote client keeps its connection pool
+    return get_search_client()
+
+
+def has_data() -> bool:
+    # aus den Statistiken im Speicher (lokal oder über /stats), ohne die Collection zu zählen
+    try:
+        return search_client().stats()["chunks"] > 0
+    except SearchError:
+        # das Backend ist nicht erreichbar: die Suche zeigt den Fehler an
+        return True
 
 
 def init_page() -> None:
@@ -18,10 +35,18 @@ def init_page() -> None:
         page_title="Suche",
         initial_sidebar_state="expanded",
     )
-    if "docs" not in st.session_state:
-        st.session_state.docs = None
-    if "query_set" not in st.session_state:
-        st.session_state.query_set = None
+    if "query" not in st.session_state:
+        st.session_state.query = None
+    if "page" not in st.session_state:
+        st.session_state.page = None
+    if "page_key" not in st.session_state:
+        st.session_state.page_key = None
+    if "page_number" not in st.session_state:
+        st.session_state.page_number = 0
+    if "facets" not in st.session_state:
+        st.session_state.facets = None
+    if "facets_key" not in st.session_state:
+        st.session_state.facets_key = None
     if "chat_placeholder" not in st.session_state:
         st.session_state.chat_placeholder = "Ihre Suchanfrage"
 
@@ -35,9 +60,70 @@ def make_title() -> None:
 
 
 def reset(chat_placeholder: str=DEFAULT_CHAT_PLACEHOLDER) -> None:
-    st.session_state.docs = None
-    st.session_state.query_set = False
+    st.session_state.page = None
+    st.session_state.page_key = None
+    st.session_state.page_number = 0
     st.session_state.chat_placeholder = chat_placeholder
+    # eine neue Anfrage beginnt ohne Filter
+    for field in FACET_FIELDS:
+        st.session_state[f"filter_{field}"] = []
+
+
+def first_page() -> None:
+    # nach dem Ändern der Seitengröße wieder bei der ersten Seite beginnen
+    st.session_state.page_number = 0
+
+
+def fetch_facets(query: str) -> dict:
+    # die Facetten der ungefilterten Suche bieten die Werte der Filter an;
+    # abgerufen wird dafür nur ein Ergebnis, gezählt wird im Backend über alle
+    if st.session_state.facets_key != query:
+        st.session_state.facets = search_client().search_page(query, offset=0, limit=1).facets
+        st.session_state.facets_key = query
+    return st.session_state.facets
+
+
+def fetch_page(query: str, page_number: int, page_size: int, filters: dict) -> SearchPage:
+    """
+    Ruft nur die Ergebnisse der aktiven Seite ab (inkl. Texte). Solange
+    sich Anfrage, Filter, Seite und Seitengröße nicht ändern, wird die
+    Seite bei weiteren Reruns von Streamlit aus dem Session State gelesen.
+    """
+    key = (query, tuple((field, tuple(values)) for field, values in filters.items()), page_number, page_size)
+    if st.session_state.page_key != key:
+        st.session_state.page = search_client().search_page(
+            query,
+            offset=page_number * page_size,
+            limit=page_size,
+            filters=filters
+        )
+        st.session_state.page_key = key
+    return st.session_state.page
+
+
+def show_filters(query: str) -> dict:
+    """
+    Zeigt in der Seitenleiste die Filter nach Datei und Abschnitt, jeweils
+    mit der Anzahl der Ergebnisse pro Wert, und gibt die gewählten zurück.
+    """
+    facets = fetch_facets(query)
+    filters = {}
+    with st.sidebar:
+        st.header("Filter")
+        for field in FACET_FIELDS:
+            counts = facets.get(field, {})
+            key = f"filter_{field}"
+            # gewählte Werte bleiben wählbar, auch wenn sie ungefiltert nicht vorkommen
+            options = list(counts) + [v for v in st.session_state.get(key, []) if v not in counts]
+            if values := st.multiselect(
+                FILTER_LABELS.get(field, field),
+                options,
+                format_func=lambda v, counts=counts: f"{v} ({counts.get(v, 0)})",
+                key=key,
+                on_change=first_page
+            ):
+                filters[field] = values
+    return filters
 
 
 def show_search_area():
@@ -45,74 +131,66 @@ def show_search_area():
     init_page()
     make_title()
 
-    if len(_db_manager):
+    if has_data():
 
         search_bar = st.container(border=False)
         if query := search_bar.chat_input(  # wenn der Nutzer eine Anfrage eingibt
             placeholder=st.session_state.chat_placeholder,
             on_submit=reset,
             # args=(query, )  # make the query the new placeholder
-        ) or st.session_state.query_set:    # oder wenn es schon eine gibt
-
-            # es wird gecheckt ob es schon relevante Chunks gefunden wurden
-            if not st.session_state.docs:
-
-                # wenn nicht, dann werden sie mit dem Pipeline abgerufen (siehe utils/pipeline.py)
-                response = requests.get(f"{BASE_URL}/get", params={"query": query})
-                if response.status_code == 200:
-                    docs = response.json()
-                    # die gefundenen Chunks speichern
-                    st.session_state.docs = docs
-                    st.session_state.query_set = True
-                    # st.session_state.chat_placeholder = query
-
-                else:
-                    st.error(
-                        response.json() + "\n\nWenden Sie sich bitte an "
-                        "die zuständigen Entwickler."
-                    )
-
-            else:
-                # die gefundenen Chunks einlesen
-                docs = st.session_state.docs
-                
+        ):
+            st.session_state.query = query
+
+        if query := st.session_state.query:    # oder wenn es schon eine gibt
+
+            n_docs_col, n_show_col_txt, n_show_col = st.columns(
+                [7, 2, 2],
+                vertical_alignment="center"
+            )
+            n_show_col_txt.markdown("Vorschläge pro Seite")
+            n = n_show_col.selectbox(
+                "Vorschläge pro Seite",
+                (5, 10, 20),
+                label_visibility="collapsed",
+                on_change=first_page
+            )
+
+            # nur die aktive Seite wird abgerufen (siehe utils/pipeline.py)
+            try:
+                filters = show_filters(query)
+                page = fetch_page(query, st.session_state.page_number, n, filters)
+            except SearchError as e:
+                st.error(
+                    f"{e}\n\nWenden Sie sich bitte an "
+                    "die zuständigen Entwickler."
+                )
+                return
 
-            # wenn die Chunks abgerufen / eingelesen wurden, werden sie gezeigt
-            if n_docs := len(docs):
+            # wenn die Chunks abgerufen wurden, werden sie gezeigt
+            if n_docs := page.total:
 
-                n_docs_col, n_show_col_txt, n_show_col = st.columns(
-                    [7, 2, 2],
-                    vertical_alignment="center"
-                )
                 n_docs_col.markdown(f"**{n_docs}** Ergebnisse gefunden.")
-                n_show_col_txt.markdown("Vorschläge pro Seite")
-                n = n_show_col.selectbox(
-                    "Vorschläge pro Seite",
-                    (5, 10, 20),
-                    label_visibility="collapsed"
-                )
+                n_pages = -(-n_docs // n)
+                if n_pages > 1:
+                    # Seitenauswahl; ein Wechsel löst einen Rerun aus, der die neue Seite abruft
+                    st.radio(
+                        "Seite",
+                        range(n_pages),
+                        format_func=lambda i: f"Seite {i + 1}",
+                        horizontal=True,
+                        label_visibility="collapsed",
+                        key="page_number"
+                    )
 
-                boundaries = list(range(0, n_docs, n)) + [n_docs]
-                ranges = list(pairwise(boundaries))
-                range_descs = [f"Seite {i + 1}" for i in range(len(ranges))]
-                tabs = st.tabs(range_descs) # Seiten mit Ergebnissen
-                for i, tab in enumerate(tabs):
-                    with tab:
-                        start, end = ranges[i]
-                        for j in range(start, end):
-                            doc = docs[j]
-                            # für jeden Chunk gibt es eine Beschreibung aus den Metadaten
-                            descr = f"**{j + 1}**. " + ", ".join(f"**{k}**: __{v}__" for k, v in doc["metadata"].items())
-                            with st.expander(descr, expanded=True):
-                                # der formatierte Text
-                                st.markdown(doc["text"])
+                for j, doc in enumerate(page.results, start=page.offset):
+                    # für jeden Chunk gibt es eine Beschreibung aus den Metadaten
+                    descr = f"**{j + 1}**. " + ", ".join(f"**{k}**: __{v}__" for k, v in doc.metadata.items())
+                    with st.expander(descr, expanded=True):
+                        # der formatierte Text
+                        st.markdown(doc.text)
 
             else:
-                st.error(
-                    f"Fehler ({response.status_code}):\n\n"
-                    f"{response.text}\n\n"
-                    "Wenden Sie sich bitte an die zuständigen Entwickler."
-                )
+                st.info("Zu Ihrer Suchanfrage wurden keine passenden Textbausteine gefunden.")
 
     else:
 
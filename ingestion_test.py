@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+import argparse
+import os
+import shutil
+
+# Eigene Test-Collection mit lokalen Embeddings; muss vor dem Import von
+# utils.db_management gesetzt sein, das die Collection beim Import öffnet.
+os.environ["DB_PATH"] = "ingestion_test"
+os.environ["COLLECTION_NAME"] = "ingestion_test"
+os.environ["EMBEDDING_BACKEND"] = "hashed"
+
+# Importiere den DBManager aus dem Modul.
+from utils.db_management import _db_manager
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Lässt das Schreiben in Chroma beim Hochladen einer PDF fehlschlagen und prüft, "
+                    "dass add_pdf den Fehler meldet, nichts übernimmt und der nächste Versuch gelingt."
+    )
+    parser.add_argument("pdf_path", help="Pfad zur PDF-Datei, die hochgeladen werden soll.")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.pdf_path):
+        print(f"Die Datei {args.pdf_path} wurde nicht gefunden.")
+        exit(1)
+
+    db = _db_manager
+    failures = []
+    collection = db.vector_store._collection
+    upsert = collection.upsert
+
+    def failing_upsert(*args, **kwargs):
+        raise RuntimeError("Chroma nicht erreichbar")
+
+    try:
+        collection.upsert = failing_upsert
+        try:
+            report = db.add_pdf(args.pdf_path)
+            failures.append(f"kein Fehler, sondern {report}")
+        except RuntimeError as e:
+            print(f"Fehler wie erwartet: {e}")
+        finally:
+            collection.upsert = upsert
+        if len(db) or db._file_index.paths():
+            failures.append(f"nach dem Fehler: {len(db)} Chunks, Dateien {db._file_index.paths()}")
+
+        # der zweite Versuch setzt am Checkpoint an
+        report = db.add_pdf(args.pdf_path)
+        print(f"Zweiter Versuch: {report}")
+        if not report.get("added") or len(db) != report["added"]:
+            failures.append(f"zweiter Versuch: {report}, {len(db)} Chunks")
+    finally:
+        shutil.rmtree(db._db_path, ignore_errors=True)
+
+    for failure in failures:
+        print(failure)
+    if failures:
+        exit(1)
+    print("OK")
+
+
+if __name__ == '__main__':
+    main()
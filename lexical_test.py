@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+import argparse
+import tempfile
+import time
+
+# Importiere die lexikalische Suche aus dem Modul.
+from utils.lexical import BM25Index, is_exact_query
+
+# Anfragen, die nur lexikalisch beantwortet werden, und solche, die es nicht werden
+EXACT_QUERIES = ["DIN 1045", "1.3.2.", "EN 206-1", "DIN EN ISO 9001", "18531/1", '"Abdichtung"']
+OTHER_QUERIES = ["Beton", "Abdichtung DIN 18531", "DIN 1045 Beton", "-", ""]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Prüft die Erkennung exakter Anfragen (auch ihre Laufzeit bei langen Zahlenfolgen) "
+                    "und den Mindest-Score der BM25-Suche."
+    )
+    parser.add_argument("--digits", type=int, default=5000, help="Länge der Zahlenfolge ohne Treffer. Standard: 5000")
+    parser.add_argument("--max-seconds", type=float, default=0.1, help="Erlaubte Laufzeit pro Anfrage. Standard: 0.1")
+    args = parser.parse_args()
+
+    failures = []
+    for query in EXACT_QUERIES:
+        if not is_exact_query(query):
+            failures.append(f"nicht als exakt erkannt: {query!r}")
+    for query in OTHER_QUERIES:
+        if is_exact_query(query):
+            failures.append(f"fälschlich als exakt erkannt: {query!r}")
+
+    # lange Zahlenfolgen ohne Treffer: früher exponentielles Backtracking
+    for query in ("1" * args.digits + "x", "DIN " + " ".join(str(18531 + i) for i in range(args.digits // 6)) + " Abdichtung"):
+        start = time.perf_counter()
+        exact = is_exact_query(query)
+        seconds = time.perf_counter() - start
+        print(f"{len(query)} Zeichen: {seconds * 1000:.2f} ms")
+        if exact or seconds > args.max_seconds:
+            failures.append(f"Anfrage mit {len(query)} Zeichen: exakt={exact}, {seconds:.3f} s")
+
+    # Treffer nur über ein häufiges Wort fallen unter den Mindest-Score
+    with tempfile.TemporaryDirectory() as tmp:
+        index = BM25Index(f"{tmp}/lexical.sqlite")
+        index.add({f"doc{i}": f"Beton und Stahl Position {i}" for i in range(200)})
+        index.add({"abdichtung": "Abdichtung der Bodenplatte und Wände"})
+        hits = index.search("Abdichtung und", min_score=1.0)
+        print(f"Treffer mit Mindest-Score: {[doc_id for doc_id, _ in hits]}")
+        if [doc_id for doc_id, _ in hits] != ["abdichtung"]:
+            failures.append(f"Mindest-Score: {hits[:5]}")
+
+    for failure in failures:
+        print(failure)
+    if failures:
+        exit(1)
+    print("OK")
+
+
+if __name__ == '__main__':
+    main()
@@ -11,6 +11,9 @@ def init_page() -> None:
     )
     if "uploader_key" not in st.session_state:
         st.session_state.uploader_key = str(uuid4())
+    if "finished_jobs" not in st.session_state:
+        # Aufträge, die beim letzten Rerun schon abgeschlossen waren
+        st.session_state.finished_jobs = None
 
 
 def make_title() -> None:
@@ -19,13 +22,139 @@ def make_title() -> None:
     
 
 def get_filepaths():
-    return list(_db_manager._file_index.keys())
+    return _db_manager._file_index.paths()
+
+
+def select_all(filepaths) -> None:
+    # "Alle auswählen" setzt die Auswahl jeder Datei
+    for filepath in filepaths:
+        st.session_state[f"select_{filepath}"] = st.session_state.select_all
+
+
+def delete_selected(filepaths) -> None:
+    # alle ausgewählten Dateien in einem Schritt löschen (ein Löschvorgang im Vectorstore)
+    _db_manager.delete_pdfs(filepaths)
+    for filepath in filepaths:
+        st.session_state.pop(f"select_{filepath}", None)
+    st.session_state.select_all = False
 
 
 def update_uploader_key():
     st.session_state.uploader_key = str(uuid4())
 
 
+def format_eta(seconds) -> str:
+    if seconds is None:
+        return "Restzeit wird ermittelt"
+    if seconds < 60:
+        return "noch weniger als 1 Minute"
+    return f"noch ca. {round(seconds / 60)} Minuten"
+
+
+def show_job(job) -> None:
+    name = job["name"]
+    if job["status"] == "queued":
+        st.markdown(f"**{name}**: wartet auf die Verarbeitung")
+    elif job["status"] == "running":
+        if not job["extracted"] and not job["new"]:
+            st.progress(0.0, text=f"**{name}**: Text wird gelesen")
+            return
+        total = job["new"]
+        text = (
+            f"**{name}**: {job['summarized']} zusammengefasst, {job['embedded']} eingebettet, "
+            f"{job['stored']} gespeichert von {total}{'' if job['extracted'] else '+'} neuen Chunks"
+        )
+        if job["extracted"]:
+            text += f" – {format_eta(job['eta'])}"
+        st.progress(job["stored"] / total if total else 0.0, text=text)
+    else:
+        message_col, retry_col, remove_col = st.columns([8, 1, 1], vertical_alignment="center")
+        if job["status"] == "failed":
+            message_col.error(f"**{name}** konnte nicht verarbeitet werden: {job['error']}")
+            retry_col.button(
+                "🔁", key=f"retry_{job['id']}", help="Erneut versuchen",
+                on_click=_db_manager.retry_job, args=(job["id"],)
+            )
+        else:
+            report = job["report"]
+            message_col.success(
+                f"**{name}**: {report['added']} Chunks hinzugefügt, "
+                f"{report['removed']} entfernt, {report['kept']} unverändert"
+            )
+        remove_col.button(
+            "✖️", key=f"remove_{job['id']}", help="Ausblenden",
+            on_click=_db_manager.remove_job, args=(job["id"],)
+        )
+
+
+@st.fragment(run_every=2)
+def show_jobs() -> None:
+    """
+    Zeigt die Aufträge der Hintergrundverarbeitung. Nur dieser Teil der
+    Seite wird alle zwei Sekunden neu geladen; die Verarbeitung selbst läuft
+    unabhängig von der Sitzung weiter, auch wenn die Seite geschlossen wird.
+    """
+    jobs = _db_manager.ingestion_jobs()
+    finished = {job["id"] for job in jobs if job["status"] in ("done", "failed")}
+    previous, st.session_state.finished_jobs = st.session_state.finished_jobs, finished
+    if previous is not None and finished - previous:
+        # eine Datei ist fertig: die ganze Seite neu laden, damit die Liste der Dateien stimmt
+        st.rerun()
+    if not jobs:
+        return
+    st.subheader("Verarbeitung")
+    for job in jobs:
+        show_job(job)
+    if _db_manager.ingestion_stats:
+        with st.expander("Details der Verarbeitung"):
+            # Durchsatz und Warteschlangen je Stufe der Pipeline
+            st.table({
+                stage: {
+                    "Elemente": stats["processed"],
+                    "pro Sekunde": round(stats["items_per_second"], 1),
+                    "aktiv (s)": round(stats["busy_seconds"], 1),
+                    "Warteschlange max.": stats["max_queue_depth"],
+                    "Warteschlange Ø": round(stats["mean_queue_depth"], 1)
+                }
+                for stage, stats in _db_manager.ingestion_stats.items()
+            })
+
+
+def format_bytes(n) -> str:
+    for unit in ("B", "KB", "MB", "GB"):
+        if n < 1024 or unit == "GB":
+            return f"{n:.0f} {unit}" if unit == "B" else f"{n:.1f} {unit}"
+        n /= 1024
+
+
+def show_stats(stats) -> None:
+    # Kennzahlen der Collection (siehe `DBManager.stats`)
+    with st.expander("Statistiken"):
+        chunks_col, summarized_col, tokens_col, disk_col = st.columns(4)
+        chunks_col.metric("Chunks", stats["chunks"])
+        summarized_col.metric(
+            "Zusammengefasst", stats["summarized"],
+            help=f"{stats['passthrough']} Chunks unter 300 Tokens wurden unverändert übernommen"
+        )
+        tokens_col.metric(
+            "Tokens", f"{stats['tokens']:,}".replace(",", "."),
+            help=f"{stats['summary_tokens']:,} Tokens wurden eingebettet".replace(",", ".")
+        )
+        disk_col.metric(
+            "Speicher", format_bytes(stats["disk_bytes"]),
+            help=f"davon Embeddings: {format_bytes(stats['embedding_bytes'])} ({stats['embedding_dimensions']} Dimensionen)"
+        )
+        # Chunks pro Datei und Abschnitt
+        st.table({
+            "Chunks": {path: file_stats["chunks"] for path, file_stats in stats["files"].items()},
+            "Tokens": {path: file_stats["tokens"] for path, file_stats in stats["files"].items()},
+            **{
+                section: {path: file_stats["sections"].get(section, 0) for path, file_stats in stats["files"].items()}
+                for section in stats["sections"]
+            }
+        })
+
+
 def show_data_management_area():
 
     init_page()
@@ -34,20 +163,26 @@ def show_data_management_area():
 	# enlist all the data and add the possibility to modify it
     if (filepaths := get_filepaths()):
         with st.container(border=True):
-            for i, filepath in enumerate(filepaths):
-                filename_col, deletion_col = st.columns([6, 1])
-                filename_col.markdown(f"**{filepath}**")
-                with deletion_col.popover("🗑️"):
-                    st.text("Löschen Datei?")
-                    if st.button("Ja", key=i):
-                        _db_manager.delete_pdf(filepath)
-                        st.rerun()  # update tables und so
-
-    if not len(_db_manager):
+            st.checkbox("Alle auswählen", key="select_all", on_change=select_all, args=(filepaths,))
+            for filepath in filepaths:
+                st.checkbox(f"**{filepath}**", key=f"select_{filepath}")
+            selected = [filepath for filepath in filepaths if st.session_state.get(f"select_{filepath}")]
+            with st.popover(f"🗑️ Ausgewählte löschen ({len(selected)})", disabled=not selected):
+                st.text(f"{len(selected)} Datei(en) löschen?")
+                # Callback: die Seite wird danach ohnehin neu aufgebaut
+                st.button("Ja", key="delete_selected", on_click=delete_selected, args=(selected,))
+
+    # aus dem Speicher, ohne die Collection zu zählen
+    stats = _db_manager.stats()
+    if not stats["chunks"]:
         st.info("Sie haben noch keine Daten hochgeladen.")
                 
     if filepaths:
-        st.markdown(f"Total Chunks: {len(_db_manager)}")
+        st.markdown(f"Total Chunks: {stats['chunks']}")
+        show_stats(stats)
+
+    # Fortschritt und Ergebnisse der Hintergrundverarbeitung
+    show_jobs()
 
     st.subheader("Weitere Daten laden" if filepaths else "Daten laden")
     uploaded_files = st.file_uploader(
@@ -58,10 +193,10 @@ def show_data_management_area():
         key=st.session_state.uploader_key   # every type a new key to clear the state 
     )
     if uploaded_files:
-        with st.spinner("Ihre Daten werden vorbereitet. Es kann wenige Minuten dauern."):
-            for i, uploaded_file in enumerate(uploaded_files):
-                bytes_data = uploaded_file.getvalue()
-                _db_manager.add_pdf(uploaded_file.name, bytes_data)
+        # die Dateien werden nur gespeichert und in die Warteschlange gestellt;
+        # verarbeitet werden sie im Hintergrund, die Seite bleibt bedienbar
+        for uploaded_file in uploaded_files:
+            _db_manager.enqueue_pdf(uploaded_file.name, uploaded_file.getvalue())
         update_uploader_key()
         st.rerun()  # update tables und so
 
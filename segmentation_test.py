@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+import argparse
+import random
+import re
+import time
+
+# Importiere die Segmentierung (Schritte 2-5) aus dem Modul.
+from utils import prepare_data
+from utils.prepare_data import read_and_clean_pdf, segment_sequentially
+
+# Überschriften-Muster vor der Umstellung (Alternative am Anfang)
+ORIGINAL_HEADING_PATTERN = re.compile(
+    r'(?P<level>(\d+\.\d+\.\d+\.|\d+\.\d+\.))\s*(?P<title>[^\n]+)(?:\r?\n)+',
+    re.MULTILINE
+)
+
+WORDS = (
+    "Beton Mauerwerk Estrich Putz Fenster Tür Dach Stahl Holz Dämmung Abdichtung "
+    "Fliesen Wand Decke Boden liefern einbauen herstellen gemäß DIN 1045 Qualität Fuge Kante"
+).split()
+
+
+def make_lv_text(rng: random.Random, n_chapters: int, n_sub: int, n_subsub: int, para_len: int) -> str:
+    """
+    Erzeugt den bereinigten Text eines künstlichen Leistungsverzeichnisses
+    (Inhaltsverzeichnis, Vorbemerkungen, Baubeschreibung, Ausschreibungstext).
+    """
+    def paragraph():
+        return [" ".join(rng.choice(WORDS) for _ in range(12)) for _ in range(para_len)]
+
+    lines = ["Inhaltsverzeichnis"]
+    for c in range(1, n_chapters + 1):
+        lines.append(f"{c}. Gewerk {c} ........ {2 * c + 1}")
+        for s in range(1, n_sub + 1):
+            lines.append(f"{c}.{s}. Titel {c}.{s} ........ {2 * c + 1}")
+    lines.append("Zusammenstellung ........ 99")
+    lines.append("Zusätzliche Vorbemerkungen")
+    for i in range(1, 4):
+        lines.append(f"{i}. " + " ".join(paragraph()[:2]))
+    lines.append("Baubeschreibung")
+    for i in range(1, 4):
+        lines.append(f"1.0{i} Punkt {i}: " + " ".join(paragraph()[:2]))
+    for c in range(1, n_chapters + 1):
+        lines.append(f"{c}. Gewerk {c}")
+        for s in range(1, n_sub + 1):
+            lines.append(f"{c}.{s}. Titel {c}.{s}")
+            lines += paragraph()
+            for ss in range(1, n_subsub + 1):
+                lines.append(f"{c}.{s}.{ss}. Position {c}.{s}.{ss}")
+                lines += paragraph()
+    return "\n".join(lines) + "\n"
+
+
+def segment(text: str, metadata: dict):
+    return segment_sequentially([{'text': text, 'metadata': dict(metadata)}])
+
+
+def original(text: str, metadata: dict):
+    """Die Schritte 2-5 mit dem ursprünglichen Überschriften-Muster."""
+    pattern = prepare_data.SUBCHAPTER_HEADING_PATTERN
+    prepare_data.SUBCHAPTER_HEADING_PATTERN = ORIGINAL_HEADING_PATTERN
+    try:
+        return segment(text, metadata)
+    finally:
+        prepare_data.SUBCHAPTER_HEADING_PATTERN = pattern
+
+
+def best_time(func, repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Vergleicht die Schritte 2-5 mit dem ursprünglichen und dem neuen Überschriften-Muster "
+                    "(Regression) und misst beide."
+    )
+    parser.add_argument("pdf_paths", nargs="*", help="PDF-Dateien, die verglichen werden sollen.")
+    parser.add_argument("--synthetic", type=int, default=20, help="Anzahl künstlicher Dokumente. Standard: 20")
+    parser.add_argument("--chapters", type=int, default=40, help="Kapitel pro künstlichem Dokument. Standard: 40")
+    parser.add_argument("--repeat", type=int, default=3, help="Wiederholungen pro Zeitmessung. Standard: 3")
+    parser.add_argument("--seed", type=int, default=0, help="Startwert des Zufallsgenerators. Standard: 0")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    documents = []
+    for pdf_path in args.pdf_paths:
+        doc = read_and_clean_pdf(pdf_path)[0]
+        documents.append((pdf_path, doc['text'], doc['metadata']))
+    for i in range(args.synthetic):
+        text = make_lv_text(
+            rng,
+            n_chapters=rng.randint(1, args.chapters),
+            n_sub=rng.randint(0, 6),
+            n_subsub=rng.randint(0, 4),
+            para_len=rng.randint(0, 12)
+        )
+        documents.append((f"synthetisch_{i}", text, {'Dateiname': f"synthetisch_{i}.pdf"}))
+
+    mismatches = 0
+    total_original = 0.0
+    total_segmented = 0.0
+    for name, text, metadata in documents:
+        expected = original(text, metadata)
+        chunks = segment(text, metadata)
+        if chunks != expected:
+            mismatches += 1
+            print(f"ABWEICHUNG in {name}: {len(chunks)} statt {len(expected)} Chunks")
+
+        t_original = best_time(lambda: original(text, metadata), args.repeat)
+        t_segmented = best_time(lambda: segment(text, metadata), args.repeat)
+        total_original += t_original
+        total_segmented += t_segmented
+        if args.pdf_paths and name in args.pdf_paths:
+            print(
+                f"{name}: {len(text) / 1024:.0f} KB, {len(chunks)} Chunks, "
+                f"ursprüngliches Muster {t_original * 1000:.1f} ms, neues Muster {t_segmented * 1000:.1f} ms"
+            )
+
+    print(f"{len(documents)} Dokumente verglichen, {mismatches} Abweichungen.")
+    print(
+        f"Gesamt: ursprüngliches Muster {total_original * 1000:.1f} ms, neues Muster {total_segmented * 1000:.1f} ms "
+        f"(Faktor {total_original / max(total_segmented, 1e-9):.1f})"
+    )
+    if mismatches:
+        exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,38 +1,183 @@
-from flask import Flask, request
+import os
+import json
+import asyncio
 import threading
-from waitress import serve
+import uvicorn
+from starlette.applications import Starlette
+from starlette.responses import Response, StreamingResponse
+from starlette.routing import Route
 
 from utils.pipeline import pipeline
+from utils.db_management import _db_manager
+from utils.caching import ResponseCache, normalize_query
+from utils.search import FILTER_FIELDS, normalize_filters
 
-app = Flask(__name__)
 HOST = "127.0.0.1"
 PORT = 5000
 BASE_URL = f"http://{HOST}:{PORT}"
+# upper bound for the serialized /get responses kept in memory
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", 64 * 1024 ** 2))
+
+# upper bound for the number of queries in one /batch request
+BATCH_MAX_QUERIES = int(os.getenv("BATCH_MAX_QUERIES", 500))
+
+# a hit skips both the search and the JSON encoding
+response_cache = ResponseCache(RESPONSE_CACHE_MAX_BYTES)
+
+
+class SingleFlight:
+	"""
+	Concurrent calls with the same key share one computation: the first
+	caller starts it, everyone arriving before it is done awaits the result.
+	"""
+
+	def __init__(self):
+		self._in_flight = {}
+		self.calls = 0
+		self.coalesced = 0
+
+	async def do(self, key, func):
+		self.calls += 1
+		task = self._in_flight.get(key)
+		if task is None:
+			task = asyncio.ensure_future(func())
+			self._in_flight[key] = task
+			task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+		else:
+			self.coalesced += 1
+		# a client that disconnects must not cancel the others' computation
+		return await asyncio.shield(task)
+
+
+single_flight = SingleFlight()
+
+
+def text_response(body, status_code):
+	# same content type as the responses of the former Flask server
+	return Response(body, status_code=status_code, media_type="text/html")
+
 
 # this app only listens to input queries and returns the results
-@app.route("/get", methods=["GET"])
-def get_relevant_docs():
+async def get_relevant_docs(request):
 	# main.py ensures we have a query
-	query = request.args.get("query")
-	# will return up to 100 relevant docs
+	query = request.query_params.get("query")
+	# with offset and/or limit, only that page is returned, together with the
+	# total number of results; without them, all results as before
+	data = {"input": query}
+	# filters are repeated params, e.g. ?Dateiname=a.pdf&Dateiname=b.pdf&section=...
+	filters = {
+		field: request.query_params.getlist(field)
+		for field in FILTER_FIELDS if field in request.query_params
+	}
+	if filters:
+		data["filters"] = filters
+	try:
+		for param in ("offset", "limit"):
+			if (value := request.query_params.get(param)) is not None:
+				data[param] = int(value)
+	except ValueError as e:
+		return text_response(str(e), 400)
+	# read before the search: results that are computed while the collection
+	# changes are stored under the old generation and not served again
+	generation = _db_manager.generation
+	key = (
+		(
+			_db_manager._collection_name, normalize_query(query), normalize_filters(filters),
+			data.get("offset"), data.get("limit")
+		)
+		if query is not None else None
+	)
+	if key is not None and (body := response_cache.get(key, generation)) is not None:
+		return text_response(body, 200)
+
+	async def search():
+		# will return up to 100 relevant docs
+		body = (await pipeline.ainvoke(data)).encode("utf-8")
+		if key is not None:
+			response_cache.put(key, generation, body)
+		return body
+
 	try:
-		res = pipeline.invoke({"input": query})
-		return res, 200
+		if key is None:
+			body = await search()
+		else:
+			body = await single_flight.do((generation, key), search)
 	except Exception as e:
-		return str(e), 400
-	
+		return text_response(str(e), 400)
+	return text_response(body, 200)
+
+
+def parse_batch(body):
+	# accepts plain strings as well as {"query": "...", "filters": {"Dateiname": [...]}}
+	if not isinstance(body, dict) or not isinstance(body.get("queries"), list):
+		raise ValueError('expected a JSON object with a list "queries"')
+	queries = [{"query": q} if isinstance(q, str) else q for q in body["queries"]]
+	if not 0 < len(queries) <= BATCH_MAX_QUERIES:
+		raise ValueError(f"expected 1 to {BATCH_MAX_QUERIES} queries, got {len(queries)}")
+	for q in queries:
+		if not isinstance(q, dict) or not isinstance(q.get("query"), str) or not q["query"].strip():
+			raise ValueError(f"not a query: {q!r}")
+	limit = body.get("limit")
+	if limit is not None and (not isinstance(limit, int) or limit < 1):
+		raise ValueError(f"limit must be an integer >= 1, not {limit!r}")
+	return queries, limit
+
+
+# many queries in one request, e.g. a checklist run against every new tender
+async def search_batch(request):
+	"""
+	Expects {"queries": ["...", {"query": "...", "filters": {...}}, ...], "limit": n}
+	and streams one JSON line per query, {"index": i, "query": "...", "results": [...]},
+	as soon as its results are ready (not necessarily in the order of the queries).
+	All queries that need a vector are embedded with one request.
+	"""
+	try:
+		queries, limit = parse_batch(await request.json())
+		results = pipeline.asearch_batch(queries)
+	except ValueError as e:
+		return text_response(str(e), 400)
+
+	async def lines():
+		try:
+			async for index, hits in results:
+				yield json.dumps({
+					"index": index,
+					"query": queries[index]["query"],
+					"results": [r.to_dict() for r in hits[:limit]]
+				}, ensure_ascii=False) + "\n"
+		except Exception as e:
+			# the status is already sent, so the failure ends the stream as its last line
+			yield json.dumps({"error": str(e)}, ensure_ascii=False) + "\n"
+
+	return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+# chunk counts per file and section, tokens and sizes, from memory (see `DBManager.stats`)
+async def get_stats(request):
+	# `stats` only reads memory, but waits for the lock of a running commit,
+	# so not in the event loop
+	stats = await asyncio.to_thread(_db_manager.stats)
+	return Response(json.dumps(stats, ensure_ascii=False), media_type="application/json")
+
 
 # ping for dev to see if the server is up
-@app.route("/healthcheck", methods=["GET"])
-def healthcheck():
-	return "ok", 200
-	
+async def healthcheck(request):
+	return text_response("ok", 200)
+
+
+app = Starlette(routes=[
+	Route("/get", get_relevant_docs, methods=["GET"]),
+	Route("/batch", search_batch, methods=["POST"]),
+	Route("/stats", get_stats, methods=["GET"]),
+	Route("/healthcheck", healthcheck, methods=["GET"])
+])
+
 
 def start_server():
-    serve(app, host=HOST, port=PORT)
+	uvicorn.run(app, host=HOST, port=PORT, log_level="warning")
 
 
 # start the backend so it listens to the incoming queries;
 # it runs in a different thread to prevent blocking
 server_thread = threading.Thread(target=start_server, daemon=True)
-server_thread.start()
\ No newline at end of file
+server_thread.start()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+import argparse
+import random
+import threading
+import time
+
+from langchain_core.messages import AIMessage
+from langchain_core.runnables import RunnableLambda
+
+# Importiere die Zusammenfassungs-Funktion aus dem Modul.
+from utils.prepare_data import SUMMARY_TEMPLATE, make_summaries
+
+
+def make_stand_in_summarizer(latency: float, failure_rate: float):
+    """
+    Lokaler Ersatz für das Chat-Modell: wartet `latency` Sekunden pro Aufruf,
+    schlägt mit Wahrscheinlichkeit `failure_rate` fehl und gibt sonst
+    den Anfang des Prompts als "Zusammenfassung" zurück.
+    """
+    lock = threading.Lock()
+    stats = {"calls": 0, "in_flight": 0, "max_in_flight": 0}
+
+    def fake_llm(prompt_value):
+        with lock:
+            stats["calls"] += 1
+            stats["in_flight"] += 1
+            stats["max_in_flight"] = max(stats["max_in_flight"], stats["in_flight"])
+        try:
+            time.sleep(latency)
+            if random.random() < failure_rate:
+                raise RuntimeError("Künstlicher Fehler des Ersatzmodells")
+            text = prompt_value.to_string().split("TEXT:", 1)[1]
+            return AIMessage(content="Zusammenfassung: " + text.split()[0])
+        finally:
+            with lock:
+                stats["in_flight"] -= 1
+
+    return SUMMARY_TEMPLATE | RunnableLambda(fake_llm), stats
+
+
+def make_docs(n_chunks: int):
+    # jeder Chunk ist lang genug (> 300 Tokens), um zusammengefasst zu werden
+    return [
+        {
+            "text": f"chunk{i} " + "Wort " * 400,
+            "metadata": {"Dateiname": "test.pdf", "section": "Ausschreibungstext"}
+        }
+        for i in range(n_chunks)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Testet make_summaries mit einem lokalen Ersatz-Chat-Modell mit künstlicher Latenz."
+    )
+    parser.add_argument("--chunks", type=int, default=40, help="Anzahl der Chunks. Standard: 40")
+    parser.add_argument("--latency", type=float, default=0.2, help="Latenz pro Aufruf in Sekunden. Standard: 0.2")
+    parser.add_argument("--concurrency", type=int, default=8, help="Maximale gleichzeitige Aufrufe. Standard: 8")
+    parser.add_argument("--failure-rate", type=float, default=0.1, help="Fehlerrate pro Aufruf. Standard: 0.1")
+    args = parser.parse_args()
+
+    summarizer, stats = make_stand_in_summarizer(args.latency, args.failure_rate)
+    docs = make_docs(args.chunks)
+    progress = []
+
+    start = time.perf_counter()
+    docs = make_summaries(
+        docs,
+        summarizer=summarizer,
+        max_concurrency=args.concurrency,
+        max_attempts=10,
+        on_progress=lambda done, total: progress.append((done, total))
+    )
+    elapsed = time.perf_counter() - start
+
+    # Reihenfolge, Fortschritt und Nebenläufigkeit prüfen
+    for i, doc in enumerate(docs):
+        assert doc["summary"] == f"Zusammenfassung: chunk{i}", doc["summary"]
+    assert progress == [(i + 1, args.chunks) for i in range(args.chunks)], progress
+    assert stats["max_in_flight"] <= args.concurrency, stats
+
+    sequential = args.chunks * args.latency
+    print(f"{args.chunks} Chunks in {elapsed:.2f}s zusammengefasst (sequentiell ca. {sequential:.2f}s).")
+    print(f"Aufrufe inkl. Wiederholungen: {stats['calls']}, max. gleichzeitig: {stats['max_in_flight']}")
+
+
+if __name__ == '__main__':
+    main()
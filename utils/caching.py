@@ -0,0 +1,398 @@
+import json
+import asyncio
+import time
+import struct
+import hashlib
+import threading
+import unicodedata
+from array import array
+from collections import OrderedDict
+from typing import Optional, List, Dict
+
+from langchain_core.embeddings import Embeddings
+
+from utils.storage import open_shared_sqlite
+
+
+def content_hash(*parts) -> str:
+	# stable hash over arbitrary JSON-serializable parts
+	payload = json.dumps(parts, ensure_ascii=False, separators=(",", ":"))
+	return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def normalize_query(query) -> str:
+	# the same query typed with other spacing is still the same query
+	return " ".join(unicodedata.normalize("NFC", query).split())
+
+
+class SQLiteCache:
+	"""
+	Persistent key-value cache in a single SQLite file.
+	The total size of the stored values is bounded by `max_bytes`;
+	when it is exceeded, the least recently used entries are evicted.
+	"""
+
+	def __init__(self, path, max_bytes):
+		self._path = path
+		self._max_bytes = max_bytes
+		self._lock = threading.Lock()
+		self._conn = open_shared_sqlite(path)
+		self._conn.execute(
+			"CREATE TABLE IF NOT EXISTS cache ("
+			"key TEXT PRIMARY KEY, value BLOB NOT NULL, "
+			"size INTEGER NOT NULL, last_access REAL NOT NULL)"
+		)
+		self._conn.commit()
+		self._total_bytes = self._conn.execute(
+			"SELECT COALESCE(SUM(size), 0) FROM cache"
+		).fetchone()[0]
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+
+	def get(self, key) -> Optional[bytes]:
+		with self._lock:
+			row = self._conn.execute(
+				"SELECT value FROM cache WHERE key = ?", (key,)
+			).fetchone()
+			if row is None:
+				self.misses += 1
+				return None
+			self.hits += 1
+			self._conn.execute(
+				"UPDATE cache SET last_access = ? WHERE key = ?", (time.time(), key)
+			)
+			self._conn.commit()
+			return row[0]
+
+	def put(self, key, value: bytes):
+		self.put_many({key: value})
+
+	def get_many(self, keys) -> Dict[str, bytes]:
+		# one transaction for the whole batch; returns only the hits
+		keys = list(dict.fromkeys(keys))
+		found = {}
+		with self._lock:
+			for start in range(0, len(keys), 500):
+				batch = keys[start:start + 500]
+				rows = self._conn.execute(
+					f"SELECT key, value FROM cache WHERE key IN ({','.join('?' * len(batch))})",
+					batch
+				).fetchall()
+				found.update(rows)
+			now = time.time()
+			self._conn.executemany(
+				"UPDATE cache SET last_access = ? WHERE key = ?",
+				[(now, key) for key in found]
+			)
+			self._conn.commit()
+		self.hits += len(found)
+		self.misses += len(keys) - len(found)
+		return found
+
+	def put_many(self, items: Dict[str, bytes]):
+		with self._lock:
+			now = time.time()
+			for key, value in items.items():
+				old = self._conn.execute(
+					"SELECT size FROM cache WHERE key = ?", (key,)
+				).fetchone()
+				if old is not None:
+					self._total_bytes -= old[0]
+				self._conn.execute(
+					"INSERT OR REPLACE INTO cache (key, value, size, last_access) VALUES (?, ?, ?, ?)",
+					(key, value, len(value), now)
+				)
+				self._total_bytes += len(value)
+			self._evict()
+			self._conn.commit()
+
+	def _evict(self):
+		# drop the least recently used entries until we are within the budget
+		while self._total_bytes > self._max_bytes:
+			rows = self._conn.execute(
+				"SELECT key, size FROM cache ORDER BY last_access LIMIT 100"
+			).fetchall()
+			if not rows: break
+			for key, size in rows:
+				self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+				self._total_bytes -= size
+				self.evictions += 1
+				if self._total_bytes <= self._max_bytes: break
+
+	def stats(self) -> dict:
+		with self._lock:
+			entries = self._conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+		lookups = self.hits + self.misses
+		return {
+			"entries": entries,
+			"bytes": self._total_bytes,
+			"max_bytes": self._max_bytes,
+			"hits": self.hits,
+			"misses": self.misses,
+			"hit_rate": self.hits / lookups if lookups else 0.0,
+			"evictions": self.evictions
+		}
+
+
+class SummaryCache(SQLiteCache):
+	"""
+	Cache for the LLM summaries of the chunks. The key covers everything
+	the summary depends on: chunk text, metadata string, prompt template
+	and model, so changing the prompt or the model invalidates the entries.
+	"""
+
+	def __init__(self, path, prompt, model_name, max_bytes):
+		super().__init__(path, max_bytes)
+		self._prompt = prompt
+		self._model_name = model_name
+
+	def _key(self, text, metadata_text):
+		return content_hash(text, metadata_text, self._prompt, self._model_name)
+
+	def get_summary(self, text, metadata_text) -> Optional[str]:
+		value = self.get(self._key(text, metadata_text))
+		return value.decode("utf-8") if value is not None else None
+
+	def put_summary(self, text, metadata_text, summary):
+		self.put(self._key(text, metadata_text), summary.encode("utf-8"))
+
+
+class QueryEmbeddingCache:
+	"""
+	In-process LRU cache of query vectors. At most `max_entries` vectors are
+	kept, each for `ttl` seconds. With `path`, the vectors are also written
+	to a `SQLiteCache` there and survive restarts of the app.
+	"""
+
+	def __init__(self, max_entries, ttl, path=None, max_bytes=None):
+		self._max_entries = max_entries
+		self._ttl = ttl
+		self._entries = OrderedDict()	# key -> (created, vector), oldest access first
+		self._lock = threading.Lock()
+		self._store = SQLiteCache(path, max_bytes) if path else None
+		self.hits = 0
+		self.misses = 0
+		self.expirations = 0
+
+	def _remember(self, key, created, vector):
+		with self._lock:
+			self._entries[key] = (created, vector)
+			self._entries.move_to_end(key)
+			while len(self._entries) > self._max_entries:
+				self._entries.popitem(last=False)
+
+	def get(self, key) -> Optional[List[float]]:
+		now = time.time()
+		with self._lock:
+			entry = self._entries.get(key)
+			if entry is not None:
+				if now - entry[0] <= self._ttl:
+					self._entries.move_to_end(key)
+					self.hits += 1
+					return entry[1]
+				del self._entries[key]
+				self.expirations += 1
+		if self._store is not None and (blob := self._store.get(key)) is not None:
+			created = struct.unpack_from("d", blob)[0]
+			if now - created <= self._ttl:
+				vector = array("f", blob[8:]).tolist()
+				self._remember(key, created, vector)
+				with self._lock:
+					self.hits += 1
+				return vector
+		with self._lock:
+			self.misses += 1
+		return None
+
+	def put(self, key, vector: List[float]):
+		created = time.time()
+		self._remember(key, created, vector)
+		if self._store is not None:
+			self._store.put(key, struct.pack("d", created) + array("f", vector).tobytes())
+
+	def stats(self) -> dict:
+		lookups = self.hits + self.misses
+		return {
+			"entries": len(self._entries),
+			"max_entries": self._max_entries,
+			"hits": self.hits,
+			"misses": self.misses,
+			"hit_rate": self.hits / lookups if lookups else 0.0,
+			"expirations": self.expirations
+		}
+
+
+class CachedEmbeddings(Embeddings):
+	"""
+	Wraps an embedding function so that document texts which were already
+	embedded with the same model are served from a persistent cache instead
+	of the network. Vectors are stored compactly as float32 blobs; without
+	a `path` documents are always embedded (local backends are faster than
+	the lookup). Queries go through the optional `query_cache` (see
+	`QueryEmbeddingCache`).
+	"""
+
+	def __init__(self, embeddings: Embeddings, model_name, path, max_bytes, query_cache=None):
+		self._embeddings = embeddings
+		self._model_name = model_name
+		self._cache = SQLiteCache(path, max_bytes) if path else None
+		self.query_cache = query_cache
+		self.saved_bytes = 0	# request payload that did not have to be sent
+
+	def _key(self, text):
+		return content_hash(text, self._model_name)
+
+	def embed_documents(self, texts: List[str]) -> List[List[float]]:
+		if self._cache is None:
+			return self._embeddings.embed_documents(texts)
+		keys = [self._key(text) for text in texts]
+		found = self._cache.get_many(keys)
+		vectors = {
+			key: array("f", blob).tolist()
+			for key, blob in found.items()
+		}
+		# embed every missing text only once, even if it occurs repeatedly
+		missing = {key: text for key, text in zip(keys, texts) if key not in vectors}
+		if missing:
+			new_vectors = self._embeddings.embed_documents(list(missing.values()))
+			new_blobs = {
+				key: array("f", vector).tobytes()
+				for key, vector in zip(missing.keys(), new_vectors)
+			}
+			self._cache.put_many(new_blobs)
+			# same float32 precision whether a vector came from the cache or not
+			vectors.update({
+				key: array("f", blob).tolist()
+				for key, blob in new_blobs.items()
+			})
+		self.saved_bytes += sum(
+			len(text.encode("utf-8"))
+			for key, text in zip(keys, texts) if key in found
+		)
+		return [vectors[key] for key in keys]
+
+	def embed_query(self, text: str) -> List[float]:
+		if self.query_cache is None:
+			return self._embeddings.embed_query(text)
+		query = normalize_query(text)
+		key = content_hash("query", query, self._model_name)
+		vector = self.query_cache.get(key)
+		if vector is None:
+			# same float32 precision as the persisted vectors
+			vector = array("f", self._embeddings.embed_query(query)).tolist()
+			self.query_cache.put(key, vector)
+		return vector
+
+	async def aembed_query(self, text: str) -> List[float]:
+		# awaits the embedding request instead of blocking a thread for it
+		if self.query_cache is None:
+			return await self._embeddings.aembed_query(text)
+		query = normalize_query(text)
+		key = content_hash("query", query, self._model_name)
+		vector = self.query_cache.get(key)
+		if vector is None:
+			vector = array("f", await self._embeddings.aembed_query(query)).tolist()
+			self.query_cache.put(key, vector)
+		return vector
+
+	async def aembed_queries(self, texts: List[str]) -> List[List[float]]:
+		"""
+		Embeds many queries with a single request; queries found in the
+		`query_cache` and repeated queries are not sent.
+		"""
+		queries = [normalize_query(text) for text in texts]
+		keys = {query: content_hash("query", query, self._model_name) for query in queries}
+		vectors = {}
+		if self.query_cache is not None:
+			for query, key in keys.items():
+				if (vector := self.query_cache.get(key)) is not None:
+					vectors[query] = vector
+		missing = [query for query in keys if query not in vectors]
+		if missing:
+			if hasattr(self._embeddings, "embed_queries"):
+				# local backends weight queries differently from documents (see `HashedNgramEmbeddings`)
+				new_vectors = await asyncio.to_thread(self._embeddings.embed_queries, missing)
+			else:
+				# OpenAI embeds a query like a document; all of them in one request
+				new_vectors = await self._embeddings.aembed_documents(missing, chunk_size=len(missing))
+			for query, vector in zip(missing, new_vectors):
+				vectors[query] = array("f", vector).tolist()
+				if self.query_cache is not None:
+					self.query_cache.put(keys[query], vectors[query])
+		return [vectors[query] for query in queries]
+
+	def stats(self) -> dict:
+		if self._cache is None:
+			return {"saved_calls": 0, "saved_bytes": 0, "stored_vectors": 0, "stored_bytes": 0, "hit_rate": 0.0}
+		stats = self._cache.stats()
+		return {
+			"saved_calls": stats["hits"],
+			"saved_bytes": self.saved_bytes,
+			"stored_vectors": stats["entries"],
+			"stored_bytes": stats["bytes"],
+			"hit_rate": stats["hit_rate"]
+		}
+
+
+class ResponseCache:
+	"""
+	In-memory LRU cache of serialized responses, bounded by the total size
+	of the stored bytes. Every entry belongs to a generation of the
+	collection (see `DBManager.generation`): only entries of the current
+	generation are hit, and all older ones are dropped as soon as a
+	response of a newer generation is stored. Values other than bytes can
+	be stored as well when `sizeof` estimates their size.
+	"""
+
+	def __init__(self, max_bytes, sizeof=len):
+		self._max_bytes = max_bytes
+		self._sizeof = sizeof
+		self._entries = OrderedDict()	# key -> (value, size), oldest access first
+		self._generation = None
+		self._total_bytes = 0
+		self._lock = threading.Lock()
+		self.hits = 0
+		self.misses = 0
+
+	def get(self, key, generation):
+		with self._lock:
+			entry = self._entries.get(key) if generation == self._generation else None
+			if entry is None:
+				self.misses += 1
+				return None
+			self._entries.move_to_end(key)
+			self.hits += 1
+			return entry[0]
+
+	def put(self, key, generation, value):
+		size = self._sizeof(value)
+		if size > self._max_bytes:
+			return
+		with self._lock:
+			if self._generation is not None and generation < self._generation:
+				return	# computed before the last change of the collection
+			if generation != self._generation:
+				self._entries.clear()
+				self._total_bytes = 0
+				self._generation = generation
+			old = self._entries.pop(key, None)
+			if old is not None:
+				self._total_bytes -= old[1]
+			self._entries[key] = (value, size)
+			self._total_bytes += size
+			while self._total_bytes > self._max_bytes:
+				_, (_, evicted_size) = self._entries.popitem(last=False)
+				self._total_bytes -= evicted_size
+
+	def stats(self) -> dict:
+		lookups = self.hits + self.misses
+		return {
+			"entries": len(self._entries),
+			"bytes": self._total_bytes,
+			"max_bytes": self._max_bytes,
+			"generation": self._generation,
+			"hits": self.hits,
+			"misses": self.misses,
+			"hit_rate": self.hits / lookups if lookups else 0.0
+		}
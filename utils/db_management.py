@@ -1,43 +1,306 @@
 import os
-import json
-from uuid import uuid4
-from langchain_openai import OpenAIEmbeddings
+import time
+import hashlib
+import shutil
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, List, Optional
+from uuid import uuid4, uuid5, UUID
 from langchain_chroma import Chroma
 from langchain_core.documents import Document
 
-from utils.prepare_data import prepare_data
+from utils.prepare_data import (
+	prepare_data, extract_chunk_list, summarize_chunk, is_passthrough, count_tokens,
+	SUMMARY_PROMPT, SUMMARY_MAX_CONCURRENCY, LLM
+)
+from utils.caching import SummaryCache, CachedEmbeddings, QueryEmbeddingCache, content_hash
+from utils.ingestion import Stage, Pipeline, JobQueue, Checkpoint, call_with_retry
+from utils.lexical import BM25Index
+from utils.embedding import resolve_embedding_config, create_embeddings, HashedNgramEmbeddings
+from utils.vector_index import NumpyVectorIndex
+from utils.file_index import FileIndex
 
 STORAGE_PATH = "/ausschreibungen_storage"
+# upper bound for the persisted LLM summaries
+SUMMARY_CACHE_MAX_BYTES = int(os.getenv("SUMMARY_CACHE_MAX_BYTES", 256 * 1024 ** 2))
+# upper bound for the persisted document embeddings (float32, ~6 KB per vector)
+EMBEDDING_CACHE_MAX_BYTES = int(os.getenv("EMBEDDING_CACHE_MAX_BYTES", 512 * 1024 ** 2))
+# query vectors kept in memory, and for how long (seconds)
+QUERY_CACHE_MAX_ENTRIES = int(os.getenv("QUERY_CACHE_MAX_ENTRIES", 2048))
+QUERY_CACHE_TTL = float(os.getenv("QUERY_CACHE_TTL", 7 * 24 * 3600))
+# also keep the query vectors on disk across restarts
+QUERY_CACHE_PERSIST = os.getenv("QUERY_CACHE_PERSIST", "0") == "1"
+# capacity of the queues between the ingestion stages (in chunks)
+INGESTION_QUEUE_SIZE = int(os.getenv("INGESTION_QUEUE_SIZE", 256))
+# chunks per embedding request (and per vector store write) during ingestion
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", 64))
+# how long a batch waits for more chunks before it is sent (seconds)
+EMBEDDING_BATCH_WAIT = float(os.getenv("EMBEDDING_BATCH_WAIT", 0.2))
+# embedding requests in flight at the same time during ingestion
+EMBEDDING_MAX_CONCURRENCY = int(os.getenv("EMBEDDING_MAX_CONCURRENCY", 4))
+# attempts per batch for the embedding request and the vector store write
+EMBEDDING_MAX_ATTEMPTS = int(os.getenv("EMBEDDING_MAX_ATTEMPTS", 3))
+# read PDFs page by page instead of as one string (see `stream_chunks`)
+STREAMING_EXTRACTION = os.getenv("STREAMING_EXTRACTION", "0") == "1"
+# engine of the vector search: "chroma" (HNSW) or "numpy" (exact search over a
+# memory-mapped matrix, see utils/vector_index.py); Chroma stores the chunks either way
+VECTOR_INDEX = os.getenv("VECTOR_INDEX", "chroma")
+# checkpoints of failed uploads are kept this long for a retry (seconds)
+CHECKPOINT_MAX_AGE = float(os.getenv("CHECKPOINT_MAX_AGE", 7 * 24 * 3600))
+# processes that extract the uploads queued with `enqueue_pdf`
+INGESTION_WORKERS = int(os.getenv("INGESTION_WORKERS", os.cpu_count() or 1))
+# chunks per read and write of the Chroma collection, at most its maximum batch size
+CHROMA_BATCH_SIZE = int(os.getenv("CHROMA_BATCH_SIZE", 1000))
+# namespace of the deterministic chunk ids (uuid5)
+CHUNK_ID_NAMESPACE = UUID("6f1c0a52-8d3e-4b7a-9f21-3c5e7d9a1b40")
 
 
 class DBManager:
 
-	def __init__(self, db_path, collection_name):
+	def __init__(self, db_path, collection_name, embedding_backend=None):
 		self._db_path = os.path.join(STORAGE_PATH, db_path)	# for Docker volume
 		self._collection_name = collection_name
-		# must be enough for a sequence of keywords
-		embeddings = OpenAIEmbeddings(model="text-embedding-3-small")
+		# the former JSON file index, see `_load_file_index`
+		legacy_file_index_path = os.path.join(self._db_path, f"__{collection_name}_metadata.json")
+		# the embedding backend is chosen when the collection is created and stays with it
+		# (EMBEDDING_BACKEND / `embedding_backend`, see utils/embedding.py)
+		self.embedding_config = resolve_embedding_config(
+			os.path.join(self._db_path, f"__{collection_name}_embedding.json"),
+			**({"requested": embedding_backend} if embedding_backend else {}),
+			legacy=os.path.exists(legacy_file_index_path) or os.path.exists(f"{legacy_file_index_path}.migrated")
+		)
+		# repeated queries are not sent to the embedding API again;
+		# a local backend is faster than the cache lookup
+		query_cache = QueryEmbeddingCache(
+			max_entries=QUERY_CACHE_MAX_ENTRIES,
+			ttl=QUERY_CACHE_TTL,
+			path=os.path.join(self._db_path, f"__{collection_name}_queries.sqlite") if QUERY_CACHE_PERSIST else None,
+			# float32 vectors plus the timestamp
+			max_bytes=QUERY_CACHE_MAX_ENTRIES * (self.embedding_config["dimensions"] * 4 + 8)
+		) if self.embedding_config["remote"] else None
+		# one request per batch; retries of the batches are done in `_embed`
+		embeddings = create_embeddings(
+			self.embedding_config,
+			state_path=os.path.join(self._db_path, f"__{collection_name}_embedding_state.npy"),
+			batch_size=EMBEDDING_BATCH_SIZE
+		)
+		# the local backend weights queries by the document frequencies of the collection
+		self._document_frequencies = embeddings if isinstance(embeddings, HashedNgramEmbeddings) else None
+		# re-uploaded summaries are not sent to the embedding API again;
+		# like for the queries, a local backend is faster than the cache lookup
+		self.embeddings = CachedEmbeddings(
+			embeddings,
+			model_name=self.embedding_config["model_name"],
+			path=os.path.join(
+				self._db_path, f"__{collection_name}_embeddings.sqlite"
+			) if self.embedding_config["remote"] else None,
+			max_bytes=EMBEDDING_CACHE_MAX_BYTES,
+			query_cache=query_cache
+		)
 		# init / read
 		self.vector_store = Chroma(
 			collection_name=collection_name,
-			embedding_function=embeddings,
+			embedding_function=self.embeddings,
 			persist_directory=self._db_path
 		)
+		# Chroma rejects more ids per call than its maximum batch size
+		self._chroma_batch_size = min(CHROMA_BATCH_SIZE, self.vector_store._client.get_max_batch_size())
 		# read file index from metadata (if not newly initialized)
-		self._file_index_path = os.path.join(self._db_path, f"__{collection_name}_metadata.json")
-		self._load_file_index()
+		self._load_file_index(legacy_file_index_path)
+		self._backfill_stats()
+		# guards the file index: uploads are committed in the background
+		# while files are deleted from the page
+		self._lock = threading.RLock()
+		# bumped on every change of the collection; versions cached search results
+		self.generation = 0
+		# disk usage of the storage directory and the generation it was measured
+		# at, measured again in the background after every change (see `stats`)
+		self._disk_usage = {}
+		self._disk_usage_generation = None
+		self._disk_worker = None
+		# throughput and queue depths per stage of the last ingestion (see `_ingest`)
+		self.ingestion_stats = {}
+		# summaries survive re-uploads of unchanged chunks
+		self.summary_cache = SummaryCache(
+			os.path.join(self._db_path, f"__{collection_name}_summaries.sqlite"),
+			prompt=SUMMARY_PROMPT,
+			model_name=LLM.model_name,
+			max_bytes=SUMMARY_CACHE_MAX_BYTES
+		)
+		# lexical (BM25) index over the chunk texts, kept in step with the collection
+		self.lexical_index = BM25Index(os.path.join(self._db_path, f"__{collection_name}_lexical.sqlite"))
+		self._sync_lexical_index()
+		# optional exact vector index, also kept in step with the collection
+		self.vector_index = NumpyVectorIndex(
+			os.path.join(self._db_path, f"__{collection_name}_vectors"),
+			dimensions=self.embedding_config["dimensions"]
+		) if VECTOR_INDEX == "numpy" else None
+		self._sync_vector_index()
+		self._sync_document_frequencies()
+		# intermediate results of the uploads, see `Checkpoint`
+		self._checkpoints_path = os.path.join(self._db_path, f"__{collection_name}_checkpoints")
+		self._recover_checkpoints()
+		# uploads waiting for the background ingestion (see `enqueue_pdf`)
+		self._uploads_path = os.path.join(self._db_path, f"__{collection_name}_uploads")
+		self.job_queue = JobQueue(os.path.join(self._db_path, f"__{collection_name}_jobs.sqlite"))
+		self._worker = None
+		self._active_jobs = {}	# job id -> job of `_ingest`, while it is in the pipeline
+		if self.job_queue.has_queued():
+			# resume what was queued or running before a restart
+			self._start_worker()
+		self._update_disk_usage()
 
-	def _load_file_index(self):
-		if not os.path.exists(self._file_index_path):
-			self._file_index = {}
+	def _sync_lexical_index(self):
+		# collections from before the lexical index (or after a crash
+		# between the two writes) are indexed once from the vector store
+		if len(self.lexical_index) == len(self):
 			return
-		else:
-			with open(self._file_index_path) as f:
-				self._file_index = json.load(f)
+		self.lexical_index.clear()
+		for batch in self._iter_collection(include=["metadatas"]):
+			self.lexical_index.add({
+				chunk_id: self._lexical_text(metadata.get("text", ""), metadata)
+				for chunk_id, metadata in zip(batch["ids"], batch["metadatas"])
+			})
+
+	def _sync_vector_index(self):
+		# same as `_sync_lexical_index`, with the vectors stored in Chroma
+		if self.vector_index is None or len(self.vector_index) == len(self):
+			return
+		self.vector_index.clear()
+		for batch in self._iter_collection(include=["embeddings"]):
+			self.vector_index.add(batch["ids"], batch["embeddings"])
+
+	def _sync_document_frequencies(self):
+		# same as `_sync_vector_index` for the document frequencies of the local
+		# backend (collections from before they followed the collection)
+		if self._document_frequencies is None or self._document_frequencies.document_count == len(self):
+			return
+		self._document_frequencies.recount_documents(
+			batch["embeddings"] for batch in self._iter_collection(include=["embeddings"])
+		)
+
+	def _iter_collection(self, include):
+		# the whole collection in batches of `get` results (ids and `include`)
+		for offset in range(0, len(self), self._chroma_batch_size):
+			yield self.vector_store._collection.get(include=include, limit=self._chroma_batch_size, offset=offset)
+
+	def _delete_chunks(self, ids):
+		# from the collection and from every index next to it
+		ids = list(ids)
+		for start in range(0, len(ids), self._chroma_batch_size):
+			batch_ids = ids[start:start + self._chroma_batch_size]
+			if self._document_frequencies is not None:
+				# only what is still stored is counted out
+				stored = self.vector_store._collection.get(ids=batch_ids, include=["embeddings"])
+				self.vector_store.delete(batch_ids)
+				self._document_frequencies.count_documents(stored["embeddings"], sign=-1)
+			else:
+				self.vector_store.delete(batch_ids)
+		self.lexical_index.delete(ids)
+		if self.vector_index is not None:
+			self.vector_index.delete(ids)
+
+	@staticmethod
+	def _lexical_text(text, metadata) -> str:
+		# the metadata (file name, headings, Ordnungszahl) is searchable as well
+		return "\n".join([text] + [str(value) for key, value in metadata.items() if key != "text"])
+
+	def _load_file_index(self, legacy_path):
+		self._file_index = FileIndex(os.path.join(self._db_path, f"__{self._collection_name}_files.sqlite"))
+		# collections from before the SQLite index are migrated once
+		self._file_index.migrate_json(legacy_path)
+
+	@staticmethod
+	def _chunk_stats(chunk: dict) -> tuple:
+		# what the file index keeps per chunk for `stats`
+		return (
+			chunk["metadata"].get("section"),
+			int(not is_passthrough(chunk)),
+			count_tokens(chunk["text"]),
+			count_tokens(chunk["summary"])
+		)
+
+	def _backfill_stats(self):
+		# chunks indexed before the statistics were recorded get them once from the collection
+		missing = self._file_index.missing_stats()
+		if not missing:
+			return
+		# ids that are no longer in the collection are marked with 0 tokens
+		# (section and summary unknown), so they are not looked up on every start
+		chunk_stats = dict.fromkeys(missing, (None, None, 0, 0))
+		for start in range(0, len(missing), self._chroma_batch_size):
+			batch = self.vector_store._collection.get(
+				ids=missing[start:start + self._chroma_batch_size], include=["documents", "metadatas"]
+			)
+			chunk_stats.update({
+				chunk_id: self._chunk_stats({"text": metadata.get("text", ""), "summary": document, "metadata": metadata})
+				for chunk_id, document, metadata in zip(batch["ids"], batch["documents"], batch["metadatas"])
+			})
+		self._file_index.set_chunk_stats(chunk_stats)
+
+	def stats(self) -> dict:
+		"""
+		Statistics of the collection, from memory: chunks per file and
+		section, summarized and passed through chunks and tokens (kept up to
+		date by the file index on every commit, see `CollectionStats`), the
+		size of the raw embeddings and the disk usage of the storage
+		directory as last measured (in the background after every change).
+		"""
+		with self._lock:
+			stats = self._file_index.stats()
+			generation = self.generation
+			disk = self._disk_usage
+		dimensions = self.embedding_config["dimensions"]
+		return {
+			**stats,
+			"generation": generation,
+			"embedding_dimensions": dimensions,
+			"embedding_bytes": stats["chunks"] * dimensions * 4,	# float32
+			"disk_bytes": sum(disk.values()),
+			"disk": disk
+		}
 
-	def _save_file_index(self):
-		with open(self._file_index_path, "w") as f:
-			json.dump(self._file_index, f, indent=4)
+	def _update_disk_usage(self):
+		# measures the disk usage in a background thread; a change during a
+		# measurement is measured again right after it
+		with self._lock:
+			if self._disk_worker is None:
+				self._disk_worker = threading.Thread(target=self._measure_disk_usage_loop, daemon=True)
+				self._disk_worker.start()
+
+	def _measure_disk_usage_loop(self):
+		while True:
+			with self._lock:
+				if self._disk_usage_generation == self.generation:
+					self._disk_worker = None
+					return
+				generation = self.generation
+			disk = self._measure_disk_usage()
+			with self._lock:
+				self._disk_usage = disk
+				self._disk_usage_generation = generation
+
+	def _measure_disk_usage(self) -> dict:
+		# bytes per part of the storage directory: "chroma" and the files
+		# next to it (lexical, vectors, checkpoints, ...) without their prefix
+		prefix = f"__{self._collection_name}_"
+		disk = {}
+		for root, _, filenames in os.walk(self._db_path):
+			relative = os.path.relpath(root, self._db_path)
+			for filename in filenames:
+				name = filename if relative == "." else relative.split(os.sep)[0]
+				if name.startswith(prefix):
+					name = name[len(prefix):].split(".")[0]
+				elif name.startswith("__"):
+					continue	# another collection in the same directory
+				else:
+					name = "chroma"
+				try:
+					disk[name] = disk.get(name, 0) + os.path.getsize(os.path.join(root, filename))
+				except OSError:
+					pass	# removed in the meantime (e.g. a finished checkpoint)
+		return dict(sorted(disk.items()))
 
 	def _chunk2doc(self, chunk: dict) -> Document:
 		return Document(
@@ -53,41 +316,594 @@ class DBManager:
 			for filename in os.listdir(dir_path)
 			if filename.lower().endswith('.pdf')
 		]
-		self.add_pdfs(pdf_paths)
+		return self.add_pdfs(pdf_paths)
+
+	def _chunk_ids(self, pdf_path, chunks):
+		# the id only depends on the file and the chunk contents, so an
+		# unchanged chunk gets the same id on every upload; identical chunks
+		# within one file are told apart by their occurrence
+		occurrences = {}
+		for chunk in chunks:
+			chunk_hash = content_hash(chunk["text"], chunk["metadata"])
+			n = occurrences[chunk_hash] = occurrences.get(chunk_hash, 0) + 1
+			yield str(uuid5(CHUNK_ID_NAMESPACE, f"{pdf_path}\n{chunk_hash}\n{n}")), chunk
+
+	# Ingestion pipeline: extract -> summarize -> embed -> store. The stages
+	# run concurrently, connected by bounded queues, and pass on
+	# ("chunk", job, chunk_id, chunk), ("failed", job, error) and
+	# ("end", job) items; `job` holds the state of one file.
 
-	def add_pdf(self, pdf_path, pdf_data=None):
-		if pdf_data:
-			 chunks = prepare_data( (pdf_path, pdf_data) )
+	def _open_checkpoint(self, pdf_path, pdf_input) -> Checkpoint:
+		# one checkpoint per file name and content, so a retry of the same upload finds it
+		if isinstance(pdf_input, str):
+			# in blocks, so the file is not held in memory (see STREAMING_EXTRACTION)
+			digest, size = hashlib.sha256(), 0
+			with open(pdf_input, "rb") as f:
+				while block := f.read(1024 ** 2):
+					digest.update(block)
+					size += len(block)
 		else:
-			chunks = prepare_data(pdf_path)
-		docs = [
-			self._chunk2doc(chunk)
-			for chunk in chunks
-		]
-		uuids = [str(uuid4()) for _ in range(len(docs))]
-		# first we want to delete the document if it exists;
-		# since we don't know the changes in the document,
-		# we cannot directly use `vector_store.update_document()`
-		# because that would require to know strictly which parts
-		# changed and which corresponding documents with which ids
-		# were associated with those; therefore, we just need to
-		# completely rewrite all the entries for this document so
-		# here we first need to delete all associated docs
-		self.delete_pdf(pdf_path)
-		# now add
-		self.vector_store.add_documents(docs, ids=uuids)
-		# update file index of the instance
-		self._file_index[pdf_path] = uuids
-		# after everything is added, update the metadata in the DB
-		self._save_file_index()
+			pdf_bytes = pdf_input[1] if isinstance(pdf_input, tuple) else pdf_input
+			digest, size = hashlib.sha256(pdf_bytes), len(pdf_bytes)
+		pdf_hash = digest.hexdigest()
+		checkpoint = Checkpoint(os.path.join(self._checkpoints_path, f"{content_hash(pdf_path, pdf_hash)}.sqlite"))
+		checkpoint.source = {"pdf_path": pdf_path, "content_hash": pdf_hash, "size": size}
+		return checkpoint
+
+	def _extract_stage(self, extract_chunks):
+		def extract(job):
+			# diff the chunks against the previous version of the file while they are extracted
+			old_ids = set(self._file_index.chunk_ids(job["pdf_path"]))
+			self._file_index.set_status(job["pdf_path"], "updating")
+			try:
+				checkpoint = job["checkpoint"] = self._open_checkpoint(job["pdf_path"], job["pdf_input"])
+				resumed = checkpoint.extracted
+				if resumed:
+					chunks = checkpoint.chunks()
+				else:
+					chunks = self._chunk_ids(job["pdf_path"], extract_chunks(job["pdf_input"]))
+				for chunk_id, chunk in chunks:
+					if not resumed:
+						checkpoint.add_chunks([(chunk_id, chunk)], start=len(job["ids"]))
+					job["ids"].append(chunk_id)
+					if chunk_id not in old_ids:
+						job["new_ids"].append(chunk_id)
+						job["new"] += 1
+						yield ("chunk", job, chunk_id, chunk)
+				if not resumed:
+					checkpoint.finish_extraction(len(job["ids"]))
+			except Exception as e:
+				# the chunks extracted so far are still in the pipeline, see `_store`
+				job["error"] = e
+			job["removed_ids"] = old_ids.difference(job["ids"])
+			yield ("end", job)
+		return extract
+
+	def _summarize(self, item):
+		if item[0] == "chunk":
+			job, chunk_id, chunk = item[1:]
+			try:
+				# summarized before the previous attempt failed
+				if (summary := job["checkpoint"].get_summary(chunk_id)) is not None:
+					chunk["summary"] = summary
+				else:
+					summarize_chunk(chunk, summary_cache=self.summary_cache)
+					job["checkpoint"].put_summary(chunk_id, chunk["summary"])
+			except Exception as e:
+				item = ("failed", job, e)
+			else:
+				with self._lock:
+					job["summarized"] += 1
+		yield item
+
+	def _embed(self, items):
+		# each batch is retried on its own; the vectors of the batches are
+		# checkpointed (see `_store`), so after a failure only the batches
+		# that were not embedded yet are sent again on the next attempt
+		chunk_items = [item for item in items if item[0] == "chunk"]
+		if chunk_items:
+			try:
+				vectors = {}
+				by_job = {}
+				for item in chunk_items:
+					by_job.setdefault(id(item[1]), (item[1], []))[1].append(item[2])
+				for job, ids in by_job.values():
+					vectors.update(job["checkpoint"].get_vectors(ids))
+				missing = [item for item in chunk_items if item[2] not in vectors]
+				if missing:
+					vectors.update(zip(
+						[item[2] for item in missing],
+						call_with_retry(
+							self.embeddings.embed_documents,
+							EMBEDDING_MAX_ATTEMPTS,
+							[item[3]["summary"] for item in missing]
+						)
+					))
+			except Exception as e:
+				yield from (("failed", item[1], e) for item in items if item[0] == "chunk")
+			else:
+				with self._lock:
+					for item in chunk_items:
+						item[1]["embedded"] += 1
+				yield from (item + (vectors[item[2]],) for item in chunk_items)
+		yield from (item for item in items if item[0] != "chunk")
+
+	def _store(self, items):
+		# the vectors go into the checkpoint of their upload; the collection
+		# is only written when the whole file is done (see `_commit_job`),
+		# so until then searches see the previous version of the file
+		by_job = {}
+		for item in items:
+			if item[0] == "chunk":
+				by_job.setdefault(id(item[1]), (item[1], {}))[1][item[2]] = item[4]
+		failed = {}
+		for job_key, (job, vectors) in by_job.items():
+			try:
+				job["checkpoint"].put_vectors(vectors)
+			except Exception as e:
+				failed[job_key] = e
+		touched = {}
+		for item in items:
+			kind, job = item[0], item[1]
+			if kind == "chunk" and id(job) in failed:
+				item = ("failed", job, failed[id(job)])
+				kind = "failed"
+			if kind == "chunk":
+				job["done"] += 1
+			elif kind == "failed":
+				job["error"] = job["error"] or item[2]
+				job["done"] += 1
+			else:
+				job["extracted"] = True
+			touched[job["pdf_path"]] = job
+		for job in touched.values():
+			yield ("progress", job)
+			if job["extracted"] and job["done"] == job["new"]:
+				if job["deferred"]:
+					# committed together with the rest of its set, see `replace_pdfs`
+					yield ("ready", job)
+				else:
+					yield ("done", job, self._commit_job(job))
+
+	def _commit_job(self, job) -> dict:
+		return self._commit_jobs([job])[0]
+
+	def _commit_jobs(self, jobs: List[dict], deleted_paths=()) -> List[dict]:
+		# commits finished uploads together with the deletion of `deleted_paths`:
+		# all of them or, if one failed, none (their checkpoints are kept)
+		with self._lock:
+			error = next((job["error"] for job in jobs if job["error"] is not None), None)
+			if error is None:
+				error = self._refresh_diffs(jobs)
+			if error is None:
+				updates = [
+					(job["checkpoint"], job["pdf_path"], job["ids"], job["new_ids"], job["removed_ids"])
+					for job in jobs
+				]
+				try:
+					# from here on, a crash is rolled forward on the next start
+					for job in jobs:
+						job["checkpoint"].begin_commit()
+					entries = self._write_chunks(updates)
+				except Exception as e:
+					error = self._undo_commit(jobs, e)
+				else:
+					try:
+						# the previous chunks are being removed: no way back, only forward
+						call_with_retry(self._replace_chunks, EMBEDDING_MAX_ATTEMPTS, updates, deleted_paths, entries)
+					except Exception as e:
+						error = RuntimeError(f"{e} (the upload is completed on the next start)")
+			if error is not None:
+				for job in jobs:
+					# also a failure of the commit itself is the error of the
+					# upload (`add_pdf` raises it)
+					job["error"] = job["error"] or error
+					# nothing of a failed upload is in the collection (unless its
+					# commit could only be rolled forward, see above); what was
+					# already done stays in its checkpoint for the next attempt
+					if job.get("checkpoint") is not None:
+						job["checkpoint"].close()
+					# a previous version of the file stays indexed
+					self._file_index.set_status(job["pdf_path"], "failed", str(job["error"]))
+				return [{"error": str(job["error"])} for job in jobs]
+			reports = []
+			for job in jobs:
+				job["checkpoint"].remove()
+				reports.append({
+					"added": job["new"],
+					"removed": len(job["removed_ids"]),
+					"kept": len(job["ids"]) - job["new"]
+				})
+			return reports
+
+	def _refresh_diffs(self, jobs) -> Optional[Exception]:
+		# under the lock: the chunks were diffed against the version that was
+		# indexed when the extraction started; if the file was deleted or
+		# committed again since, its "kept" chunks may be gone, and they were
+		# neither summarized nor embedded, so the upload has to be retried
+		# (from its checkpoint, the caches spare the summaries and embeddings)
+		for job in jobs:
+			current = set(self._file_index.chunk_ids(job["pdf_path"]))
+			new_ids = set(job["new_ids"])
+			if any(chunk_id not in current for chunk_id in job["ids"] if chunk_id not in new_ids):
+				return RuntimeError(f"{job['pdf_path']} was deleted or changed during the upload, please retry")
+			job["removed_ids"] = current.difference(job["ids"])
+			# chunks that are indexed already are not written (nor taken back, see `_undo_commit`)
+			job["new_ids"] = [chunk_id for chunk_id in job["new_ids"] if chunk_id not in current]
+		return None
+
+	def _undo_commit(self, jobs, error) -> Exception:
+		# nothing was removed yet, so the previous versions are intact: the
+		# new chunks written so far are taken back and the commit is off
+		try:
+			self._delete_chunks([chunk_id for job in jobs for chunk_id in job["new_ids"]])
+			for job in jobs:
+				job["checkpoint"].end_commit()
+		except Exception:
+			# then it stays marked and is completed on the next start
+			return RuntimeError(f"{error} (the upload is completed on the next start)")
+		return error
+
+	def _apply_checkpoints(self, updates, deleted_paths=()):
+		# writes the new chunks of finished uploads ((checkpoint, pdf_path, ids,
+		# new_ids, removed_ids) each) into the collection and every index, then
+		# removes the old ones and those of `deleted_paths` in one batch and
+		# records the new versions in one transaction; repeating it after a
+		# crash leads to the same state (the ids are deterministic)
+		self._replace_chunks(updates, deleted_paths, self._write_chunks(updates))
+
+	def _write_chunks(self, updates) -> list:
+		# first half of `_apply_checkpoints`: returns the written (id, chunk, vector) entries
+		entries = []
+		for checkpoint, pdf_path, _, new_ids, _ in updates:
+			file_entries = list(checkpoint.entries(new_ids))
+			if len(file_entries) != len(new_ids):
+				raise RuntimeError(f"The checkpoint of {pdf_path} is incomplete, please upload the file again")
+			entries.extend(file_entries)
+		for start in range(0, len(entries), self._chroma_batch_size):
+			batch = entries[start:start + self._chroma_batch_size]
+			docs = [self._chunk2doc(chunk) for _, chunk, _ in batch]
+			batch_ids = [chunk_id for chunk_id, _, _ in batch]
+			if self._document_frequencies is not None:
+				# a repeated write (see `_apply_checkpoints`) does not count a chunk twice
+				stored = set(self.vector_store._collection.get(ids=batch_ids, include=[])["ids"])
+			call_with_retry(
+				self.vector_store._collection.upsert,
+				EMBEDDING_MAX_ATTEMPTS,
+				ids=batch_ids,
+				embeddings=[vector for _, _, vector in batch],
+				documents=[doc.page_content for doc in docs],
+				metadatas=[doc.metadata for doc in docs]
+			)
+			self.lexical_index.add({
+				chunk_id: self._lexical_text(chunk["text"], chunk["metadata"])
+				for chunk_id, chunk, _ in batch
+			})
+			if self.vector_index is not None:
+				self.vector_index.add(batch_ids, [vector for _, _, vector in batch])
+			if self._document_frequencies is not None:
+				self._document_frequencies.count_documents(
+					[vector for chunk_id, _, vector in batch if chunk_id not in stored]
+				)
+		return entries
+
+	def _replace_chunks(self, updates, deleted_paths, entries):
+		# second half of `_apply_checkpoints`
+		# the old chunks are removed only after the new ones are in,
+		# so the files stay searchable during the upload
+		removed_ids = set()
+		for *_, file_removed_ids in updates:
+			removed_ids.update(file_removed_ids)
+		for pdf_path in deleted_paths:
+			removed_ids.update(self._file_index.chunk_ids(pdf_path))
+		if removed_ids:
+			self._delete_chunks(list(removed_ids))
+		# after everything is written, record the new versions in one transaction
+		replaced = {}
+		for checkpoint, pdf_path, ids, _, _ in updates:
+			source = checkpoint.source or {}
+			replaced[pdf_path] = (ids, source.get("content_hash"), source.get("size"))
+		self._file_index.commit(
+			replaced, deleted_paths,
+			chunk_stats={chunk_id: self._chunk_stats(chunk) for chunk_id, chunk, _ in entries}
+		)
+		self.generation += 1
+		self._update_disk_usage()
+
+	def _recover_checkpoints(self):
+		# commits that were interrupted by a crash are completed; checkpoints
+		# of failed uploads that were not retried for too long are dropped
+		if not os.path.isdir(self._checkpoints_path):
+			return
+		for filename in os.listdir(self._checkpoints_path):
+			if not filename.endswith(".sqlite"):
+				continue
+			path = os.path.join(self._checkpoints_path, filename)
+			checkpoint = Checkpoint(path)
+			if checkpoint.committing and checkpoint.source is not None:
+				pdf_path = checkpoint.source["pdf_path"]
+				ids = checkpoint.chunk_ids()
+				old_ids = set(self._file_index.chunk_ids(pdf_path))
+				self._apply_checkpoints([(
+					checkpoint, pdf_path, ids,
+					[chunk_id for chunk_id in ids if chunk_id not in old_ids],
+					old_ids.difference(ids)
+				)])
+				checkpoint.remove()
+			elif time.time() - os.path.getmtime(path) > CHECKPOINT_MAX_AGE:
+				checkpoint.remove()
+			else:
+				checkpoint.close()
+
+	@staticmethod
+	def _new_job(pdf_path, pdf_input, job_id=None, deferred=False) -> dict:
+		return {
+			"pdf_path": pdf_path, "pdf_input": pdf_input, "job_id": job_id, "checkpoint": None, "deferred": deferred,
+			"ids": [], "new_ids": [], "removed_ids": set(),
+			"new": 0, "summarized": 0, "embedded": 0, "done": 0, "extracted": False, "error": None
+		}
+
+	def _ingest(self, jobs: Iterable[dict], extract_chunks, extract_workers=1, queue_size=None):
+		# yields ("progress", job) and ("done", job, report) in the calling thread;
+		# `jobs` (see `_new_job`) may be a generator that keeps feeding the pipeline
+		if queue_size is None:
+			jobs = list(jobs)
+			queue_size = len(jobs) or 1
+		pipeline = Pipeline([
+			Stage("extract", self._extract_stage(extract_chunks), workers=extract_workers, queue_size=queue_size),
+			Stage("summarize", self._summarize, workers=SUMMARY_MAX_CONCURRENCY, queue_size=INGESTION_QUEUE_SIZE),
+			Stage(
+				"embed", self._embed, workers=EMBEDDING_MAX_CONCURRENCY,
+				queue_size=INGESTION_QUEUE_SIZE, batch_size=EMBEDDING_BATCH_SIZE,
+				batch_wait=EMBEDDING_BATCH_WAIT
+			),
+			Stage("store", self._store, queue_size=INGESTION_QUEUE_SIZE, batch_size=EMBEDDING_BATCH_SIZE)
+		])
+		try:
+			for event in pipeline.run(jobs):
+				self.ingestion_stats = pipeline.stats()
+				yield event
+		finally:
+			self.ingestion_stats = pipeline.stats()
+
+	def add_pdf(self, pdf_path, pdf_data=None, on_progress=None) -> dict:
+		"""
+		Adds a PDF or re-ingests a changed version of it. Only the chunks
+		that are new are summarized and embedded, only the ones that
+		disappeared are deleted; returns the counts of added, removed and
+		kept chunks. Chunks are summarized and embedded while the file is
+		still being extracted (see `_ingest`); `on_progress(done, total)`
+		reports the finished new chunks in the calling thread, where `total`
+		grows until the extraction is finished. The results of every stage
+		are checkpointed, so after a failure, calling it again with the same
+		file resumes where it stopped; the collection is only changed once
+		the whole file is done.
+		"""
+		pdf_input = (pdf_path, pdf_data) if pdf_data else pdf_path
+		extract_chunks = lambda pdf_input: prepare_data(
+			pdf_input, summarize=False, streaming=STREAMING_EXTRACTION
+		)
+		report = None
+		for event in self._ingest([self._new_job(pdf_path, pdf_input)], extract_chunks):
+			job = event[1]
+			if event[0] == "progress" and on_progress and job["new"]:
+				on_progress(job["done"], job["new"])
+			elif event[0] == "done":
+				report = event[2]
+		if job["error"] is not None:
+			raise job["error"]
+		return report
+
+	def add_pdfs(self, pdf_inputs, max_workers=None, on_file_done=None) -> dict:
+		"""
+		Bulk version of `add_pdf` for many files. `pdf_inputs` are paths or
+		(filename, bytes) tuples. Text extraction and segmentation run in a
+		process pool (CPU-bound) and feed the same pipeline as `add_pdf`, so
+		the next files are extracted while the chunks of the first ones are
+		summarized and stored. Returns the report of `add_pdf` per file, or
+		{"error": ...} for files that failed; `on_file_done(pdf_path, done,
+		total)` is called in the calling thread after each file.
+		"""
+		pdf_inputs = self._by_path(pdf_inputs)
+		reports = {}
+		for event in self._ingest_in_pool(pdf_inputs, max_workers):
+			if event[0] != "done":
+				continue
+			reports[event[1]["pdf_path"]] = event[2]
+			if on_file_done:
+				on_file_done(event[1]["pdf_path"], len(reports), len(pdf_inputs))
+		return reports
+
+	def replace_pdfs(self, pdf_inputs, delete=(), max_workers=None, on_file_done=None) -> dict:
+		"""
+		Like `add_pdfs`, but the files are committed together once all of them
+		are ingested, along with the deletion of the files in `delete`: one
+		batched delete in the vector store and the indexes, one transaction
+		in the file index and one new generation. If one file fails, nothing
+		is committed (the finished ones keep their checkpoints, so a retry
+		only redoes what is missing) and every report is {"error": ...}.
+		`on_file_done` is called when a file is ingested, before the commit.
+		"""
+		pdf_inputs = self._by_path(pdf_inputs)
+		delete = [pdf_path for pdf_path in dict.fromkeys(delete) if pdf_path not in pdf_inputs]
+		jobs = []
+		for event in self._ingest_in_pool(pdf_inputs, max_workers, deferred=True):
+			if event[0] != "ready":
+				continue
+			jobs.append(event[1])
+			if on_file_done:
+				on_file_done(event[1]["pdf_path"], len(jobs), len(pdf_inputs))
+		with self._lock:
+			delete = [pdf_path for pdf_path in delete if pdf_path in self._file_index]
+			if not jobs and not delete:
+				return {}
+			reports = self._commit_jobs(jobs, delete)
+		return {job["pdf_path"]: report for job, report in zip(jobs, reports)}
+
+	@staticmethod
+	def _by_path(pdf_inputs) -> dict:
+		return {
+			pdf_input[0] if isinstance(pdf_input, tuple) else pdf_input: pdf_input
+			for pdf_input in pdf_inputs
+		}
+
+	@staticmethod
+	def _extraction_pool(max_workers):
+		# a process pool for the CPU-bound extraction and the `extract_chunks`
+		# of `_ingest` that runs in it; spawn: forking the multi-threaded
+		# streamlit process is not safe
+		extract_pool = ProcessPoolExecutor(
+			max_workers=max_workers,
+			mp_context=multiprocessing.get_context("spawn")
+		)
+		extract_chunks = lambda pdf_input: extract_pool.submit(
+			extract_chunk_list, pdf_input, STREAMING_EXTRACTION
+		).result()
+		return extract_pool, extract_chunks
+
+	def _ingest_in_pool(self, pdf_inputs: dict, max_workers=None, deferred=False):
+		# `_ingest` of the given files with the extraction in a process pool
+		extract_pool, extract_chunks = self._extraction_pool(max_workers)
+		with extract_pool:
+			extract_workers = max_workers or os.cpu_count() or 1
+			jobs = [
+				self._new_job(pdf_path, pdf_input, deferred=deferred)
+				for pdf_path, pdf_input in pdf_inputs.items()
+			]
+			yield from self._ingest(jobs, extract_chunks, extract_workers=extract_workers)
 
 	def delete_pdf(self, pdf_path):
-		if pdf_path not in self._file_index: return
-		ids_to_delete = self._file_index[pdf_path]
-		self.vector_store.delete(ids_to_delete)
-		self._file_index.pop(pdf_path)
-		# after everything is deleted, update the metadata in the DB
-		self._save_file_index()
+		self.delete_pdfs([pdf_path])
+
+	def delete_pdfs(self, pdf_paths) -> int:
+		"""
+		Deletes many files at once: one batched delete in the vector store
+		and the indexes, one transaction in the file index and one new
+		generation. Returns the number of files that were deleted.
+		"""
+		with self._lock:
+			pdf_paths = [pdf_path for pdf_path in dict.fromkeys(pdf_paths) if pdf_path in self._file_index]
+			if pdf_paths:
+				self._apply_checkpoints([], pdf_paths)
+			return len(pdf_paths)
+
+	# Background ingestion: uploads are written to disk and queued in
+	# `job_queue`; one thread feeds them into a single `_ingest` pipeline
+	# (so `_store` stays the only writer) while there are queued jobs.
+
+	def enqueue_pdf(self, pdf_path, pdf_data) -> str:
+		"""
+		Writes the upload to disk and queues it for the background ingestion;
+		returns the id of the job at once. Status, progress and result are
+		reported by `ingestion_jobs`.
+		"""
+		job_id = uuid4().hex
+		upload_path = os.path.join(self._uploads_path, job_id, os.path.basename(pdf_path))
+		os.makedirs(os.path.dirname(upload_path), exist_ok=True)
+		with open(upload_path + ".part", "wb") as f:
+			f.write(pdf_data)
+		os.replace(upload_path + ".part", upload_path)
+		self.job_queue.put(job_id, pdf_path, upload_path)
+		self._start_worker()
+		return job_id
+
+	def retry_job(self, job_id) -> bool:
+		if retried := self.job_queue.retry(job_id):
+			self._start_worker()
+		return retried
+
+	def remove_job(self, job_id):
+		# forgets a finished job together with its upload
+		if (job := self.job_queue.remove(job_id)) is not None:
+			shutil.rmtree(os.path.dirname(job["path"]), ignore_errors=True)
+
+	def ingestion_jobs(self) -> list:
+		"""
+		All jobs, oldest first, with their status ("queued", "running",
+		"done", "failed"), the progress per stage of the new chunks
+		("extracted" is set once the total `new` is known), the report of
+		`add_pdf` or the error, and for running jobs the estimated seconds
+		left ("eta", None while the total is unknown).
+		"""
+		jobs = self.job_queue.jobs()
+		now = time.time()
+		for job in jobs:
+			if (live := self._active_jobs.get(job["id"])) is not None:
+				# the counters in the database are only updated per stored batch
+				job.update(
+					extracted=live["extracted"], new=live["new"], summarized=live["summarized"],
+					embedded=live["embedded"], stored=live["done"]
+				)
+			job["eta"] = None
+			if job["status"] == "running" and job["extracted"] and job["stored"]:
+				rate = job["stored"] / max(now - job["started"], 1e-6)
+				job["eta"] = (job["new"] - job["stored"]) / rate
+		return jobs
+
+	def _start_worker(self):
+		with self._lock:
+			if self._worker is None:
+				self._worker = threading.Thread(target=self._process_queue, daemon=True)
+				self._worker.start()
+
+	def _claim_jobs(self):
+		# feeds the pipeline until no job is queued; another upload of a file
+		# that is still in the pipeline waits until that one is committed,
+		# since it is diffed against the committed version
+		while True:
+			with self._lock:
+				busy = {job["pdf_path"] for job in self._active_jobs.values()}
+				row = self.job_queue.claim(exclude=busy)
+				if row is not None:
+					job = self._active_jobs[row["id"]] = self._new_job(row["name"], row["path"], job_id=row["id"])
+				elif not self.job_queue.has_queued():
+					return
+			if row is not None:
+				yield job
+				continue
+			with self.job_queue.changed:
+				self.job_queue.changed.wait(timeout=1)
+
+	def _process_queue(self):
+		while True:
+			with self._lock:
+				if not self.job_queue.has_queued():
+					self._worker = None
+					return
+			extract_pool, extract_chunks = self._extraction_pool(INGESTION_WORKERS)
+			try:
+				with extract_pool:
+					events = self._ingest(
+						self._claim_jobs(), extract_chunks,
+						extract_workers=INGESTION_WORKERS, queue_size=INGESTION_WORKERS
+					)
+					for event in events:
+						job = event[1]
+						if event[0] == "progress":
+							self.job_queue.progress(
+								job["job_id"], extracted=job["extracted"], new=job["new"],
+								summarized=job["summarized"], embedded=job["embedded"], stored=job["done"]
+							)
+						elif event[0] == "done":
+							self._finish_job(job, event[2])
+			except Exception as e:
+				# the pipeline itself failed: nothing that was in it is committed
+				for job in list(self._active_jobs.values()):
+					self._finish_job(job, {"error": str(e)})
+
+	def _finish_job(self, job, report):
+		self.job_queue.progress(
+			job["job_id"], extracted=job["extracted"], new=job["new"],
+			summarized=job["summarized"], embedded=job["embedded"], stored=job["done"]
+		)
+		if "error" in report:
+			# the upload stays on disk for `retry_job`
+			self.job_queue.finish(job["job_id"], error=report["error"])
+		else:
+			self.job_queue.finish(job["job_id"], report=report)
+			shutil.rmtree(os.path.dirname(job["pdf_input"]), ignore_errors=True)
+		with self._lock:
+			self._active_jobs.pop(job["job_id"], None)
 
 	def __len__(self):
 		return self.vector_store._collection.count()
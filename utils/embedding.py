@@ -0,0 +1,206 @@
+import os
+import json
+import threading
+from typing import List
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from unidecode import unidecode
+from langchain_core.embeddings import Embeddings
+from langchain_openai import OpenAIEmbeddings
+
+# backend of newly created collections; an existing collection keeps the
+# backend it was created with (see `resolve_embedding_config`)
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND")
+# number of hash buckets (= dimensions) of the local backend
+HASHED_EMBEDDING_DIMENSIONS = int(os.getenv("HASHED_EMBEDDING_DIMENSIONS", 2048))
+
+# defaults per backend; the values a collection was created with are stored next to it
+EMBEDDING_BACKENDS = {
+	"openai": {
+		"model_name": "text-embedding-3-small",
+		"dimensions": 1536,
+		"remote": True,
+		"similarity_threshold": 0.35
+	},
+	"hashed": {
+		"model_name": "hashed-char-ngrams-tfidf",
+		"dimensions": HASHED_EMBEDDING_DIMENSIONS,
+		"ngram_range": [3, 5],
+		"remote": False,
+		# the scores depend on the length of the chunks and cannot be
+		# compared to a fixed threshold; the best `k` are returned
+		"similarity_threshold": None
+	}
+}
+
+# odd 64-bit multipliers of the n-gram hash (one per character position)
+_HASH_MULTIPLIERS = np.array([
+	0x9E3779B97F4A7C15, 0xC2B2AE3D27D4EB4F, 0x165667B19E3779F9, 0xD6E8FEB86659FD93,
+	0xFF51AFD7ED558CCD, 0xC4CEB9FE1A85EC53, 0x94D049BB133111EB, 0xBF58476D1CE4E5B9
+], dtype=np.uint64)
+
+
+class HashedNgramEmbeddings(Embeddings):
+	"""
+	Local CPU embeddings without any network request: the character n-grams
+	of the transliterated, lower-cased text are hashed into `dimensions`
+	buckets, with log-scaled term frequencies. A whole batch is hashed and
+	counted in a few NumPy operations.
+
+	Documents are embedded with term frequencies only, so their vectors do
+	not change when the collection grows; the IDF weighting is applied to
+	the query instead. The document frequencies follow the documents in the
+	collection: its owner reports the vectors that are added and removed
+	(`count_documents`) and counts them again from all vectors if they have
+	drifted apart (`recount_documents`). They are kept in `state_path`.
+	"""
+
+	def __init__(self, dimensions=HASHED_EMBEDDING_DIMENSIONS, ngram_range=(3, 5), state_path=None):
+		self.dimensions = dimensions
+		self.ngram_range = tuple(ngram_range)
+		self._state_path = state_path
+		self._lock = threading.Lock()
+		self._n_docs = 0
+		self._df = np.zeros(dimensions, dtype=np.int64)
+		if state_path and os.path.exists(state_path):
+			state = np.load(state_path)
+			self._n_docs = int(state[0])
+			self._df = state[1:].astype(np.int64)
+
+	def _counts(self, texts: List[str]) -> np.ndarray:
+		# one row of bucket counts per text
+		encoded = [
+			np.frombuffer(f" {' '.join(unidecode(text).lower().split())} ".encode("ascii", "ignore"), dtype=np.uint8)
+			for text in texts
+		]
+		lengths = np.array([len(e) for e in encoded])
+		counts = np.zeros((len(texts), self.dimensions), dtype=np.float64)
+		if not lengths.sum():
+			return counts
+		buffer = np.concatenate(encoded).astype(np.uint64)
+		doc_of_position = np.repeat(np.arange(len(texts)), lengths)
+		for n in range(self.ngram_range[0], self.ngram_range[1] + 1):
+			if len(buffer) < n:
+				continue
+			with np.errstate(over="ignore"):
+				# uint64 arithmetic wraps around, which is what the hash wants
+				hashes = sliding_window_view(buffer, n) @ _HASH_MULTIPLIERS[:n] + np.uint64(n)
+				hashes ^= hashes >> np.uint64(31)
+				hashes *= np.uint64(0xBF58476D1CE4E5B9)
+				hashes ^= hashes >> np.uint64(29)
+			docs = doc_of_position[:len(hashes)]
+			# n-grams that reach into the next text are dropped
+			valid = docs == doc_of_position[n - 1:]
+			buckets = (hashes[valid] % np.uint64(self.dimensions)).astype(np.int64)
+			counts += np.bincount(
+				docs[valid] * self.dimensions + buckets,
+				minlength=len(texts) * self.dimensions
+			).reshape(len(texts), self.dimensions)
+		return counts
+
+	@staticmethod
+	def _normalize(vectors: np.ndarray) -> List[List[float]]:
+		norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+		return (vectors / np.where(norms == 0, 1, norms)).tolist()
+
+	def embed_documents(self, texts: List[str]) -> List[List[float]]:
+		# embedding alone does not count the documents: they may come from a
+		# cache, be embedded again or never be stored
+		return self._normalize(np.log1p(self._counts(texts)))
+
+	@property
+	def document_count(self) -> int:
+		return self._n_docs
+
+	def count_documents(self, vectors, sign=1):
+		"""
+		Adds the documents with the given vectors (as stored in the
+		collection) to the document frequencies, or removes them with
+		`sign=-1`. A document contains the buckets where its vector is not 0.
+		"""
+		if not len(vectors):
+			return
+		present = (np.asarray(vectors) != 0).sum(axis=0)
+		with self._lock:
+			self._n_docs += sign * len(vectors)
+			self._df += sign * present
+			self._save()
+
+	def recount_documents(self, vector_batches):
+		"""Counts the document frequencies again from the vectors of all documents."""
+		n_docs = 0
+		df = np.zeros(self.dimensions, dtype=np.int64)
+		for vectors in vector_batches:
+			if len(vectors):
+				n_docs += len(vectors)
+				df += (np.asarray(vectors) != 0).sum(axis=0)
+		with self._lock:
+			self._n_docs = n_docs
+			self._df = df
+			self._save()
+
+	def _save(self):
+		if self._state_path:
+			np.save(self._state_path, np.concatenate([[self._n_docs], self._df]))
+
+	def embed_queries(self, texts: List[str]) -> List[List[float]]:
+		# all queries hashed at once; unlike `embed_documents`, the document frequencies stay as they are
+		counts = self._counts(texts)
+		with self._lock:
+			idf = np.log((1 + self._n_docs) / (1 + self._df)) + 1
+			# buckets that occur in no document cannot match, they would only lower the scores
+			idf[self._df == 0] = 0
+		return self._normalize(np.log1p(counts) * idf)
+
+	def embed_query(self, text: str) -> List[float]:
+		return self.embed_queries([text])[0]
+
+
+def resolve_embedding_config(path, requested=EMBEDDING_BACKEND, legacy=False) -> dict:
+	"""
+	Returns the embedding configuration of the collection whose config file
+	is `path`. A new collection gets the `requested` backend (OpenAI if
+	none); `legacy` collections, created before the config file existed,
+	were built with OpenAI. Vectors of different backends cannot be
+	compared, so requesting another backend for an existing collection is
+	an error.
+	"""
+	if os.path.exists(path):
+		with open(path) as f:
+			config = json.load(f)
+	elif legacy:
+		config = {"backend": "openai", **EMBEDDING_BACKENDS["openai"]}
+	else:
+		config = None
+	if config is not None:
+		if requested and requested != config["backend"]:
+			raise ValueError(
+				f"The collection was embedded with '{config['backend']}', not '{requested}'; "
+				"use a new collection for another embedding backend."
+			)
+		if not os.path.exists(path):
+			with open(path, "w") as f:
+				json.dump(config, f, indent=4)
+		return config
+	backend = requested or "openai"
+	if backend not in EMBEDDING_BACKENDS:
+		raise ValueError(f"Unknown embedding backend '{backend}', expected one of {list(EMBEDDING_BACKENDS)}")
+	config = {"backend": backend, **EMBEDDING_BACKENDS[backend]}
+	os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+	with open(path, "w") as f:
+		json.dump(config, f, indent=4)
+	return config
+
+
+def create_embeddings(config: dict, state_path, batch_size) -> Embeddings:
+	if config["backend"] == "openai":
+		# one request per batch; retries of the batches are done by the caller
+		return OpenAIEmbeddings(model=config["model_name"], chunk_size=batch_size)
+	if config["backend"] == "hashed":
+		return HashedNgramEmbeddings(
+			dimensions=config["dimensions"],
+			ngram_range=config["ngram_range"],
+			state_path=state_path
+		)
+	raise ValueError(f"Unknown embedding backend '{config['backend']}'")
@@ -0,0 +1,244 @@
+import os
+import json
+import time
+import threading
+from typing import Dict, Iterable, List, Optional
+
+from utils.storage import open_shared_sqlite
+
+# per chunk, next to its file and position: section, summarized (1) or
+# passed through (0), tokens of the text and of the embedded summary;
+# NULL for chunks indexed before these columns (see `DBManager._backfill_stats`)
+CHUNK_STATS_COLUMNS = ("section", "summarized", "tokens", "summary_tokens")
+
+
+class CollectionStats:
+	"""
+	Chunk statistics of the indexed files, kept in memory and updated with
+	every commit of the file index, so reading them costs nothing. Rows
+	are (path, section, summarized, chunks, tokens, summary_tokens).
+	"""
+
+	def __init__(self):
+		self.files = {}	# path -> {"chunks": n, ..., "sections": {section: n}}
+
+	def update(self, rows, sign=1):
+		# sign -1 takes the rows out again
+		for path, section, summarized, chunks, tokens, summary_tokens in rows:
+			stats = self.files.get(path)
+			if stats is None:
+				stats = self.files[path] = {
+					"chunks": 0, "summarized": 0, "passthrough": 0,
+					"tokens": 0, "summary_tokens": 0, "sections": {}
+				}
+			stats["chunks"] += sign * chunks
+			if summarized is not None:
+				stats["summarized" if summarized else "passthrough"] += sign * chunks
+			stats["tokens"] += sign * (tokens or 0)
+			stats["summary_tokens"] += sign * (summary_tokens or 0)
+			if section is not None:
+				count = stats["sections"].get(section, 0) + sign * chunks
+				if count:
+					stats["sections"][section] = count
+				else:
+					stats["sections"].pop(section, None)
+			if not stats["chunks"]:
+				del self.files[path]
+
+	def to_dict(self) -> dict:
+		totals = {"chunks": 0, "summarized": 0, "passthrough": 0, "tokens": 0, "summary_tokens": 0}
+		sections = {}
+		for stats in self.files.values():
+			for field in totals:
+				totals[field] += stats[field]
+			for section, count in stats["sections"].items():
+				sections[section] = sections.get(section, 0) + count
+		return {
+			**totals,
+			"sections": dict(sorted(sections.items(), key=lambda item: item[1], reverse=True)),
+			"files": {path: {**stats, "sections": dict(stats["sections"])} for path, stats in self.files.items()}
+		}
+
+
+class FileIndex:
+	"""
+	Which chunks belong to which file, in SQLite (WAL): one row per file
+	with the content hash and size of the ingested version, its chunk
+	count, timestamps and the status of its latest ingestion, and one row
+	per chunk with its statistics. Replacing the chunks of a file is a
+	single transaction, so the index never holds half of an update; the
+	totals in `stats()` follow every committed transaction.
+
+	A file is only listed once a version of it was committed. "updating"
+	and "failed" refer to a newer version, while the committed one stays
+	indexed.
+	"""
+
+	def __init__(self, path):
+		self._lock = threading.Lock()
+		self._conn = open_shared_sqlite(path)
+		self._conn.execute("PRAGMA foreign_keys=ON")
+		self._conn.execute(
+			"CREATE TABLE IF NOT EXISTS files ("
+			"path TEXT PRIMARY KEY, content_hash TEXT, size INTEGER, chunks INTEGER NOT NULL, "
+			"status TEXT NOT NULL, error TEXT, created REAL NOT NULL, updated REAL NOT NULL)"
+		)
+		self._conn.execute(
+			"CREATE TABLE IF NOT EXISTS chunks ("
+			"id TEXT PRIMARY KEY, path TEXT NOT NULL REFERENCES files(path) ON DELETE CASCADE, "
+			"position INTEGER NOT NULL)"
+		)
+		self._conn.execute("CREATE INDEX IF NOT EXISTS chunks_by_path ON chunks (path, position)")
+		columns = {row[1] for row in self._conn.execute("PRAGMA table_info(chunks)")}
+		for column in CHUNK_STATS_COLUMNS:
+			if column not in columns:
+				self._conn.execute(f"ALTER TABLE chunks ADD COLUMN {column} {'TEXT' if column == 'section' else 'INTEGER'}")
+		self._conn.commit()
+		self._load_stats()
+
+	def _load_stats(self):
+		# one aggregate over the chunks on start, incremental from then on
+		self._stats = CollectionStats()
+		self._stats.update(self._conn.execute(
+			"SELECT path, section, summarized, COUNT(*), SUM(tokens), SUM(summary_tokens) "
+			"FROM chunks GROUP BY path, section, summarized"
+		))
+
+	def migrate_json(self, json_path) -> bool:
+		"""
+		One-time import of the former JSON index ({path: [chunk ids]}); the
+		file is kept as `<json_path>.migrated`. Returns whether it was imported.
+		"""
+		if not os.path.exists(json_path):
+			return False
+		with open(json_path) as f:
+			file_index = json.load(f)
+		now = time.time()
+		with self._lock:
+			with self._conn:
+				for path, ids in file_index.items():
+					self._replace(path, ids, None, None, now, {})
+			self._load_stats()
+		os.replace(json_path, f"{json_path}.migrated")
+		return True
+
+	def _stats_rows(self, paths) -> List[tuple]:
+		# the chunks of `paths` as rows of `CollectionStats`
+		return [
+			(path, section, summarized, 1, tokens, summary_tokens)
+			for path in paths
+			for section, summarized, tokens, summary_tokens in self._conn.execute(
+				"SELECT section, summarized, tokens, summary_tokens FROM chunks WHERE path = ?", (path,)
+			)
+		]
+
+	def _replace(self, path, ids, content_hash, size, now, chunk_stats):
+		# inside a transaction; the chunks of the previous version go with the
+		# file row, kept chunks keep their statistics
+		old_stats = {
+			row[0]: row[1:] for row in self._conn.execute(
+				"SELECT id, section, summarized, tokens, summary_tokens FROM chunks WHERE path = ?", (path,)
+			)
+		}
+		row = self._conn.execute("SELECT created FROM files WHERE path = ?", (path,)).fetchone()
+		self._conn.execute("DELETE FROM files WHERE path = ?", (path,))
+		self._conn.execute(
+			"INSERT INTO files (path, content_hash, size, chunks, status, created, updated) "
+			"VALUES (?, ?, ?, ?, 'indexed', ?, ?)",
+			(path, content_hash, size, len(ids), row[0] if row else now, now)
+		)
+		rows = [
+			(chunk_id, path, position, *(chunk_stats.get(chunk_id) or old_stats.get(chunk_id) or (None,) * 4))
+			for position, chunk_id in enumerate(ids)
+		]
+		self._conn.executemany(
+			"INSERT OR REPLACE INTO chunks (id, path, position, section, summarized, tokens, summary_tokens) "
+			"VALUES (?, ?, ?, ?, ?, ?, ?)",
+			rows
+		)
+		# (removed, added) rows of `CollectionStats`
+		return (
+			[
+				(path, section, summarized, 1, tokens, summary_tokens)
+				for section, summarized, tokens, summary_tokens in old_stats.values()
+			],
+			[
+				(path, section, summarized, 1, tokens, summary_tokens)
+				for _, _, _, section, summarized, tokens, summary_tokens in rows
+			]
+		)
+
+	def commit(self, replaced: Optional[Dict[str, tuple]] = None, deleted: Iterable[str] = (),
+			chunk_stats: Optional[Dict[str, tuple]] = None):
+		"""
+		Records new versions ({path: (ids, content_hash, size)}) and removes
+		the `deleted` paths, all in one transaction. `chunk_stats` holds the
+		statistics of new chunks ({id: (section, summarized, tokens,
+		summary_tokens)}); chunks that are kept keep theirs.
+		"""
+		now = time.time()
+		removed, added = [], []
+		with self._lock:
+			with self._conn:
+				for path, (ids, content_hash, size) in (replaced or {}).items():
+					file_removed, file_added = self._replace(path, ids, content_hash, size, now, chunk_stats or {})
+					removed.extend(file_removed)
+					added.extend(file_added)
+				deleted = list(deleted)
+				removed.extend(self._stats_rows(deleted))
+				self._conn.executemany("DELETE FROM files WHERE path = ?", [(path,) for path in deleted])
+			# only once the transaction is committed
+			self._stats.update(removed, sign=-1)
+			self._stats.update(added)
+
+	def missing_stats(self) -> List[str]:
+		# chunks indexed before the statistics were recorded
+		with self._lock:
+			return [row[0] for row in self._conn.execute("SELECT id FROM chunks WHERE tokens IS NULL")]
+
+	def set_chunk_stats(self, chunk_stats: Dict[str, tuple]):
+		with self._lock:
+			with self._conn:
+				self._conn.executemany(
+					"UPDATE chunks SET section = ?, summarized = ?, tokens = ?, summary_tokens = ? WHERE id = ?",
+					[(*stats, chunk_id) for chunk_id, stats in chunk_stats.items()]
+				)
+			self._load_stats()
+
+	def stats(self) -> dict:
+		# see `CollectionStats.to_dict`
+		with self._lock:
+			return self._stats.to_dict()
+
+	def set_status(self, path, status, error: Optional[str] = None):
+		# only for files with a committed version, see the class docstring
+		with self._lock, self._conn:
+			self._conn.execute("UPDATE files SET status = ?, error = ? WHERE path = ?", (status, error, path))
+
+	def _chunk_ids(self, path) -> List[str]:
+		return [row[0] for row in self._conn.execute(
+			"SELECT id FROM chunks WHERE path = ? ORDER BY position", (path,)
+		)]
+
+	def chunk_ids(self, path) -> List[str]:
+		# empty for files that are not indexed
+		with self._lock:
+			return self._chunk_ids(path)
+
+	def paths(self) -> List[str]:
+		with self._lock:
+			return [row[0] for row in self._conn.execute("SELECT path FROM files ORDER BY created")]
+
+	def files(self) -> List[dict]:
+		with self._lock:
+			cursor = self._conn.execute("SELECT * FROM files ORDER BY created")
+			columns = [column[0] for column in cursor.description]
+			return [dict(zip(columns, row)) for row in cursor]
+
+	def __contains__(self, path):
+		with self._lock:
+			return self._conn.execute("SELECT 1 FROM files WHERE path = ?", (path,)).fetchone() is not None
+
+	def __len__(self):
+		with self._lock:
+			return self._conn.execute("SELECT COUNT(*) FROM files").fetchone()[0]
@@ -0,0 +1,422 @@
+import os
+import json
+import time
+import queue
+import random
+import sqlite3
+import threading
+from array import array
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from utils.storage import open_shared_sqlite
+
+# marks the end of the input of a stage
+_END = object()
+
+
+def call_with_retry(func, max_attempts, *args, **kwargs):
+	"""Calls `func`; failures are retried with exponential backoff."""
+	for attempt in range(max_attempts):
+		try:
+			return func(*args, **kwargs)
+		except Exception:
+			if attempt + 1 == max_attempts:
+				raise
+			time.sleep(min(2 ** attempt, 30) * (0.5 + random.random()))
+
+
+class Stage:
+	"""
+	One step of a `Pipeline`. `workers` threads take items from a bounded
+	input queue and call `func` with them; everything `func` yields is
+	passed on to the next stage. With `batch_size` > 1, `func` gets a list
+	of up to `batch_size` items: those already waiting plus the ones that
+	arrive within `batch_wait` seconds after the first.
+	"""
+
+	def __init__(self, name, func: Callable, workers=1, queue_size=64, batch_size=1, batch_wait=0.0):
+		self.name = name
+		self.func = func
+		self.workers = workers
+		self.batch_size = batch_size
+		self.batch_wait = batch_wait
+		self.queue = queue.Queue(maxsize=queue_size)
+		self._lock = threading.Lock()
+		self._running = workers
+		self.processed = 0
+		self.busy_seconds = 0.0
+		self.max_queue_depth = 0
+		self._depth_sum = 0
+		self._depth_samples = 0
+		self._started = None
+		self._finished = None
+
+	def _take(self):
+		item = self.queue.get()
+		with self._lock:
+			depth = self.queue.qsize() + 1
+			self.max_queue_depth = max(self.max_queue_depth, depth)
+			self._depth_sum += depth
+			self._depth_samples += 1
+			if self._started is None:
+				self._started = time.perf_counter()
+		return item
+
+	def _record(self, n_items, busy_seconds):
+		with self._lock:
+			self.processed += n_items
+			self.busy_seconds += busy_seconds
+
+	def stats(self) -> dict:
+		with self._lock:
+			end = self._finished or time.perf_counter()
+			elapsed = end - self._started if self._started else 0.0
+			return {
+				"processed": self.processed,
+				"busy_seconds": self.busy_seconds,
+				"items_per_second": self.processed / elapsed if elapsed else 0.0,
+				# only the end marker is left once the stage has finished
+				"queue_depth": self.queue.qsize() if self._finished is None else 0,
+				"max_queue_depth": self.max_queue_depth,
+				"mean_queue_depth": self._depth_sum / self._depth_samples if self._depth_samples else 0.0
+			}
+
+
+class Pipeline:
+	"""
+	Runs `stages` concurrently, connected by their bounded queues: a stage
+	that is faster than the next one blocks instead of piling up items.
+	The output of the last stage is yielded by `run` in the calling thread.
+	"""
+
+	def __init__(self, stages: List[Stage]):
+		self.stages = stages
+		self._output = queue.Queue()
+		self.errors = []
+
+	def _put(self, index, item):
+		if index < len(self.stages):
+			self.stages[index].queue.put(item)
+		else:
+			self._output.put(item)
+
+	def _work(self, index):
+		stage = self.stages[index]
+		while True:
+			item = stage._take()
+			if item is _END:
+				# let the other workers of the stage stop as well
+				stage.queue.put(_END)
+				break
+			batch = [item]
+			deadline = time.perf_counter() + stage.batch_wait
+			while len(batch) < stage.batch_size:
+				remaining = deadline - time.perf_counter()
+				try:
+					item = stage.queue.get(timeout=remaining) if remaining > 0 else stage.queue.get_nowait()
+				except queue.Empty:
+					break
+				if item is _END:
+					stage.queue.put(_END)
+					break
+				batch.append(item)
+			start = time.perf_counter()
+			waited = 0.0
+			try:
+				for output in stage.func(batch if stage.batch_size > 1 else batch[0]):
+					put_start = time.perf_counter()
+					self._put(index + 1, output)
+					waited += time.perf_counter() - put_start
+			except Exception as e:
+				self.errors.append(e)
+			stage._record(len(batch), time.perf_counter() - start - waited)
+		with stage._lock:
+			stage._running -= 1
+			last = stage._running == 0
+			if last:
+				stage._finished = time.perf_counter()
+		if last:
+			self._put(index + 1, _END)
+
+	def _feed(self, items):
+		try:
+			for item in items:
+				self._put(0, item)
+		except Exception as e:
+			self.errors.append(e)
+		finally:
+			self._put(0, _END)
+
+	def run(self, items: Iterable) -> Iterator:
+		threads = [threading.Thread(target=self._feed, args=(items,), daemon=True)]
+		for index, stage in enumerate(self.stages):
+			threads += [
+				threading.Thread(target=self._work, args=(index,), daemon=True)
+				for _ in range(stage.workers)
+			]
+		for thread in threads:
+			thread.start()
+		while (output := self._output.get()) is not _END:
+			yield output
+		for thread in threads:
+			thread.join()
+		if self.errors:
+			raise self.errors[0]
+
+	def stats(self) -> dict:
+		return {stage.name: stage.stats() for stage in self.stages}
+
+
+class JobQueue:
+	"""
+	Persistent FIFO of ingestion jobs in SQLite: one job per uploaded file,
+	which waits on disk at `path` until it is processed. Status, progress
+	and result of every job survive restarts of the app; jobs that were
+	running when the process stopped are queued again.
+	"""
+
+	# columns with the progress of a running job (see `progress`)
+	PROGRESS_FIELDS = ("extracted", "new", "summarized", "embedded", "stored")
+
+	def __init__(self, path):
+		self._lock = threading.Lock()
+		# signalled whenever a job is queued or finished
+		self.changed = threading.Condition(self._lock)
+		self._conn = open_shared_sqlite(path)
+		self._conn.row_factory = sqlite3.Row
+		self._conn.execute(
+			"CREATE TABLE IF NOT EXISTS jobs ("
+			"id TEXT PRIMARY KEY, name TEXT NOT NULL, path TEXT NOT NULL, status TEXT NOT NULL, "
+			"created REAL NOT NULL, started REAL, finished REAL, "
+			"extracted INTEGER NOT NULL DEFAULT 0, new INTEGER NOT NULL DEFAULT 0, "
+			"summarized INTEGER NOT NULL DEFAULT 0, embedded INTEGER NOT NULL DEFAULT 0, "
+			"stored INTEGER NOT NULL DEFAULT 0, error TEXT, report TEXT)"
+		)
+		self._conn.execute("UPDATE jobs SET status = 'queued' WHERE status = 'running'")
+		self._conn.commit()
+
+	def put(self, job_id, name, path):
+		with self.changed:
+			self._conn.execute(
+				"INSERT INTO jobs (id, name, path, status, created) VALUES (?, ?, ?, 'queued', ?)",
+				(job_id, name, path, time.time())
+			)
+			self._conn.commit()
+			self.changed.notify_all()
+
+	def claim(self, exclude=()) -> Optional[dict]:
+		"""Marks the oldest queued job whose name is not in `exclude` as running and returns it."""
+		with self._lock:
+			for row in self._conn.execute("SELECT * FROM jobs WHERE status = 'queued' ORDER BY created"):
+				if row["name"] in exclude:
+					continue
+				self._conn.execute(
+					"UPDATE jobs SET status = 'running', started = ?, finished = NULL, error = NULL, "
+					"extracted = 0, new = 0, summarized = 0, embedded = 0, stored = 0 WHERE id = ?",
+					(time.time(), row["id"])
+				)
+				self._conn.commit()
+				return dict(row)
+		return None
+
+	def has_queued(self) -> bool:
+		with self._lock:
+			return self._conn.execute("SELECT 1 FROM jobs WHERE status = 'queued' LIMIT 1").fetchone() is not None
+
+	def progress(self, job_id, **counts):
+		with self._lock:
+			fields = [field for field in self.PROGRESS_FIELDS if field in counts]
+			self._conn.execute(
+				f"UPDATE jobs SET {', '.join(f'{field} = ?' for field in fields)} WHERE id = ?",
+				[int(counts[field]) for field in fields] + [job_id]
+			)
+			self._conn.commit()
+
+	def finish(self, job_id, report: Optional[dict] = None, error: Optional[str] = None):
+		with self.changed:
+			self._conn.execute(
+				"UPDATE jobs SET status = ?, finished = ?, report = ?, error = ? WHERE id = ?",
+				(
+					"failed" if error is not None else "done", time.time(),
+					json.dumps(report) if report is not None else None, error, job_id
+				)
+			)
+			self._conn.commit()
+			self.changed.notify_all()
+
+	def retry(self, job_id) -> bool:
+		# a failed job goes back to the end of the queue; its upload is still on disk
+		with self.changed:
+			updated = self._conn.execute(
+				"UPDATE jobs SET status = 'queued', created = ? WHERE id = ? AND status = 'failed'",
+				(time.time(), job_id)
+			).rowcount
+			self._conn.commit()
+			self.changed.notify_all()
+		return bool(updated)
+
+	def remove(self, job_id) -> Optional[dict]:
+		# only finished jobs can be removed; returns the removed job
+		with self._lock:
+			row = self._conn.execute(
+				"SELECT * FROM jobs WHERE id = ? AND status IN ('done', 'failed')", (job_id,)
+			).fetchone()
+			if row is not None:
+				self._conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+				self._conn.commit()
+		return dict(row) if row is not None else None
+
+	def jobs(self) -> List[dict]:
+		with self._lock:
+			rows = self._conn.execute("SELECT * FROM jobs ORDER BY created").fetchall()
+		jobs = []
+		for row in rows:
+			job = dict(row)
+			job["extracted"] = bool(job["extracted"])
+			job["report"] = json.loads(job["report"]) if job["report"] else None
+			jobs.append(job)
+		return jobs
+
+
+class Checkpoint:
+	"""
+	Intermediate results of the ingestion of one upload in a SQLite file:
+	the extracted chunks (in order), their summaries and their embeddings.
+	Every stage writes its results as soon as they are done, so a retry
+	of the same upload resumes where the previous attempt stopped. The
+	`committing` flag is set before the results are written to the
+	collection; a checkpoint that still has it after a crash is committed
+	again (see `DBManager._recover_checkpoints`).
+	"""
+
+	def __init__(self, path):
+		self.path = path
+		self._lock = threading.Lock()
+		self._conn = open_shared_sqlite(path)
+		# every chunk is written on its own; a power loss may cost the last
+		# few of them (which are then redone), never the consistency of the file
+		self._conn.execute("PRAGMA synchronous=NORMAL")
+		self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+		self._conn.execute(
+			"CREATE TABLE IF NOT EXISTS chunks (id TEXT PRIMARY KEY, position INTEGER NOT NULL, chunk TEXT NOT NULL)"
+		)
+		self._conn.execute("CREATE TABLE IF NOT EXISTS summaries (id TEXT PRIMARY KEY, summary TEXT NOT NULL)")
+		self._conn.execute("CREATE TABLE IF NOT EXISTS vectors (id TEXT PRIMARY KEY, vector BLOB NOT NULL)")
+		self._conn.commit()
+
+	def _get_meta(self, key):
+		with self._lock:
+			row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+		return json.loads(row[0]) if row else None
+
+	def _set_meta(self, key, value):
+		with self._lock:
+			self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, json.dumps(value)))
+			self._conn.commit()
+
+	@property
+	def source(self) -> Optional[dict]:
+		# the upload: {"pdf_path": ..., "content_hash": ..., "size": ...}
+		return self._get_meta("source")
+
+	@source.setter
+	def source(self, value: dict):
+		self._set_meta("source", value)
+
+	@property
+	def extracted(self) -> bool:
+		return bool(self._get_meta("extracted"))
+
+	@property
+	def committing(self) -> bool:
+		return bool(self._get_meta("committing"))
+
+	def begin_commit(self):
+		self._set_meta("committing", True)
+
+	def end_commit(self):
+		# the commit was taken back, see `DBManager._undo_commit`
+		self._set_meta("committing", False)
+
+	def add_chunks(self, chunks: List[Tuple[str, dict]], start):
+		# (id, chunk) pairs at positions start, start + 1, ...
+		with self._lock:
+			self._conn.executemany(
+				"INSERT OR REPLACE INTO chunks (id, position, chunk) VALUES (?, ?, ?)",
+				[
+					(chunk_id, start + i, json.dumps(chunk, ensure_ascii=False))
+					for i, (chunk_id, chunk) in enumerate(chunks)
+				]
+			)
+			self._conn.commit()
+
+	def finish_extraction(self, n_chunks):
+		# chunks of an earlier, interrupted extraction beyond the end are dropped
+		with self._lock:
+			self._conn.execute("DELETE FROM chunks WHERE position >= ?", (n_chunks,))
+			self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('extracted', 'true')")
+			self._conn.commit()
+
+	def chunks(self) -> Iterator[Tuple[str, dict]]:
+		with self._lock:
+			rows = self._conn.execute("SELECT id, chunk FROM chunks ORDER BY position").fetchall()
+		for chunk_id, chunk in rows:
+			yield chunk_id, json.loads(chunk)
+
+	def chunk_ids(self) -> List[str]:
+		with self._lock:
+			return [row[0] for row in self._conn.execute("SELECT id FROM chunks ORDER BY position")]
+
+	def get_summary(self, chunk_id) -> Optional[str]:
+		with self._lock:
+			row = self._conn.execute("SELECT summary FROM summaries WHERE id = ?", (chunk_id,)).fetchone()
+		return row[0] if row else None
+
+	def put_summary(self, chunk_id, summary):
+		with self._lock:
+			self._conn.execute("INSERT OR REPLACE INTO summaries (id, summary) VALUES (?, ?)", (chunk_id, summary))
+			self._conn.commit()
+
+	def get_vectors(self, ids) -> Dict[str, List[float]]:
+		with self._lock:
+			rows = [
+				row
+				for i in range(0, len(ids), 500)
+				for row in self._conn.execute(
+					f"SELECT id, vector FROM vectors WHERE id IN ({','.join('?' * len(ids[i:i + 500]))})",
+					ids[i:i + 500]
+				)
+			]
+		return {chunk_id: array("f", blob).tolist() for chunk_id, blob in rows}
+
+	def put_vectors(self, vectors: Dict[str, List[float]]):
+		with self._lock:
+			self._conn.executemany(
+				"INSERT OR REPLACE INTO vectors (id, vector) VALUES (?, ?)",
+				[(chunk_id, array("f", vector).tobytes()) for chunk_id, vector in vectors.items()]
+			)
+			self._conn.commit()
+
+	def entries(self, ids) -> Iterator[Tuple[str, dict, List[float]]]:
+		# (id, chunk with its summary, vector) of the given ids, for the commit
+		ids = list(ids)
+		vectors = self.get_vectors(ids)
+		wanted = set(ids)
+		with self._lock:
+			rows = self._conn.execute(
+				"SELECT chunks.id, chunks.chunk, summaries.summary FROM chunks "
+				"JOIN summaries ON summaries.id = chunks.id ORDER BY chunks.position"
+			).fetchall()
+		for chunk_id, chunk, summary in rows:
+			if chunk_id in wanted and chunk_id in vectors:
+				yield chunk_id, {**json.loads(chunk), "summary": summary}, vectors[chunk_id]
+
+	def close(self):
+		with self._lock:
+			self._conn.close()
+
+	def remove(self):
+		self.close()
+		for suffix in ("", "-wal", "-shm"):
+			if os.path.exists(self.path + suffix):
+				os.remove(self.path + suffix)
@@ -0,0 +1,151 @@
+import re
+import json
+import math
+import heapq
+import threading
+from collections import Counter
+from typing import Dict, List, Tuple, Iterable
+from unidecode import unidecode
+
+from utils.storage import open_shared_sqlite
+
+# Ordnungszahlen and norm numbers ("1.3.2.", "206-1", "18531/1") stay one token
+TOKEN_PATTERN = re.compile(r"\d+(?:[.\-/]\d+)+|\w+")
+# quoted queries and queries made only of norm designations and numbers
+# ("DIN 1045", "1.3.2.", "EN 206-1") are answered by the lexical index alone;
+# checked token by token, one pattern over the whole query backtracks
+# exponentially on long digit strings
+QUOTED_QUERY_PATTERN = re.compile(r'^"[^"]+"$')
+EXACT_TOKEN_PATTERN = re.compile(r"DIN|EN|ISO|VOB|ZTV|\d+(?:[.\-/]\d+)*\.?", re.IGNORECASE)
+EXACT_TOKEN_SEPARATOR = re.compile(r"[\s/-]+")
+
+
+def tokenize(text) -> List[str]:
+	# the chunk texts are stored transliterated (see `finish_chunks`), so the queries are as well
+	return TOKEN_PATTERN.findall(unidecode(text).lower())
+
+
+def is_exact_query(query) -> bool:
+	query = query.strip()
+	if QUOTED_QUERY_PATTERN.match(query):
+		return True
+	tokens = [token for token in EXACT_TOKEN_SEPARATOR.split(query) if token]
+	return bool(tokens) and all(EXACT_TOKEN_PATTERN.fullmatch(token) for token in tokens)
+
+
+def reciprocal_rank_fusion(rankings: Iterable[List[str]], k=60) -> List[Tuple[str, float]]:
+	# every ranking contributes 1 / (k + rank) per id; no score calibration needed
+	scores = {}
+	for ranking in rankings:
+		for rank, doc_id in enumerate(ranking, start=1):
+			scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank)
+	return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+class BM25Index:
+	"""
+	Inverted index over the chunk texts, scored with Okapi BM25. The
+	postings are kept in memory for the queries; the SQLite file holds one
+	row with the term frequencies per document, from which they are
+	rebuilt on start. `add` and `delete` update both incrementally.
+	"""
+
+	def __init__(self, path, k1=1.2, b=0.75):
+		self.k1 = k1
+		self.b = b
+		self._lock = threading.Lock()
+		self._conn = open_shared_sqlite(path)
+		self._conn.execute(
+			"CREATE TABLE IF NOT EXISTS docs ("
+			"id TEXT PRIMARY KEY, length INTEGER NOT NULL, terms TEXT NOT NULL)"
+		)
+		self._conn.commit()
+		self._lengths = {}
+		self._terms = {}	# id -> its terms, to find its postings on delete
+		self._total_length = 0
+		self._postings = {}	# term -> {id: term frequency}
+		for doc_id, length, terms in self._conn.execute("SELECT id, length, terms FROM docs"):
+			self._index(doc_id, length, json.loads(terms))
+
+	def _index(self, doc_id, length, counts: Dict[str, int]):
+		self._lengths[doc_id] = length
+		self._terms[doc_id] = tuple(counts)
+		self._total_length += length
+		for term, tf in counts.items():
+			self._postings.setdefault(term, {})[doc_id] = tf
+
+	def _delete(self, ids):
+		removed = [doc_id for doc_id in ids if doc_id in self._lengths]
+		for doc_id in removed:
+			self._total_length -= self._lengths.pop(doc_id)
+			for term in self._terms.pop(doc_id):
+				postings = self._postings[term]
+				del postings[doc_id]
+				if not postings:
+					del self._postings[term]
+		self._conn.executemany("DELETE FROM docs WHERE id = ?", [(doc_id,) for doc_id in removed])
+
+	def add(self, docs: Dict[str, str]):
+		"""Indexes `docs` (id -> text); ids that are already indexed are replaced."""
+		with self._lock:
+			self._delete(list(docs))
+			rows = []
+			for doc_id, text in docs.items():
+				counts = Counter(tokenize(text))
+				length = sum(counts.values())
+				self._index(doc_id, length, counts)
+				rows.append((doc_id, length, json.dumps(counts, ensure_ascii=False, separators=(",", ":"))))
+			self._conn.executemany("INSERT INTO docs (id, length, terms) VALUES (?, ?, ?)", rows)
+			self._conn.commit()
+
+	def delete(self, ids):
+		with self._lock:
+			self._delete(list(ids))
+			self._conn.commit()
+
+	def clear(self):
+		with self._lock:
+			self._conn.execute("DELETE FROM docs")
+			self._conn.commit()
+			self._lengths = {}
+			self._terms = {}
+			self._postings = {}
+			self._total_length = 0
+
+	def search(self, query, k=100, require_all=False, ids=None, min_score=None) -> List[Tuple[str, float]]:
+		"""
+		Returns up to `k` (id, score) pairs, best first. With `require_all`,
+		only documents that contain every term of the query are returned;
+		with `ids`, only documents among them; with `min_score`, only those
+		that score at least that much (matches of stopwords alone score
+		little, their idf is close to 0).
+		"""
+		terms = set(tokenize(query))
+		with self._lock:
+			n_docs = len(self._lengths)
+			if not terms or not n_docs:
+				return []
+			avg_length = self._total_length / n_docs
+			scores = {}
+			matched = Counter()
+			for term in terms:
+				postings = self._postings.get(term)
+				if not postings:
+					if require_all:
+						return []
+					continue
+				idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+				for doc_id, tf in postings.items():
+					if ids is not None and doc_id not in ids:
+						continue
+					length_norm = self.k1 * (1 - self.b + self.b * self._lengths[doc_id] / avg_length)
+					scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + length_norm)
+					matched[doc_id] += 1
+		if require_all:
+			scores = {doc_id: score for doc_id, score in scores.items() if matched[doc_id] == len(terms)}
+		if min_score is not None:
+			scores = {doc_id: score for doc_id, score in scores.items() if score >= min_score}
+		return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+
+	def __len__(self):
+		return len(self._lengths)
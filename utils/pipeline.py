@@ -1,15 +1,48 @@
 import os
 import json
+import asyncio
 from dotenv import load_dotenv
-from typing import List, Dict
+from typing import List, Dict, Optional, Tuple, AsyncIterator
 import openai
 
 from utils.db_management import _db_manager
+from utils.caching import ResponseCache, normalize_query
+from utils.search import SearchResult, SearchPage, Filters, paginate, normalize_filters, chroma_where
+from utils.lexical import is_exact_query, reciprocal_rank_fusion
 
 load_dotenv()
 openai.api_key = os.getenv("OPENAI_API_KEY")
 
 SIMILARITY_THRESHOLD = 0.35
+# Anzahl der Ergebnisse der Vektorsuche, der lexikalischen Suche und der Fusion
+TOP_K = int(os.getenv("TOP_K", 100))
+# Ergebnisse der Vektorsuche und der lexikalischen Suche (BM25) per
+# Reciprocal Rank Fusion zusammenführen ("1"); standardmäßig nur Vektorsuche.
+# Mit "1" sind die Scores in /get und /batch die der Fusion (1 / (RRF_K + Rang)
+# pro Liste, also etwa 0.01 bis 0.033) statt der Relevanz der Vektorsuche
+# (0 bis 1); Schwellen der Clients auf `score` müssen dann angepasst werden
+HYBRID_SEARCH = os.getenv("HYBRID_SEARCH", "0") == "1"
+# Mindest-BM25-Score der lexikalischen Treffer, die in die Fusion eingehen:
+# Treffer nur über häufige Wörter ("und", "der") haben einen idf nahe 0 und
+# würden sonst am SIMILARITY_THRESHOLD der Vektorsuche vorbei bis zu TOP_K
+# Ergebnisse liefern; ein seltener Begriff allein erreicht ihn
+LEXICAL_MIN_SCORE = float(os.getenv("LEXICAL_MIN_SCORE", 1.0))
+# Konstante k der Reciprocal Rank Fusion
+RRF_K = int(os.getenv("RRF_K", 60))
+# Obergrenze (ca. Bytes) für die im Speicher gehaltenen Ergebnislisten,
+# damit das Blättern durch die Seiten einer Suche nicht erneut sucht
+RESULTS_CACHE_MAX_BYTES = int(os.getenv("RESULTS_CACHE_MAX_BYTES", 64 * 1024 ** 2))
+# Obergrenze (ca. Bytes) für die gemerkten ID-Mengen der Filter
+FILTER_CACHE_MAX_BYTES = int(os.getenv("FILTER_CACHE_MAX_BYTES", 16 * 1024 ** 2))
+
+
+def to_json(results: List[SearchResult]) -> str:
+    return json.dumps([r.to_dict() for r in results], ensure_ascii=False)
+
+
+def results_size(results: List[SearchResult]) -> int:
+    # grobe Schätzung: die Texte machen den Großteil aus
+    return sum(len(r.text) + 200 for r in results)
 
 
 def init_pipeline():
@@ -17,28 +50,211 @@ def init_pipeline():
     Wir erzeugen eine Klasse MyPipeline, die – wie früher – eine .invoke()-Methode hat.
     So ändert sich `server.py` nicht, weil wir da auch 'pipeline.invoke(...)' aufrufen.
     """
+
+    def fetch_many(hit_lists: List[List[Tuple[str, float]]]) -> List[List[SearchResult]]:
+        # Texte und Metadaten der gefundenen IDs aller Anfragen mit einem Zugriff
+        # auf Chroma, pro Anfrage in der Reihenfolge der Treffer
+        ids = list(dict.fromkeys(chunk_id for hits in hit_lists for chunk_id, _ in hits))
+        if not ids:
+            return [[] for _ in hit_lists]
+        res = _db_manager.vector_store._collection.get(ids=ids, include=["metadatas"])
+        metadatas = dict(zip(res["ids"], res["metadatas"]))
+        outputs = []
+        for hits in hit_lists:
+            results = []
+            for chunk_id, score in hits:
+                if (metadata := metadatas.get(chunk_id)) is None:
+                    continue    # gerade gelöscht
+                # mehrere Anfragen können denselben Chunk finden
+                metadata = dict(metadata)
+                original_text = metadata.pop("text", "")
+                results.append(SearchResult(chunk_id, original_text, metadata, score))
+            outputs.append(results)
+        return outputs
+
+    def fetch_results(hits: List[Tuple[str, float]]) -> List[SearchResult]:
+        return fetch_many([hits])[0]
+
+    # IDs der Chunks pro Filter, pro Stand der Collection
+    filter_cache = ResponseCache(FILTER_CACHE_MAX_BYTES, sizeof=lambda ids: 64 * len(ids) + 64)
+
+    def allowed_ids(filters: Filters) -> Optional[set]:
+        """
+        Die IDs der Chunks, die zu den Filtern passen (None = alle). Chroma
+        wertet die Filter auf seinen Metadaten aus; der BM25- und der
+        NumPy-Index bewerten dann nur noch diese Kandidaten.
+        """
+        if not filters:
+            return None
+        generation = _db_manager.generation
+        ids = filter_cache.get(filters, generation)
+        if ids is None:
+            ids = set(_db_manager.vector_store._collection.get(where=chroma_where(filters), include=[])["ids"])
+            filter_cache.put(filters, generation, ids)
+        return ids
+
+    def search_by_vectors(query_vectors: List[List[float]], filters: Filters = ()) -> List[List[SearchResult]]:
+        """
+        Sucht mit den bereits berechneten Vektoren der Anfragen im Vectorstore,
+        mit denselben Scores und demselben Schwellwert wie
+        `similarity_search_with_relevance_scores`. Alle Anfragen werden
+        zusammen bewertet, die Ergebnisse kommen pro Anfrage zurück.
+        """
+        vector_store = _db_manager.vector_store
+        # die Scores der Embedding-Backends sind unterschiedlich verteilt
+        threshold = _db_manager.embedding_config.get("similarity_threshold", SIMILARITY_THRESHOLD)
+        if _db_manager.vector_index is not None:
+            # exakte Suche im NumPy-Index (VECTOR_INDEX=numpy), nur die Treffer werden aus Chroma gelesen
+            return fetch_many(_db_manager.vector_index.search_batch(
+                query_vectors, k=TOP_K, threshold=threshold, ids=allowed_ids(filters)
+            ))
+
+        # direkt auf der Chroma-Collection, damit wir die IDs für die Fusion bekommen;
+        # die Filter schränkt Chroma schon bei der Suche ein
+        res = vector_store._collection.query(
+            query_embeddings=query_vectors,
+            n_results=TOP_K,
+            where=chroma_where(filters),
+            include=["metadatas", "distances"]
+        )
+        relevance_score = vector_store._select_relevance_score_fn()
+
+        outputs = []
+        for ids, metadatas, distances in zip(res["ids"], res["metadatas"], res["distances"]):
+            results = []
+            for chunk_id, metadata, distance in zip(ids, metadatas, distances):
+                score = relevance_score(distance)
+                if threshold is not None and score < threshold:
+                    continue
+                original_text = metadata.pop("text", "")
+                results.append(SearchResult(chunk_id, original_text, metadata, score))
+            outputs.append(results)
+        return outputs
+
+    def search_by_vector(query_vector: List[float], filters: Filters = ()) -> List[SearchResult]:
+        return search_by_vectors([query_vector], filters)[0]
+
+    def search_lexical(query: str, exact: bool = False, filters: Filters = ()) -> List[SearchResult]:
+        """
+        Sucht im lokalen BM25-Index, ohne Anfrage an die Embedding-API.
+        Mit `exact` werden nur Chunks gefunden, die alle Begriffe enthalten,
+        sonst nur solche mit einem Score von mindestens `LEXICAL_MIN_SCORE`.
+        """
+        return fetch_results(_db_manager.lexical_index.search(
+            query, k=TOP_K, require_all=exact, ids=allowed_ids(filters),
+            min_score=None if exact else LEXICAL_MIN_SCORE
+        ))
+
+    def fuse(dense: List[SearchResult], lexical: List[SearchResult]) -> List[SearchResult]:
+        by_id = {r.id: r for r in lexical}
+        by_id.update((r.id, r) for r in dense)
+        fused = reciprocal_rank_fusion([[r.id for r in dense], [r.id for r in lexical]], k=RRF_K)
+        return [
+            SearchResult(chunk_id, by_id[chunk_id].text, by_id[chunk_id].metadata, score)
+            for chunk_id, score in fused[:TOP_K]
+        ]
+
+    def search_exact(query: str, filters: Filters = ()) -> Optional[List[SearchResult]]:
+        # Ordnungszahlen, DIN-Nummern und Begriffe in Anführungszeichen werden
+        # in Millisekunden lexikalisch beantwortet; findet sich nichts, wird
+        # wie gewohnt (semantisch) gesucht
+        if HYBRID_SEARCH and is_exact_query(query):
+            return search_lexical(query, exact=True, filters=filters) or None
+        return None
     
-    def retrieve(user_input: str) -> List[Dict]:
+    def retrieve(user_input: str, filters: Filters = ()) -> List[SearchResult]:
         """
         Die reine Retrieval-Funktion, die user_input nimmt und 
         via Vectorstore ähnliche Dokumente heraussucht.
+        Mit `filters` (siehe `normalize_filters`) nur unter den passenden Chunks.
         """
         query = user_input.strip()
-        res = _db_manager.vector_store.similarity_search_with_relevance_scores(
-            query=query,
-            k=100,
-            score_threshold=SIMILARITY_THRESHOLD
-        )
+        if (results := search_exact(query, filters)) is not None:
+            return results
+        dense = search_by_vector(_db_manager.embeddings.embed_query(query), filters)
+        if not HYBRID_SEARCH:
+            return dense
+        return fuse(dense, search_lexical(query, filters=filters))
 
-        outputs = []
-        for doc, score in res:
-            original_text = doc.metadata.pop("text", "")
-            outputs.append({
-                "text": original_text,
-                "metadata": doc.metadata,
-                "score": score
-            })
-        return outputs
+    async def aretrieve(user_input: str, filters: Filters = ()) -> List[SearchResult]:
+        """
+        Wie `retrieve`, aber die Anfrage an die Embedding-API wird abgewartet,
+        ohne einen Thread zu blockieren; nur die lokale Suche läuft in einem Thread.
+        """
+        query = user_input.strip()
+        if (results := await asyncio.to_thread(search_exact, query, filters)) is not None:
+            return results
+        query_vector = await _db_manager.embeddings.aembed_query(query)
+        dense = await asyncio.to_thread(search_by_vector, query_vector, filters)
+        if not HYBRID_SEARCH:
+            return dense
+        return fuse(dense, await asyncio.to_thread(search_lexical, query, False, filters))
+
+    # alle Ergebnisse einer Anfrage, pro Stand der Collection
+    results_cache = ResponseCache(RESULTS_CACHE_MAX_BYTES, sizeof=results_size)
+
+    def cache_key(user_input: str, filters: Filters):
+        # die Generation wird vor der Suche gelesen, siehe server.py
+        return _db_manager.generation, (_db_manager._collection_name, normalize_query(user_input), filters)
+
+    def ranked(user_input: str, filters: Filters = ()) -> List[SearchResult]:
+        generation, key = cache_key(user_input, filters)
+        results = results_cache.get(key, generation)
+        if results is None:
+            results = retrieve(user_input, filters)
+            results_cache.put(key, generation, results)
+        return results
+
+    async def aranked(user_input: str, filters: Filters = ()) -> List[SearchResult]:
+        generation, key = cache_key(user_input, filters)
+        results = results_cache.get(key, generation)
+        if results is None:
+            results = await aretrieve(user_input, filters)
+            results_cache.put(key, generation, results)
+        return results
+
+    async def aranked_batch(items: List[Tuple[str, Filters]]) -> AsyncIterator[Tuple[int, List[SearchResult]]]:
+        """
+        Sucht viele Anfragen auf einmal und liefert (Nr. der Anfrage, Ergebnisse),
+        sobald die Ergebnisse einer Anfrage feststehen: zuerst die aus dem
+        Cache und die lexikalisch beantworteten, dann die übrigen. Diese
+        werden mit einer einzigen Anfrage an die Embedding-API eingebettet
+        und pro Filter gemeinsam bewertet.
+        """
+        generation = _db_manager.generation
+        # gleiche Anfragen mit gleichen Filtern werden nur einmal gesucht
+        pending = {}    # Cache-Key -> (Anfrage, Filter, Nummern der Anfragen)
+        for i, (user_input, filters) in enumerate(items):
+            key = cache_key(user_input, filters)[1]
+            pending.setdefault(key, (user_input.strip(), filters, []))[2].append(i)
+
+        to_embed = []
+        for key, (query, filters, numbers) in pending.items():
+            results = results_cache.get(key, generation)
+            if results is None:
+                results = await asyncio.to_thread(search_exact, query, filters)
+                if results is None:
+                    to_embed.append(key)
+                    continue
+                results_cache.put(key, generation, results)
+            for i in numbers:
+                yield i, results
+        if not to_embed:
+            return
+
+        query_vectors = await _db_manager.embeddings.aembed_queries([pending[key][0] for key in to_embed])
+        groups = {}     # Filter -> [(Cache-Key, Vektor), ...]
+        for key, query_vector in zip(to_embed, query_vectors):
+            groups.setdefault(pending[key][1], []).append((key, query_vector))
+        for filters, group in groups.items():
+            dense = await asyncio.to_thread(search_by_vectors, [v for _, v in group], filters)
+            for (key, _), results in zip(group, dense):
+                query, _, numbers = pending[key]
+                if HYBRID_SEARCH:
+                    results = fuse(results, await asyncio.to_thread(search_lexical, query, False, filters))
+                results_cache.put(key, generation, results)
+                for i in numbers:
+                    yield i, results
 
     class MyPipeline:
         """
@@ -48,17 +264,50 @@ def init_pipeline():
             res = pipeline.invoke({"input": query})
             return res, 200
         """
+        def search(self, query: str, filters: Optional[Dict[str, List[str]]] = None) -> List[SearchResult]:
+            # direkte Suche im selben Prozess (Suche.py), ohne JSON
+            return list(ranked(query, normalize_filters(filters)))
+
+        async def asearch(self, query: str, filters: Optional[Dict[str, List[str]]] = None) -> List[SearchResult]:
+            return list(await aranked(query, normalize_filters(filters)))
+
+        def search_page(self, query: str, offset: int = 0, limit: Optional[int] = None,
+                        filters: Optional[Dict[str, List[str]]] = None) -> SearchPage:
+            # Chroma kennt keinen Offset: alle Ergebnisse werden einmal
+            # gesucht und zwischengespeichert, jede Seite ist ein Ausschnitt davon
+            return paginate(ranked(query, normalize_filters(filters)), offset, limit)
+
+        async def asearch_page(self, query: str, offset: int = 0, limit: Optional[int] = None,
+                               filters: Optional[Dict[str, List[str]]] = None) -> SearchPage:
+            return paginate(await aranked(query, normalize_filters(filters)), offset, limit)
+
+        def asearch_batch(self, queries: List[Dict]) -> AsyncIterator[Tuple[int, List[SearchResult]]]:
+            # [{"query": "...", "filters": {...}}, ...]; die Filter werden vorab
+            # geprüft (ValueError), die Ergebnisse kommen in der Reihenfolge, in der sie feststehen
+            items = [(q["query"], normalize_filters(q.get("filters"))) for q in queries]
+            return aranked_batch(items)
+
         def invoke(self, data: Dict) -> str:
             # Erwartet ein Dict mit {"input": "..."} 
             # (so war es in Ihrem alten Code per 'pipeline.invoke({"input": query})')
             user_input = data.get("input", "")
-            results = retrieve(user_input)
+            results = retrieve(user_input, normalize_filters(data.get("filters")))
             
             # Wir wandeln die Python-Liste in einen JSON-String um,
-            # damit Flask diesen String 1:1 an den Client schicken kann.
+            # damit der Server diesen String 1:1 an den Client schicken kann.
             # Auf Client-Seite kann man dann `response.json()` aufrufen.
-            json_str = json.dumps(results, ensure_ascii=False)
-            return json_str
+            return to_json(results)
+
+        async def ainvoke(self, data: Dict) -> str:
+            # asynchrone Variante von .invoke() für den ASGI-Server;
+            # mit "offset" oder "limit" wird nur diese Seite (mit Gesamtzahl und Facetten) zurückgegeben
+            user_input = data.get("input", "")
+            filters = data.get("filters")
+            if "offset" in data or "limit" in data:
+                page = await self.asearch_page(user_input, data.get("offset", 0), data.get("limit"), filters)
+                return await asyncio.to_thread(json.dumps, page.to_dict(), ensure_ascii=False)
+            results = await aranked(user_input, normalize_filters(filters))
+            return await asyncio.to_thread(to_json, results)
 
     return MyPipeline()
 
@@ -3,10 +3,12 @@
 import os
 import io
 import re
+import sys
 import unicodedata
 import unidecode
 import json
-from typing import List, Dict, Union
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, Dict, Union, Optional, Callable, Iterator
 
 from dotenv import load_dotenv
 
@@ -16,6 +18,8 @@ from PyPDF2 import PdfReader
 from langchain_openai import ChatOpenAI
 from langchain.prompts import ChatPromptTemplate
 
+from utils.ingestion import call_with_retry
+
 # -------------------------------------------------------------------------
 # Laden der Umgebungsvariablen und OpenAI-API-Key
 # -------------------------------------------------------------------------
@@ -71,6 +75,7 @@ PATTERNS_TO_REMOVE = [
     r'^in\s+EUR\s+in\s+EUR$'
 ]
 COMPILED_PATTERNS = [re.compile(pattern, re.IGNORECASE) for pattern in PATTERNS_TO_REMOVE]
+NON_WHITESPACE = re.compile(r'\S')
 
 # ------------------------------------------------------------------------------
 # Hilfsfunktionen
@@ -90,7 +95,8 @@ def clean_metadata(metadata: Dict) -> Dict:
 # ------------------------------------------------------------------------------
 # Schritt 1: PDF lesen + bereinigen (Pfad ODER Bytes)
 # ------------------------------------------------------------------------------
-def read_and_clean_pdf(pdf_input: Union[str, bytes, tuple]) -> List[Dict]:
+def open_pdf_input(pdf_input: Union[str, bytes, tuple]):
+    """Gibt das Dateiobjekt und den Dateinamen zu Pfad, Bytes oder (Name, Bytes) zurück."""
     if isinstance(pdf_input, tuple):
         pdf_path, pdf_bytes = pdf_input
         fileobj = io.BytesIO(pdf_bytes)
@@ -108,9 +114,11 @@ def read_and_clean_pdf(pdf_input: Union[str, bytes, tuple]) -> List[Dict]:
         fileobj = io.BytesIO(pdf_bytes)
         dateiname = "uploaded_file.pdf"  # Fallback
 
-    # Dann wie gehabt Auslesen via PyPDF2
+    return fileobj, dateiname
+
+def iter_clean_pages(fileobj) -> Iterator[str]:
+    """Liest die Seiten einzeln (lazy) via PyPDF2 und entfernt die Kopf-/Fußzeilen."""
     reader = PdfReader(fileobj)
-    cleaned_pages = []
     for page in reader.pages:
         page_text = page.extract_text() or ""
         lines = page_text.split('\n')
@@ -120,9 +128,14 @@ def read_and_clean_pdf(pdf_input: Union[str, bytes, tuple]) -> List[Dict]:
             if any(pattern.search(normalized_line) for pattern in COMPILED_PATTERNS):
                 continue
             cleaned_lines.append(line)
-        cleaned_pages.append('\n'.join(cleaned_lines))
+        yield '\n'.join(cleaned_lines)
 
-    fileobj.close()
+def read_and_clean_pdf(pdf_input: Union[str, bytes, tuple]) -> List[Dict]:
+    fileobj, dateiname = open_pdf_input(pdf_input)
+
+    # Dann wie gehabt Auslesen via PyPDF2
+    with fileobj:
+        cleaned_pages = list(iter_clean_pages(fileobj))
 
     # Text zusammenführen + Metadaten bereinigen
     full_text = "\n".join(cleaned_pages)
@@ -308,17 +321,22 @@ def extract_inhaltsverzeichnis_headings_level1(docs: List[Dict]) -> List[str]:
             break
     return headings
 
-def extract_ausschreibungstext(text: str, headings_level1: List[str]):
-    if not headings_level1:
-        return None, text
-
+def ausschreibungstext_start_pattern(headings_level1: List[str]):
+    """Muster für jede Überschrift der Ebene 1 aus dem Inhaltsverzeichnis."""
     patterns = []
     for heading in headings_level1:
         pat = re.escape(heading).replace(r'\ ', r'\s+')
         patterns.append(pat)
-    combined_pattern = re.compile(r'(' + '|'.join(patterns) + r')', re.IGNORECASE)
+    return re.compile(r'(' + '|'.join(patterns) + r')', re.IGNORECASE)
 
-    match = combined_pattern.search(text)
+def find_ausschreibungstext_start(text: str, headings_level1: List[str]):
+    """Sucht die erste Überschrift der Ebene 1 aus dem Inhaltsverzeichnis im Text."""
+    if not headings_level1:
+        return None
+    return ausschreibungstext_start_pattern(headings_level1).search(text)
+
+def extract_ausschreibungstext(text: str, headings_level1: List[str]):
+    match = find_ausschreibungstext_start(text, headings_level1)
     if not match:
         return None, text
 
@@ -328,17 +346,19 @@ def extract_ausschreibungstext(text: str, headings_level1: List[str]):
 
     return ausschreibung, rest
 
+# Ebene 2 (1.1.) oder 3 (1.1.1.); ohne Alternative am Anfang kann `re` bis zur
+# nächsten Ziffer springen, statt an jeder Position einen Treffer zu versuchen
+SUBCHAPTER_HEADING_PATTERN = re.compile(
+    r'(?P<level>\d+\.\d+\.(?:\d+\.)?)\s*(?P<title>[^\n]+)(?:\r?\n)+',
+    re.MULTILINE
+)
+
 def extract_subchapters(ausschreibungstext: str, base_metadata: Dict) -> List[Dict]:
     chunks = []
     if not ausschreibungstext.strip():
         return [{'text': ausschreibungstext, 'metadata': base_metadata}]
 
-    heading_pattern = re.compile(
-        r'(?P<level>(\d+\.\d+\.\d+\.|\d+\.\d+\.))\s*(?P<title>[^\n]+)(?:\r?\n)+',
-        re.MULTILINE
-    )
-
-    matches = list(heading_pattern.finditer(ausschreibungstext))
+    matches = list(SUBCHAPTER_HEADING_PATTERN.finditer(ausschreibungstext))
     if not matches:
         return [{
             'text': ausschreibungstext.strip(),
@@ -447,60 +467,397 @@ def unify_numberings_in_metadata(docs: List[Dict]) -> List[Dict]:
 # ------------------------------------------------------------------------------
 #  Schritt X: Junk entfernen
 # ------------------------------------------------------------------------------
-def remove_junk_chunks(docs: List[Dict]) -> List[Dict]:
+# längere Chunks sind nie Junk
+JUNK_MAX_LENGTH = 600
+
+def is_junk_text(txt: str) -> bool:
+    """Einzelne Verzeichniszeile oder Zusammenstellungs-/Projektkopf (txt bereits gestrippt)."""
+    if not txt:
+        return False
+
     single_line_pattern = re.compile(
         r'^[0-9]+\.[0-9]+(\.[0-9]+)*\.?\s+.+\.+\s*$'
     )
+    lines = txt.splitlines()
+    single_line_match = (
+        len(lines) == 1
+        and single_line_pattern.match(lines[0])
+        and len(txt) < 200
+    )
 
-    cleaned = []
-    for doc in docs:
-        txt = doc.get("text", "").strip()
-        if not txt:
-            cleaned.append(doc)
-            continue
+    has_zusammenstellung = "zusammenstellung" in txt.lower()
+    has_projekt = "projekt:" in txt.lower()
+    matches_numbering = bool(re.search(r'^\s*\d+\.\d+', txt, re.MULTILINE))
+    is_short = len(txt) < JUNK_MAX_LENGTH
 
-        lines = txt.splitlines()
-        single_line_match = (
-            len(lines) == 1
-            and single_line_pattern.match(lines[0])
-            and len(txt) < 200
-        )
-
-        has_zusammenstellung = "zusammenstellung" in txt.lower()
-        has_projekt = "projekt:" in txt.lower()
-        matches_numbering = bool(re.search(r'^\s*\d+\.\d+', txt, re.MULTILINE))
-        is_short = len(txt) < 600
-
-        multi_line_match = (
-            has_zusammenstellung
-            and has_projekt
-            and matches_numbering
-            and is_short
-        )
-
-        if single_line_match or multi_line_match:
-            continue
+    multi_line_match = (
+        has_zusammenstellung
+        and has_projekt
+        and matches_numbering
+        and is_short
+    )
 
-        cleaned.append(doc)
+    return bool(single_line_match or multi_line_match)
 
-    return cleaned
+def remove_junk_chunks(docs: List[Dict]) -> List[Dict]:
+    return [doc for doc in docs if not is_junk_text(doc.get("text", "").strip())]
 
 # ------------------------------------------------------------------------------
 #  Schritt 7: ASCII-Konvertierung
 # ------------------------------------------------------------------------------
+def ascii_metadata(metadata: Dict) -> Dict:
+    ascii_md = {}
+    for k, v in metadata.items():
+        ak = unidecode.unidecode(str(k))
+        av = unidecode.unidecode(str(v))
+        ascii_md[ak] = av
+    return ascii_md
+
 def ensure_ascii_conformance(docs: List[Dict]) -> List[Dict]:
     new_data = []
     for doc in docs:
         ascii_text = unidecode.unidecode(doc['text'])
-        ascii_md = {}
-        for k, v in doc.get('metadata', {}).items():
-            ak = unidecode.unidecode(str(k))
-            av = unidecode.unidecode(str(v))
-            ascii_md[ak] = av
-
-        new_data.append({'text': ascii_text, 'metadata': ascii_md})
+        new_data.append({'text': ascii_text, 'metadata': ascii_metadata(doc.get('metadata', {}))})
     return new_data
 
+# ------------------------------------------------------------------------------
+#  Chunks als Ausschnitte eines gemeinsamen Textpuffers
+# ------------------------------------------------------------------------------
+class MetadataPool:
+    """
+    Gleiche Metadaten (z.B. alle Chunks eines Unterkapitels) teilen sich ein
+    Dict. Die geteilten Dicts dürfen deshalb nicht verändert werden; jeder
+    Schritt legt neue Metadaten über `intern` an.
+    """
+    __slots__ = ('_entries',)
+
+    def __init__(self):
+        self._entries = {}
+
+    def intern(self, metadata: Dict) -> Dict:
+        key = tuple(metadata.items())
+        shared = self._entries.get(key)
+        if shared is None:
+            shared = self._entries[key] = {
+                sys.intern(k): sys.intern(v) if isinstance(v, str) else v
+                for k, v in metadata.items()
+            }
+        return shared
+
+class Chunk:
+    """
+    Ein Chunk als Ausschnitt buffer[start:end] eines Dokuments, das sich alle
+    Chunks teilen, mit geteilten Metadaten (siehe `MetadataPool`). Der Text
+    wird erst in `finish_chunks` erzeugt.
+    """
+    __slots__ = ('buffer', 'start', 'end', 'metadata')
+
+    def __init__(self, buffer: str, start: int, end: int, metadata: Dict):
+        self.buffer = buffer
+        self.start = start
+        self.end = end
+        self.metadata = metadata
+
+    @classmethod
+    def from_text(cls, text: str, metadata: Dict) -> 'Chunk':
+        return cls(text, 0, len(text), metadata)
+
+    @classmethod
+    def stripped(cls, buffer: str, start: int, end: int, metadata: Dict) -> 'Chunk':
+        """Wie buffer[start:end].strip(), aber ohne Kopie."""
+        while start < end and buffer[start].isspace():
+            start += 1
+        while end > start and buffer[end - 1].isspace():
+            end -= 1
+        return cls(buffer, start, end, metadata)
+
+    @property
+    def text(self) -> str:
+        return self.buffer[self.start:self.end]
+
+    def __len__(self) -> int:
+        return self.end - self.start
+
+    def stripped_length(self) -> int:
+        start, end = self.start, self.end
+        while start < end and self.buffer[start].isspace():
+            start += 1
+        while end > start and self.buffer[end - 1].isspace():
+            end -= 1
+        return end - start
+
+def finish_chunks(chunks: List[Chunk]) -> List[Dict]:
+    """
+    Schritte 6-7 für segmentierte Chunks. Die Metadaten werden pro geteiltem
+    Dict nur einmal umgeformt, der Text erst hier (ASCII) erzeugt.
+    """
+    finished_metadata = {}  # id(Metadaten) -> (Metadaten, fertige Metadaten)
+    docs = []
+    for chunk in chunks:
+        # 7) Junk entfernen: nur kurze Chunks kommen in Frage
+        if chunk.stripped_length() < JUNK_MAX_LENGTH and is_junk_text(chunk.text.strip()):
+            continue
+
+        entry = finished_metadata.get(id(chunk.metadata))
+        if entry is None:
+            # 6) Nummerierungen vereinheitlichen und ASCII
+            md = dict(chunk.metadata)
+            unify_numberings_in_metadata([{'metadata': md}])
+            entry = finished_metadata[id(chunk.metadata)] = (chunk.metadata, ascii_metadata(md))
+
+        docs.append({'text': unidecode.unidecode(chunk.text), 'metadata': dict(entry[1])})
+    return docs
+
+# ------------------------------------------------------------------------------
+#  Schritte 2-5 nacheinander
+# ------------------------------------------------------------------------------
+def incomplete_heading_length(headings_level1: List[str]) -> int:
+    """So viel Text am Ende kann noch zu einer Überschrift der Ebene 1 gehören."""
+    return 2 * max(len(heading) for heading in headings_level1) + 200
+
+def split_preamble(text: str, metadata: Dict):
+    """
+    Wendet die Schritte 2-4 auf den (bisher gelesenen) Anfang des Dokuments an
+    und sucht den Beginn des Ausschreibungstexts. Gibt ein Dict mit den Chunks
+    von Inhaltsverzeichnis, Vorbemerkungen und Baubeschreibung, dem Rest-Chunk
+    vor dem Ausschreibungstext und dessen Anfang in `text` zurück, oder None,
+    solange der Ausschreibungstext noch nicht sicher begonnen hat.
+    """
+    docs = [{'text': text, 'metadata': dict(metadata)}]
+    docs = process_inhaltsverzeichnis(docs)
+    docs = process_vorbemerkungen(docs)
+    docs = process_baubeschreibung(docs)
+    headings_level1 = extract_inhaltsverzeichnis_headings_level1(docs)
+
+    rest_doc = docs[-1]
+    rest_text = rest_doc['text']
+    match = find_ausschreibungstext_start(rest_text, headings_level1)
+    if not match:
+        return None
+    body_length = len(rest_text) - match.start()
+    # alle herausgeschnittenen Abschnitte müssen vor dem Ausschreibungstext
+    # liegen (sonst endet z.B. die Baubeschreibung erst später) ...
+    body_end = len(text.rstrip())
+    if not text.endswith(rest_text[match.start():], 0, body_end):
+        return None
+    # ... und eine frühere, noch unvollständige Überschrift ausgeschlossen sein
+    if body_length <= incomplete_heading_length(headings_level1):
+        return None
+
+    rest_doc['text'] = rest_text[:match.start()].strip()
+    return {
+        'preamble_docs': docs[:-1],
+        'rest_doc': rest_doc,
+        'body_start': body_end - body_length
+    }
+
+def segment_sequentially(docs: List[Dict]) -> List[Dict]:
+    """Die Schritte 2-5 nacheinander."""
+    docs = process_inhaltsverzeichnis(docs)
+    docs = process_vorbemerkungen(docs)
+    docs = process_baubeschreibung(docs)
+    return process_ausschreibungstext(docs)
+
+def to_chunks(docs: List[Dict], pool: MetadataPool) -> List[Chunk]:
+    """Die Dicts der Schritte 2-5 als Chunks für `finish_chunks`."""
+    return [Chunk.from_text(doc['text'], pool.intern(doc['metadata'])) for doc in docs]
+
+# ------------------------------------------------------------------------------
+#  Streaming-Modus: Schritte 1-7 seitenweise
+# ------------------------------------------------------------------------------
+class SubchapterStream:
+    """
+    Seitenweise Variante von `extract_subchapters`: ein Unterkapitel wird
+    ausgegeben, sobald die nächste Überschrift feststeht. Gepuffert wird nur
+    der Text ab der letzten Überschrift.
+    """
+
+    def __init__(self, base_metadata: Dict, pool: MetadataPool):
+        self.base_metadata = base_metadata
+        self.pool = pool
+        self.buffer = ""
+        self.scan_pos = 0           # Ende der letzten bestätigten Überschrift
+        self.metadata = None        # Metadaten des aktuellen Unterkapitels
+
+    def _segment(self, end: int) -> List[Chunk]:
+        chunk = Chunk.stripped(self.buffer, 0, end, self.metadata)
+        return [chunk] if len(chunk) else []
+
+    def _scan(self, final: bool) -> List[Chunk]:
+        chunks = []
+        while m := SUBCHAPTER_HEADING_PATTERN.search(self.buffer, self.scan_pos):
+            # erst bestätigt, wenn danach noch Text folgt (der Gesamttext wird am Ende gestrippt)
+            if not final and not NON_WHITESPACE.search(self.buffer, m.end()):
+                break
+            if self.metadata is None:
+                self.metadata = self.pool.intern(
+                    {**self.base_metadata, 'subsection': None, 'subsubsection': None}
+                )
+            if m.start() > 0:
+                chunks.extend(self._segment(m.start()))
+
+            level = m.group('level').strip()
+            title = m.group('title').strip()
+            level_depth = level.count('.')
+            if level_depth == 2:
+                self.metadata = self.pool.intern(
+                    {**self.metadata, 'subsection': f"{level} {title}", 'subsubsection': None}
+                )
+            elif level_depth == 3:
+                self.metadata = self.pool.intern({**self.metadata, 'subsubsection': f"{level} {title}"})
+
+            # Text vor der Überschrift wird nicht mehr gebraucht
+            self.scan_pos = m.end() - m.start()
+            self.buffer = self.buffer[m.start():]
+        return chunks
+
+    def feed(self, text: str) -> List[Chunk]:
+        self.buffer += text
+        return self._scan(final=False)
+
+    def close(self) -> List[Chunk]:
+        self.buffer = self.buffer.rstrip()
+        chunks = self._scan(final=True)
+        if self.metadata is None:
+            # keine Überschriften gefunden -> gesamter Text als ein Chunk
+            return [Chunk.stripped(self.buffer, 0, len(self.buffer), self.pool.intern(self.base_metadata))]
+        return chunks + self._segment(len(self.buffer))
+
+TOC_START_PATTERN = re.compile(r'Inhaltsverzeichnis', re.IGNORECASE)
+TOC_END_PATTERN = re.compile(r'Zusammenstellung.*(?:\n|$)', re.IGNORECASE)
+
+def toc_headings_level1(toc: str, metadata: Dict) -> List[str]:
+    """
+    Die Überschriften der Ebene 1, die `split_preamble` aus dem
+    Inhaltsverzeichnis `toc` gewinnt (die Schritte 3-4 verändern auch den
+    Chunk des Inhaltsverzeichnisses).
+    """
+    docs = [{'text': toc, 'metadata': {**metadata, 'section': 'Inhaltsverzeichnis'}}]
+    docs = process_vorbemerkungen(docs)
+    docs = process_baubeschreibung(docs)
+    return extract_inhaltsverzeichnis_headings_level1(docs)
+
+class PreambleScanner:
+    """
+    Entscheidet seitenweise, wann `split_preamble` den Ausschreibungstext
+    finden kann. Jede Seite wird nur einmal durchsucht: erst nach dem
+    Inhaltsverzeichnis und seinem Ende, danach nach den Überschriften der
+    Ebene 1. `split_preamble` (über den ganzen bisherigen Text) läuft erst,
+    wenn eine solche Überschrift gelesen wurde.
+    """
+
+    def __init__(self, metadata: Dict):
+        self.metadata = metadata
+        self.scan_pos = 0           # bis hierhin ist der Text durchsucht
+        self.toc_start = None       # Anfang des Inhaltsverzeichnisses
+        self.toc_complete = False
+        self.start_pattern = None   # Überschriften der Ebene 1, sobald das Inhaltsverzeichnis vollständig ist
+        self.margin = 0             # Länge einer noch unvollständigen Überschrift
+        self.candidate = None       # Anfang der gelesenen Überschrift, für die `split_preamble` läuft
+
+    def _scan_toc(self, text: str) -> bool:
+        # "Inhaltsverzeichnis" und "Zusammenstellung" reichen nicht über ein
+        # Seitenende, neue Treffer liegen also hinter `scan_pos`
+        if self.toc_start is None:
+            match = TOC_START_PATTERN.search(text, self.scan_pos)
+            if not match:
+                self.scan_pos = len(text)
+                return False
+            self.toc_start = match.start()
+            self.scan_pos = match.end()
+
+        match = TOC_END_PATTERN.search(text, self.scan_pos)
+        if not match:
+            self.scan_pos = len(text)
+            return False
+        if not match.group().endswith("\n"):
+            # die Zeile kann auf der nächsten Seite weitergehen
+            self.scan_pos = match.start()
+            return False
+
+        headings_level1 = toc_headings_level1(text[self.toc_start:match.end()].strip(), self.metadata)
+        self.toc_complete = True
+        self.scan_pos = match.end()
+        if headings_level1:
+            self.start_pattern = ausschreibungstext_start_pattern(headings_level1)
+            self.margin = incomplete_heading_length(headings_level1)
+        return True
+
+    def split(self, text: str) -> Optional[Dict]:
+        """
+        `split_preamble(text, ...)` für den bisher gelesenen Text, oder None
+        ohne Aufruf, solange der Ausschreibungstext nicht begonnen haben kann.
+        """
+        if not self.toc_complete and not self._scan_toc(text):
+            return None
+        if self.start_pattern is None:
+            # Inhaltsverzeichnis ohne Überschriften: kein Ausschreibungstext
+            return None
+
+        while True:
+            if self.candidate is None:
+                match = self.start_pattern.search(text, self.scan_pos)
+                if not match:
+                    self.scan_pos = max(self.scan_pos, len(text) - self.margin)
+                    return None
+                self.candidate = match.start()
+
+            preamble = split_preamble(text, self.metadata)
+            if preamble or len(text) - self.candidate <= self.margin:
+                # zu wenig Text nach der Überschrift: mit der nächsten Seite erneut
+                return preamble
+            # die Überschrift liegt nicht am Anfang des Ausschreibungstexts (später
+            # gelesener Text kann daran nichts ändern): die nächste versuchen
+            self.scan_pos = self.candidate + 1
+            self.candidate = None
+
+def stream_chunks(pdf_input: Union[str, bytes, tuple]) -> Iterator[Dict]:
+    """
+    Streaming-Variante der Schritte 1-7. Die Seiten werden einzeln aus dem
+    PdfReader gelesen; Inhaltsverzeichnis, Vorbemerkungen und Baubeschreibung
+    werden ausgegeben, sobald der Ausschreibungstext beginnt, danach jedes
+    Unterkapitel, sobald die nächste Überschrift gelesen ist. Der Speicherbedarf
+    richtet sich so nach dem größten Abschnitt statt nach dem ganzen Dokument.
+
+    Vorausgesetzt wird die übliche Reihenfolge der Abschnitte (Inhaltsverzeichnis,
+    Vorbemerkungen, Baubeschreibung vor dem Ausschreibungstext). Wird kein
+    Ausschreibungstext gefunden, wird das Dokument wie in `prepare_data` im
+    Ganzen verarbeitet.
+    """
+    fileobj, dateiname = open_pdf_input(pdf_input)
+    metadata = clean_metadata({"Dateiname": dateiname})
+    pool = MetadataPool()
+
+    with fileobj:
+        pages = iter_clean_pages(fileobj)
+        text = None
+        preamble = None
+        scanner = PreambleScanner(metadata)
+        for page in pages:
+            text = page if text is None else text + "\n" + page
+            preamble = scanner.split(text)
+            if preamble:
+                break
+
+        if preamble is None:
+            yield from finish_chunks(to_chunks(segment_sequentially([{'text': text or "", 'metadata': metadata}]), pool))
+            return
+
+        rest_doc = preamble['rest_doc']
+        body = text[preamble['body_start']:]
+        del text
+        yield from finish_chunks(to_chunks(preamble['preamble_docs'], pool))
+
+        subchapters = SubchapterStream({**rest_doc['metadata'], 'section': 'Ausschreibungstext'}, pool)
+        yield from finish_chunks(subchapters.feed(body))
+        for page in pages:
+            yield from finish_chunks(subchapters.feed("\n" + page))
+        yield from finish_chunks(subchapters.close())
+
+    # der Rest vor dem Ausschreibungstext kommt wie in `process_ausschreibungstext` zuletzt
+    if rest_doc['text']:
+        yield from finish_chunks(to_chunks([rest_doc], pool))
+
 # ------------------------------------------------------------------------------
 #  Schritt 8: Zusammenfassung erstellen (mit Token-Logik)
 # ------------------------------------------------------------------------------
@@ -515,75 +872,178 @@ except ImportError:
         words = len(text.split())
         return int(words / 1.3)
 
-def make_summaries(docs: List[Dict]) -> List[Dict]:
-    new_docs = []
-    for doc in docs:
-        txt = doc.get("text", "").strip()
-        md = doc.get("metadata", {})
-
-        # Metadaten in menschenlesbarem String
-        meta_str = []
-        if "Dateiname" in md:
-            meta_str.append(f"Dateiname: {md['Dateiname']}")
-        if "section" in md:
-            meta_str.append(f"section: {md['section']}")
-        if "subsection" in md:
-            meta_str.append(f"subsection: {md['subsection']}")
-        if "subsubsection" in md:
-            meta_str.append(f"subsubsection: {md['subsubsection']}")
-        if "subsection_number" in md:
-            meta_str.append(f"subsection_number: {md['subsection_number']}")
-
-        meta_as_text = "\n".join(meta_str).strip()
-
-        # Token-Zählung
-        token_count = count_tokens(txt)
-
-        # < 300 Tokens -> Originaltext inkl. Metadaten
-        if token_count < 300:
-            doc["summary"] = f"{txt}\n\n[METADATEN]\n{meta_as_text}"
+# Nebenläufigkeit der LLM-Aufrufe und Wiederholungen pro Chunk
+SUMMARY_MAX_CONCURRENCY = int(os.getenv("SUMMARY_MAX_CONCURRENCY", 8))
+SUMMARY_MAX_ATTEMPTS = int(os.getenv("SUMMARY_MAX_ATTEMPTS", 3))
+
+def metadata_to_text(md: Dict) -> str:
+    """Metadaten in menschenlesbarem String (Eingabe für den Prompt)."""
+    meta_str = []
+    if "Dateiname" in md:
+        meta_str.append(f"Dateiname: {md['Dateiname']}")
+    if "section" in md:
+        meta_str.append(f"section: {md['section']}")
+    if "subsection" in md:
+        meta_str.append(f"subsection: {md['subsection']}")
+    if "subsubsection" in md:
+        meta_str.append(f"subsubsection: {md['subsubsection']}")
+    if "subsection_number" in md:
+        meta_str.append(f"subsection_number: {md['subsection_number']}")
+    return "\n".join(meta_str).strip()
+
+def summarize_with_retry(summarizer, prompt_input: Dict, max_attempts: int) -> str:
+    """Fasst einen Chunk zusammen; wiederholt bei Fehlern mit exponentiellem Backoff."""
+    return call_with_retry(summarizer.invoke, max_attempts, prompt_input).content
+
+def prepare_summary(doc: Dict, summary_cache=None) -> Optional[Dict]:
+    """
+    Setzt doc["summary"], wenn kein LLM-Aufruf nötig ist (Chunk unter
+    300 Tokens oder Treffer im `summary_cache`); gibt sonst die
+    Prompt-Eingabe für das LLM zurück.
+    """
+    txt = doc.get("text", "").strip()
+    meta_as_text = metadata_to_text(doc.get("metadata", {}))
+
+    # Token-Zählung
+    token_count = count_tokens(txt)
+
+    # < 300 Tokens -> Originaltext inkl. Metadaten
+    if token_count < 300:
+        doc["summary"] = f"{txt}\n\n[METADATEN]\n{meta_as_text}"
+        return None
+    if summary_cache is not None and (cached := summary_cache.get_summary(txt, meta_as_text)) is not None:
+        doc["summary"] = cached
+        return None
+    return {"text": txt, "metadata": meta_as_text}
+
+def is_passthrough(doc: Dict) -> bool:
+    """Ob doc["summary"] der unveränderte Text mit Metadaten ist (Chunk unter 300 Tokens, siehe `prepare_summary`)."""
+    return doc.get("summary", "").startswith(f"{doc.get('text', '').strip()}\n\n[METADATEN]\n")
+
+def summarize_chunk(
+    doc: Dict,
+    summarizer=SUMMARIZER,
+    max_attempts: int = SUMMARY_MAX_ATTEMPTS,
+    summary_cache=None
+) -> Dict:
+    """Zusammenfassung eines einzelnen Chunks wie in `make_summaries` (im aufrufenden Thread)."""
+    prompt_input = prepare_summary(doc, summary_cache)
+    if prompt_input is not None:
+        doc["summary"] = summarize_with_retry(summarizer, prompt_input, max_attempts)
+        if summary_cache is not None:
+            summary_cache.put_summary(prompt_input["text"], prompt_input["metadata"], doc["summary"])
+    return doc
+
+def make_summaries(
+    docs: List[Dict],
+    summarizer=SUMMARIZER,
+    max_concurrency: int = SUMMARY_MAX_CONCURRENCY,
+    max_attempts: int = SUMMARY_MAX_ATTEMPTS,
+    on_progress: Optional[Callable[[int, int], None]] = None,
+    summary_cache=None
+) -> List[Dict]:
+    """
+    Erstellt die Zusammenfassungen der Chunks.
+
+    Chunks unter 300 Tokens werden direkt übernommen, alle anderen werden
+    nebenläufig an das LLM geschickt (höchstens `max_concurrency` Anfragen
+    gleichzeitig). Jeder Chunk wird bei Fehlern einzeln bis zu `max_attempts`
+    Mal wiederholt; die Reihenfolge der Chunks bleibt unverändert.
+    `on_progress(fertig, gesamt)` wird nach jedem fertigen Chunk im
+    aufrufenden Thread aufgerufen.
+
+    Mit `summary_cache` (siehe utils/caching.py) werden bereits bekannte
+    Zusammenfassungen wiederverwendet und neue dort abgelegt.
+    """
+    total = len(docs)
+    done = 0
+
+    def report():
+        nonlocal done
+        done += 1
+        if on_progress:
+            on_progress(done, total)
+
+    pending = []    # (Index des Chunks, Prompt-Eingabe)
+    for i, doc in enumerate(docs):
+        prompt_input = prepare_summary(doc, summary_cache)
+        if prompt_input is None:
+            report()
         else:
-            prompt_input = {"text": txt, "metadata": meta_as_text}
-            result = SUMMARIZER.invoke(prompt_input)
-            doc["summary"] = result.content
+            pending.append((i, prompt_input))
+
+    if pending:
+        pending_inputs = dict(pending)
+        errors = []
+        with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+            futures = {
+                executor.submit(summarize_with_retry, summarizer, prompt_input, max_attempts): i
+                for i, prompt_input in pending
+            }
+            for future in as_completed(futures):
+                i = futures[future]
+                try:
+                    docs[i]["summary"] = future.result()
+                except Exception as e:
+                    errors.append(e)
+                else:
+                    if summary_cache is not None:
+                        prompt_input = pending_inputs[i]
+                        summary_cache.put_summary(
+                            prompt_input["text"], prompt_input["metadata"], docs[i]["summary"]
+                        )
+                report()
+        # erst nach allen Chunks abbrechen, damit keine laufende Anfrage verloren geht
+        if errors:
+            raise errors[0]
 
-        new_docs.append(doc)
-    return new_docs
+    return docs
 
 # ------------------------------------------------------------------------------
 #  Komplette Pipeline
 # ------------------------------------------------------------------------------
-def prepare_data(pdf_input: Union[str, bytes, tuple]) -> List[Dict]:
+def prepare_data(
+    pdf_input: Union[str, bytes, tuple],
+    on_progress: Optional[Callable[[int, int], None]] = None,
+    summary_cache=None,
+    summarize: bool = True,
+    streaming: bool = False
+) -> Union[List[Dict], Iterator[Dict]]:
     """
     pdf_input kann sein:
     - Ein Pfad (str),
     - Nur Bytes (bytes),
     - Oder (filename, bytes) als Tuple.
-    """
-    documents = read_and_clean_pdf(pdf_input)
-
-    # 2) Inhaltsverzeichnis
-    documents = process_inhaltsverzeichnis(documents)
 
-    # 3) Vorbemerkungen
-    documents = process_vorbemerkungen(documents)
-
-    # 4) Baubeschreibung
-    documents = process_baubeschreibung(documents)
-
-    # 5) Ausschreibungstext
-    documents = process_ausschreibungstext(documents)
+    on_progress(fertig, gesamt) meldet den Fortschritt der Zusammenfassungen,
+    summary_cache speichert sie dauerhaft zwischen. Mit summarize=False
+    entfällt Schritt 9, die Chunks haben dann noch kein Feld "summary".
+    Mit streaming=True laufen die Schritte 1-7 seitenweise (`stream_chunks`);
+    ohne Zusammenfassungen werden die Chunks dann als Iterator zurückgegeben.
+    """
+    if streaming:
+        documents = stream_chunks(pdf_input)
+        if summarize:
+            # für den Fortschritt muss die Zahl der Chunks feststehen
+            documents = make_summaries(list(documents), on_progress=on_progress, summary_cache=summary_cache)
+        return documents
 
-    # 6) Nummerierungen vereinheitlichen
-    documents = unify_numberings_in_metadata(documents)
+    documents = read_and_clean_pdf(pdf_input)
 
-    # 7) Junk entfernen
-    documents = remove_junk_chunks(documents)
+    # 2-5) Inhaltsverzeichnis, Vorbemerkungen, Baubeschreibung, Ausschreibungstext
+    chunks = to_chunks(segment_sequentially(documents), MetadataPool())
+    del documents
 
-    # 8) ASCII
-    documents = ensure_ascii_conformance(documents)
+    # 6-8) Nummerierungen vereinheitlichen, Junk entfernen, ASCII; erst hier entstehen die Texte
+    documents = finish_chunks(chunks)
+    del chunks
 
     # 9) Summaries
-    documents = make_summaries(documents)
+    if summarize:
+        documents = make_summaries(documents, on_progress=on_progress, summary_cache=summary_cache)
 
     return documents
+
+def extract_chunk_list(pdf_input: Union[str, bytes, tuple], streaming: bool = False) -> List[Dict]:
+    """Die Schritte 1-7 als Liste, z.B. als Ergebnis eines anderen Prozesses."""
+    return list(prepare_data(pdf_input, summarize=False, streaming=streaming))
@@ -0,0 +1,231 @@
+import os
+import json
+from collections import Counter
+from typing import List, Dict, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Ist die Variable gesetzt, sucht die Seite über HTTP in einem entfernten Backend
+# (z.B. "http://suche.intern:5000"), sonst direkt in diesem Prozess.
+SEARCH_BACKEND_URL = os.getenv("SEARCH_BACKEND_URL")
+# maximale Anzahl offener Verbindungen zum entfernten Backend
+SEARCH_POOL_SIZE = int(os.getenv("SEARCH_POOL_SIZE", 10))
+# Timeout einer Suchanfrage an das entfernte Backend in Sekunden
+SEARCH_TIMEOUT = float(os.getenv("SEARCH_TIMEOUT", 60))
+
+# Metadaten, nach denen die Suche eingeschränkt werden kann
+FILTER_FIELDS = ("Dateiname", "section", "subsection", "subsubsection", "subsection_number")
+# Metadaten, deren Werte in den Ergebnissen gezählt werden (Facetten)
+FACET_FIELDS = ("Dateiname", "section")
+
+# Filter in kanonischer Form: ((Feld, (Wert, ...)), ...), sortiert und hashbar,
+# damit gleiche Filter denselben Cache-Eintrag treffen
+Filters = Tuple[Tuple[str, Tuple[str, ...]], ...]
+
+
+def normalize_filters(filters: Optional[Dict[str, List[str]]]) -> Filters:
+    """
+    Bringt Filter der Form {"Dateiname": ["a.pdf", "b.pdf"], "section": ["Baubeschreibung"]}
+    in die kanonische Form. Ein Chunk passt, wenn er für jedes Feld einen der Werte hat.
+    """
+    if not filters:
+        return ()
+    unknown = set(filters).difference(FILTER_FIELDS)
+    if unknown:
+        raise ValueError(f"Unbekannte Filterfelder {sorted(unknown)}, erlaubt sind {list(FILTER_FIELDS)}")
+    return tuple(
+        (field, tuple(sorted(set(values))))
+        for field, values in sorted(filters.items()) if values
+    )
+
+
+def chroma_where(filters: Filters) -> Optional[Dict]:
+    # `where`-Klausel von Chroma zu den Filtern
+    clauses = [{field: {"$in": list(values)}} for field, values in filters]
+    if not clauses:
+        return None
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+
+def facet_counts(results: List["SearchResult"], fields=FACET_FIELDS) -> Dict[str, Dict[str, int]]:
+    # Anzahl der Ergebnisse pro Wert, häufigste zuerst
+    return {
+        field: dict(Counter(r.metadata[field] for r in results if field in r.metadata).most_common())
+        for field in fields
+    }
+
+
+class SearchResult:
+    """
+    Ein gefundener Chunk: seine ID in der Collection, der Originaltext,
+    seine Metadaten und der Score (höher ist besser). Der Score ist die
+    Relevanz der Vektorsuche (zwischen 0 und 1), bei hybriden Suchen
+    (HYBRID_SEARCH=1) der Score der Reciprocal Rank Fusion, bei rein
+    lexikalischen der BM25-Score.
+    """
+
+    __slots__ = ("id", "text", "metadata", "score")
+
+    def __init__(self, id: Optional[str], text: str, metadata: Dict, score: float):
+        self.id = id
+        self.text = text
+        self.metadata = metadata
+        self.score = score
+
+    @classmethod
+    def from_dict(cls, d: Dict) -> "SearchResult":
+        return cls(d.get("id"), d["text"], d["metadata"], d["score"])
+
+    def to_dict(self) -> Dict:
+        # Format der Antworten von /get
+        return {"id": self.id, "text": self.text, "metadata": self.metadata, "score": self.score}
+
+    def __repr__(self):
+        return f"SearchResult(score={self.score:.3f}, metadata={self.metadata!r})"
+
+
+class SearchPage:
+    """
+    Ein Ausschnitt der Ergebnisse einer Suche: `results` beginnt beim
+    Ergebnis Nr. `offset`, `total` ist die Anzahl aller Ergebnisse und
+    `facets` zählt sie pro Datei und Abschnitt (siehe `facet_counts`).
+    """
+
+    __slots__ = ("results", "total", "offset", "limit", "facets")
+
+    def __init__(self, results: List[SearchResult], total: int, offset: int, limit: Optional[int], facets: Optional[Dict] = None):
+        self.results = results
+        self.total = total
+        self.offset = offset
+        self.limit = limit
+        self.facets = facets or {}
+
+    @classmethod
+    def from_dict(cls, d: Dict) -> "SearchPage":
+        return cls(
+            [SearchResult.from_dict(r) for r in d["results"]],
+            d["total"], d["offset"], d["limit"], d.get("facets")
+        )
+
+    def to_dict(self) -> Dict:
+        # Format der Antworten von /get mit offset/limit
+        return {
+            "total": self.total,
+            "offset": self.offset,
+            "limit": self.limit,
+            "facets": self.facets,
+            "results": [r.to_dict() for r in self.results]
+        }
+
+
+def paginate(results: List[SearchResult], offset: int = 0, limit: Optional[int] = None) -> SearchPage:
+    if offset < 0:
+        raise ValueError(f"offset muss >= 0 sein, nicht {offset}")
+    if limit is not None and limit < 1:
+        raise ValueError(f"limit muss >= 1 sein, nicht {limit}")
+    end = None if limit is None else offset + limit
+    return SearchPage(results[offset:end], len(results), offset, limit, facet_counts(results))
+
+
+class SearchError(Exception):
+    """Die Suche ist fehlgeschlagen (lokal oder im entfernten Backend)."""
+
+
+class RemoteSearchClient:
+    """
+    Sucht über die HTTP-Schnittstelle (`/get`) eines entfernten Backends.
+    Die Verbindungen werden in einer `requests.Session` wiederverwendet,
+    sodass nicht für jede Suche eine neue TCP-Verbindung aufgebaut wird.
+    """
+
+    def __init__(self, base_url: str, pool_size: int = SEARCH_POOL_SIZE, timeout: float = SEARCH_TIMEOUT):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def _get(self, params: Dict, path: str = "/get"):
+        try:
+            response = self.session.get(f"{self.base_url}{path}", params=params, timeout=self.timeout)
+        except requests.RequestException as e:
+            raise SearchError(f"Das Backend {self.base_url} ist nicht erreichbar: {e}") from e
+        if response.status_code != 200:
+            raise SearchError(f"Fehler ({response.status_code}): {response.text}")
+        return json.loads(response.content)
+
+    def search(self, query: str, filters: Optional[Dict[str, List[str]]] = None) -> List[SearchResult]:
+        return [SearchResult.from_dict(d) for d in self._get({"query": query, **(filters or {})})]
+
+    def search_page(self, query: str, offset: int = 0, limit: Optional[int] = None,
+                    filters: Optional[Dict[str, List[str]]] = None) -> SearchPage:
+        # übertragen werden nur die Ergebnisse der angeforderten Seite;
+        # Filter als wiederholte Parameter, z.B. ?Dateiname=a.pdf&Dateiname=b.pdf
+        params = {"query": query, "offset": offset, **(filters or {})}
+        if limit is not None:
+            params["limit"] = limit
+        return SearchPage.from_dict(self._get(params))
+
+    def stats(self) -> Dict:
+        # Statistiken der Collection im Backend (siehe `DBManager.stats`)
+        return self._get({}, "/stats")
+
+    def healthcheck(self) -> bool:
+        try:
+            return self.session.get(f"{self.base_url}/healthcheck", timeout=self.timeout).status_code == 200
+        except requests.RequestException:
+            return False
+
+    def close(self) -> None:
+        self.session.close()
+
+
+class LocalSearchClient:
+    """
+    Sucht direkt im Vectorstore dieses Prozesses: ohne HTTP und ohne die
+    Ergebnisse nach JSON und zurück umzuwandeln.
+    """
+
+    def __init__(self):
+        # erst hier importieren, damit der entfernte Modus den lokalen
+        # Vectorstore nicht öffnet
+        from utils.pipeline import pipeline
+        from utils.db_management import _db_manager
+        self._pipeline = pipeline
+        self._db_manager = _db_manager
+
+    def search(self, query: str, filters: Optional[Dict[str, List[str]]] = None) -> List[SearchResult]:
+        try:
+            return self._pipeline.search(query, filters)
+        except Exception as e:
+            raise SearchError(str(e)) from e
+
+    def search_page(self, query: str, offset: int = 0, limit: Optional[int] = None,
+                    filters: Optional[Dict[str, List[str]]] = None) -> SearchPage:
+        try:
+            return self._pipeline.search_page(query, offset, limit, filters)
+        except Exception as e:
+            raise SearchError(str(e)) from e
+
+    def stats(self) -> Dict:
+        return self._db_manager.stats()
+
+    def healthcheck(self) -> bool:
+        return True
+
+    def close(self) -> None:
+        pass
+
+
+def get_search_client(base_url: Optional[str] = SEARCH_BACKEND_URL):
+    """
+    Gibt den Client für die Suche zurück: den entfernten, wenn `base_url`
+    gesetzt ist, sonst den lokalen. Beide haben dieselben Methoden
+    `.search(query, filters)`, `.search_page(query, offset, limit, filters)`
+    und `.stats()`.
+    """
+    if base_url:
+        return RemoteSearchClient(base_url)
+    return LocalSearchClient()
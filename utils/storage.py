@@ -0,0 +1,16 @@
+import os
+import sqlite3
+
+
+def open_shared_sqlite(path):
+	"""
+	Opens the SQLite database at `path` (creating its directory) for use
+	from several threads: the streamlit sessions, the ingestion and the
+	server thread share one connection, so callers serialize their access
+	with a lock of their own. WAL lets readers of other connections go on
+	while it writes.
+	"""
+	os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+	conn = sqlite3.connect(path, check_same_thread=False)
+	conn.execute("PRAGMA journal_mode=WAL")
+	return conn
@@ -0,0 +1,215 @@
+import os
+import math
+import threading
+from typing import List, Tuple, Optional
+
+import numpy as np
+
+from utils.storage import open_shared_sqlite
+
+# rows the vector file grows by at least (it doubles beyond that)
+INITIAL_CAPACITY = 1024
+# queries scored together in one matrix product by `search_batch`
+QUERY_BLOCK = int(os.getenv("VECTOR_QUERY_BLOCK", 64))
+
+
+def relevance_scores(similarities: np.ndarray) -> np.ndarray:
+	# the relevance of the Chroma path (squared L2 distance of unit vectors,
+	# see `VectorStore._euclidean_relevance_score_fn`), so thresholds keep their meaning
+	return 1.0 - (2.0 - 2.0 * similarities) / math.sqrt(2)
+
+
+class NumpyVectorIndex:
+	"""
+	Exact (brute-force) nearest neighbour search over a contiguous float32
+	matrix of unit vectors, memory-mapped from `<path>.npy`. New vectors are
+	appended in place; deleted ones are only marked (tombstones) and
+	dropped by `compact` once they make up half of the rows. The row ->
+	chunk id mapping and the tombstones are kept in `<path>.sqlite`; rows
+	are recorded there only after their vectors are flushed, so a crash in
+	between leaves unused rows behind, never rows without vectors.
+	"""
+
+	def __init__(self, path, dimensions):
+		self.dimensions = dimensions
+		self._vectors_path = f"{path}.npy"
+		self._lock = threading.Lock()
+		self._conn = open_shared_sqlite(f"{path}.sqlite")
+		self._conn.execute(
+			"CREATE TABLE IF NOT EXISTS rows ("
+			"row INTEGER PRIMARY KEY, id TEXT NOT NULL, deleted INTEGER NOT NULL DEFAULT 0)"
+		)
+		self._conn.commit()
+		self._ids = []
+		self._row_of = {}
+		deleted_rows = []
+		for row, chunk_id, deleted in self._conn.execute("SELECT row, id, deleted FROM rows ORDER BY row"):
+			self._ids.append(chunk_id)
+			if deleted:
+				deleted_rows.append(row)
+			else:
+				self._row_of[chunk_id] = row
+		if os.path.exists(self._vectors_path):
+			self._vectors = np.load(self._vectors_path, mmap_mode="r+")
+		else:
+			self._vectors = self._create(INITIAL_CAPACITY)
+		self._alive = np.zeros(len(self._vectors), dtype=bool)
+		self._alive[:len(self._ids)] = True
+		self._alive[deleted_rows] = False
+
+	def _create(self, capacity) -> np.memmap:
+		return np.lib.format.open_memmap(
+			self._vectors_path, mode="w+", dtype=np.float32, shape=(capacity, self.dimensions)
+		)
+
+	def _grow(self, needed):
+		capacity = max(len(self._vectors) * 2, needed, INITIAL_CAPACITY)
+		tmp_path = f"{self._vectors_path}.tmp.npy"
+		grown = np.lib.format.open_memmap(
+			tmp_path, mode="w+", dtype=np.float32, shape=(capacity, self.dimensions)
+		)
+		grown[:len(self._ids)] = self._vectors[:len(self._ids)]
+		grown.flush()
+		del grown
+		self._vectors = None
+		os.replace(tmp_path, self._vectors_path)
+		self._vectors = np.load(self._vectors_path, mmap_mode="r+")
+		alive = np.zeros(capacity, dtype=bool)
+		alive[:len(self._alive)] = self._alive
+		self._alive = alive
+
+	def _mark_deleted(self, ids):
+		rows = [self._row_of.pop(chunk_id) for chunk_id in ids if chunk_id in self._row_of]
+		self._alive[rows] = False
+		self._conn.executemany("UPDATE rows SET deleted = 1 WHERE row = ?", [(row,) for row in rows])
+		return len(rows)
+
+	def add(self, ids: List[str], vectors):
+		"""Appends `vectors` (normalized here); ids that are already indexed are replaced."""
+		vectors = np.asarray(vectors, dtype=np.float32).reshape(len(ids), self.dimensions)
+		norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+		vectors = vectors / np.where(norms == 0, 1, norms)
+		with self._lock:
+			self._mark_deleted(ids)
+			start = len(self._ids)
+			if start + len(ids) > len(self._vectors):
+				self._grow(start + len(ids))
+			self._vectors[start:start + len(ids)] = vectors
+			self._vectors.flush()
+			self._conn.executemany(
+				"INSERT INTO rows (row, id) VALUES (?, ?)",
+				[(start + i, chunk_id) for i, chunk_id in enumerate(ids)]
+			)
+			self._conn.commit()
+			self._ids.extend(ids)
+			for i, chunk_id in enumerate(ids):
+				self._row_of[chunk_id] = start + i
+			self._alive[start:start + len(ids)] = True
+
+	def delete(self, ids):
+		with self._lock:
+			self._mark_deleted(ids)
+			self._conn.commit()
+			if len(self._ids) > INITIAL_CAPACITY and len(self._row_of) < len(self._ids) / 2:
+				self._compact()
+
+	def compact(self):
+		with self._lock:
+			self._compact()
+
+	def _compact(self):
+		# rewrites the live rows contiguously and drops the tombstones
+		rows = np.flatnonzero(self._alive[:len(self._ids)])
+		ids = [self._ids[row] for row in rows]
+		capacity = max(INITIAL_CAPACITY, 2 * len(rows))
+		tmp_path = f"{self._vectors_path}.tmp.npy"
+		compacted = np.lib.format.open_memmap(
+			tmp_path, mode="w+", dtype=np.float32, shape=(capacity, self.dimensions)
+		)
+		compacted[:len(rows)] = self._vectors[rows]
+		compacted.flush()
+		del compacted
+		self._vectors = None
+		self._conn.execute("DELETE FROM rows")
+		self._conn.executemany("INSERT INTO rows (row, id) VALUES (?, ?)", list(enumerate(ids)))
+		# the file is replaced while the transaction is open, so both change together
+		# unless the process dies in between, then `DBManager` rebuilds the index
+		os.replace(tmp_path, self._vectors_path)
+		self._conn.commit()
+		self._vectors = np.load(self._vectors_path, mmap_mode="r+")
+		self._ids = ids
+		self._row_of = {chunk_id: row for row, chunk_id in enumerate(ids)}
+		self._alive = np.zeros(capacity, dtype=bool)
+		self._alive[:len(ids)] = True
+
+	def clear(self):
+		with self._lock:
+			self._conn.execute("DELETE FROM rows")
+			self._conn.commit()
+			self._vectors = None
+			self._vectors = self._create(INITIAL_CAPACITY)
+			self._ids = []
+			self._row_of = {}
+			self._alive = np.zeros(INITIAL_CAPACITY, dtype=bool)
+
+	def search(self, query_vector, k=100, threshold: Optional[float] = None, ids=None) -> List[Tuple[str, float]]:
+		"""
+		Returns the `k` nearest (id, relevance) pairs, best first, with the
+		same relevance as the Chroma path; with `threshold`, only those
+		whose relevance reaches it. With `ids`, only these candidates are
+		scored (e.g. the chunks that match a metadata filter).
+		"""
+		return self.search_batch([query_vector], k=k, threshold=threshold, ids=ids)[0]
+
+	def search_batch(self, query_vectors, k=100, threshold: Optional[float] = None, ids=None) -> List[List[Tuple[str, float]]]:
+		"""
+		Like `search` for many queries at once: the queries are scored in
+		one matrix product per block of `QUERY_BLOCK` queries, so the index
+		is read once per block instead of once per query.
+		"""
+		queries = np.asarray(query_vectors, dtype=np.float32).reshape(-1, self.dimensions)
+		norms = np.linalg.norm(queries, axis=1, keepdims=True)
+		queries = queries / np.where(norms == 0, 1, norms)
+		hits = []
+		with self._lock:
+			n = len(self._ids)
+			if ids is None:
+				# all rows are scored in place, the tombstones are masked afterwards
+				rows = np.arange(n)
+				vectors = self._vectors[:n]
+				deleted = ~self._alive[:n]
+				n_candidates = len(self._row_of)
+			else:
+				rows = np.fromiter(
+					(self._row_of[chunk_id] for chunk_id in ids if chunk_id in self._row_of), dtype=np.int64
+				)
+				rows.sort()	# sequential reads from the memory map
+				vectors = self._vectors[rows]
+				deleted = None
+				n_candidates = len(rows)
+			k = min(k, n_candidates)
+			if not k:
+				return [[] for _ in queries]
+			for block in range(0, len(queries), QUERY_BLOCK):
+				scores = queries[block:block + QUERY_BLOCK] @ vectors.T
+				if deleted is not None:
+					scores[:, deleted] = -np.inf
+				if k < len(rows):
+					top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+				else:
+					top = np.tile(np.arange(len(rows)), (len(scores), 1))
+				for query_scores, query_top in zip(scores, top):
+					query_top = query_top[np.argsort(-query_scores[query_top], kind="stable")]
+					query_top = query_top[np.isfinite(query_scores[query_top])]
+					relevance = relevance_scores(query_scores[query_top].astype(np.float64))
+					if threshold is not None:
+						keep = relevance >= threshold
+						query_top, relevance = query_top[keep], relevance[keep]
+					hits.append([
+						(self._ids[row], float(score))
+						for row, score in zip(rows[query_top], relevance)
+					])
+		return hits
+
+	def __len__(self):
+		return len(self._row_of)
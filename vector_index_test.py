@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+import argparse
+import statistics
+import tempfile
+import time
+import uuid
+
+import chromadb
+import numpy as np
+
+# Importiere den NumPy-Index aus dem Modul.
+from utils.vector_index import NumpyVectorIndex
+
+
+def make_vectors(rng: np.random.Generator, n: int, dim: int, n_clusters: int) -> np.ndarray:
+    """
+    Erzeugt normierte Vektoren, die sich um `n_clusters` Zentren gruppieren
+    (ähnlich wie Chunks aus wenigen Gewerken).
+    """
+    centers = rng.standard_normal((n_clusters, dim)).astype(np.float32)
+    vectors = centers[rng.integers(0, n_clusters, n)] + 0.8 * rng.standard_normal((n, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def percentiles(times):
+    times = sorted(times)
+    return statistics.median(times) * 1000, times[int(0.95 * (len(times) - 1))] * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Vergleicht die exakte Suche im NumPy-Index mit der HNSW-Suche von Chroma (Latenz und Recall)."
+    )
+    parser.add_argument("--chunks", type=int, default=20000, help="Anzahl der Vektoren. Standard: 20000")
+    parser.add_argument("--dim", type=int, default=1536, help="Dimension der Vektoren. Standard: 1536")
+    parser.add_argument("--queries", type=int, default=100, help="Anzahl der Suchanfragen. Standard: 100")
+    parser.add_argument("-k", type=int, default=100, help="Ergebnisse pro Anfrage. Standard: 100")
+    parser.add_argument("--seed", type=int, default=0, help="Startwert des Zufallsgenerators. Standard: 0")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    vectors = make_vectors(rng, args.chunks, args.dim, n_clusters=50)
+    queries = make_vectors(rng, args.queries, args.dim, n_clusters=50)
+    ids = [str(uuid.uuid4()) for _ in range(args.chunks)]
+    metadatas = [{"text": f"Text {i} " * 50, "Dateiname": f"datei_{i % 40}.pdf"} for i in range(args.chunks)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Chroma wie in DBManager: persistente Collection mit Metadaten (inkl. Text)
+        start = time.perf_counter()
+        collection = chromadb.PersistentClient(path=f"{tmp}/chroma").get_or_create_collection(
+            "benchmark", embedding_function=None
+        )
+        for i in range(0, args.chunks, 1000):
+            collection.add(
+                ids=ids[i:i + 1000],
+                embeddings=vectors[i:i + 1000].tolist(),
+                metadatas=metadatas[i:i + 1000],
+                documents=[""] * len(ids[i:i + 1000])
+            )
+        t_build_chroma = time.perf_counter() - start
+
+        start = time.perf_counter()
+        index = NumpyVectorIndex(f"{tmp}/vectors", dimensions=args.dim)
+        for i in range(0, args.chunks, 1000):
+            index.add(ids[i:i + 1000], vectors[i:i + 1000])
+        t_build_numpy = time.perf_counter() - start
+
+        t_chroma, t_numpy, t_numpy_fetch, recalls = [], [], [], []
+        for query in queries:
+            start = time.perf_counter()
+            res = collection.query(
+                query_embeddings=[query.tolist()], n_results=args.k, include=["metadatas", "distances"]
+            )
+            t_chroma.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            hits = index.search(query, k=args.k)
+            t_numpy.append(time.perf_counter() - start)
+            # wie in pipeline.py: nur die Treffer werden aus Chroma gelesen
+            collection.get(ids=[chunk_id for chunk_id, _ in hits], include=["metadatas"])
+            t_numpy_fetch.append(time.perf_counter() - start)
+
+            exact = {chunk_id for chunk_id, _ in hits}
+            recalls.append(len(exact.intersection(res["ids"][0])) / len(exact))
+
+        # Tombstones: die Hälfte löschen, dann wieder suchen
+        start = time.perf_counter()
+        index.delete(ids[::2])
+        t_delete = time.perf_counter() - start
+        deleted = set(ids[::2])
+        leaked = sum(chunk_id in deleted for query in queries[:10] for chunk_id, _ in index.search(query, k=args.k))
+
+    print(f"{args.chunks} Vektoren, {args.dim} Dimensionen, {args.queries} Anfragen, k={args.k}")
+    print(f"Aufbau: Chroma {t_build_chroma:.1f} s, NumPy {t_build_numpy:.1f} s")
+    for name, times in (
+        ("Chroma (HNSW + Metadaten)", t_chroma),
+        ("NumPy (exakt)", t_numpy),
+        ("NumPy + Metadaten aus Chroma", t_numpy_fetch)
+    ):
+        median, p95 = percentiles(times)
+        print(f"{name}: Median {median:.1f} ms, p95 {p95:.1f} ms")
+    print(f"Recall@{args.k} von Chroma gegenüber der exakten Suche: {statistics.mean(recalls):.3f}")
+    print(f"Löschen der Hälfte: {t_delete * 1000:.0f} ms, gelöschte Treffer danach: {leaked}")
+    if leaked:
+        exit(1)
+
+
+if __name__ == '__main__':
+    main()